@@ -1,6 +1,6 @@
 # import logging
 import os
-from competition import neostore
+from competition import journal, neostore, sharedcache, snapshot
 from config import config
 from flask import Flask
 from flask_bootstrap import Bootstrap
@@ -12,10 +12,12 @@ lm = LoginManager()
 lm.login_view = 'main.login'
 
 
-def create_app(config_name):
+def create_app(config_name, tool=False):
     """
     Create an application instance.
     :param config_name: development, test or production
+    :param tool: True for the application of a command line tool. The scoring rules are loaded, but points are not
+    recalculated in the background and the race-day journal is not synced.
     :return: the configured application object.
     """
     app = Flask(__name__)
@@ -25,7 +27,8 @@ def create_app(config_name):
     config[config_name].init_app(app)
 
     # Configure Logger
-    my_env.init_loghandler(__name__, app.config.get('LOGDIR'), app.config.get('LOGLEVEL'))
+    my_env.init_loghandler(__name__, app.config.get('LOGDIR'), app.config.get('LOGLEVEL'),
+                           loglevels=app.config.get('LOGLEVELS'))
 
     # initialize extensions
     bootstrap.init_app(app)
@@ -38,9 +41,32 @@ def create_app(config_name):
         os.environ['Neo4J_Host'] = app.config.get('NEO4J_HOST')
     except TypeError:
         pass
+    # Keep a database session for every request thread.
+    pool_size = app.config.get('NEO4J_POOL_SIZE') or app.config.get('WAITRESS_THREADS')
+    if pool_size:
+        os.environ['Neo4J_PoolSize'] = str(pool_size)
 
     # import blueprints
     from .main import main as main_blueprint
     app.register_blueprint(main_blueprint)
+    # Worker processes share the data version and the page cache.
+    from . import models_graph
+    cache_path = app.config.get('CACHE_PATH')
+    if cache_path:
+        models_graph.set_shared_cache(sharedcache.SharedCache(cache_path))
+    # Finish entries are registered in the race-day journal and applied to Neo4J in the background.
+    journal_path = app.config.get('JOURNAL_PATH')
+    if journal_path and not tool:
+        models_graph.set_journal(journal.Journal(journal_path), app)
+    # Snapshots of the read pages are served if Neo4J is not available.
+    snapshot_path = app.config.get('SNAPSHOT_PATH')
+    if snapshot_path:
+        models_graph.set_snapshots(snapshot.Snapshots(snapshot_path))
+    # Load the scoring rules, points are recalculated if the rules have changed.
+    with app.app_context():
+        if tool:
+            models_graph.load_scoring_rules()
+        else:
+            models_graph.check_scoring_rules()
     # configure production logging of errors
     return app
@@ -0,0 +1,151 @@
+"""
+This class consolidates the background processing of jobs for a race, e.g. the recalculation of points after a
+participant has been added or removed. Jobs run in a worker thread, so the request does not need to wait for the job.
+Multiple requests for the same race are coalesced into a single job.
+"""
+
+import logging
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from flask import current_app
+
+
+class JobQueue:
+
+    def __init__(self, handler, name="jobqueue", max_status=1000):
+        """
+        Method to instantiate the job queue. The worker thread is started on first submit.
+
+        :param handler: Function that will be called with the race nid as argument.
+
+        :param name: Name of the worker thread.
+
+        :param max_status: Maximum number of races for which the status is kept. The status of the oldest finished
+        jobs is removed.
+
+        :return: Object to handle job queue commands.
+        """
+        self.handler = handler
+        self.name = name
+        self.cond = threading.Condition()
+        # Races waiting for processing, with the application object in which the job needs to run.
+        self.pending = OrderedDict()
+        # Job status per race nid, in sequence of request.
+        self.status = OrderedDict()
+        self.max_status = max_status
+        self.running = None
+        self.worker = None
+        return
+
+    def submit(self, race_id):
+        """
+        This method will request a job for the race. If a job for the race is waiting already, then no new job is added.
+        If a job for the race is running, then the job will run once more after the current run, since the current run
+        may have missed the latest change.
+
+        :param race_id: nid of the race.
+
+        :return: Status dictionary for the job.
+        """
+        app = current_app._get_current_object()
+        with self.cond:
+            if race_id not in self.pending:
+                self.pending[race_id] = app
+                self.status.pop(race_id, None)
+                self.status[race_id] = dict(state="queued", requested=datetime.now(), finished=None, error=None)
+            else:
+                logging.debug("Job for race {nid} is queued already".format(nid=race_id))
+            self.start_worker()
+            self.cond.notify()
+            return dict(self.status[race_id])
+
+    def get_status(self, race_id):
+        """
+        This method will return the status of the most recent job for the race.
+
+        :param race_id: nid of the race.
+
+        :return: Dictionary with state (queued, running, done, failed), requested and finished timestamp and error, or
+        False if no job has been requested for the race.
+        """
+        with self.cond:
+            try:
+                return dict(self.status[race_id])
+            except KeyError:
+                return False
+
+    def is_busy(self, race_id):
+        """
+        This method will check if a job for the race is waiting or running.
+
+        :param race_id: nid of the race.
+
+        :return: True if a job is queued or running for the race, False otherwise.
+        """
+        with self.cond:
+            return (race_id in self.pending) or (race_id == self.running)
+
+    def wait(self, timeout=None):
+        """
+        This method will wait until all jobs have been processed. This is for tools and tests that need the results.
+
+        :param timeout: Maximum time in seconds to wait, or None to wait until the queue is empty.
+
+        :return: True if the queue is empty, False if timeout occurred.
+        """
+        with self.cond:
+            return self.cond.wait_for(lambda: not self.pending and self.running is None, timeout=timeout)
+
+    def start_worker(self):
+        """
+        This method will start the worker thread if it is not running. Must be called with the condition acquired.
+
+        :return:
+        """
+        if self.worker is None or not self.worker.is_alive():
+            self.worker = threading.Thread(target=self.run, name=self.name, daemon=True)
+            self.worker.start()
+        return
+
+    def run(self):
+        """
+        This is the worker loop. It will take the oldest waiting race and call the handler within the application
+        context of the request that submitted the job.
+
+        :return:
+        """
+        while True:
+            with self.cond:
+                self.cond.wait_for(lambda: self.pending)
+                race_id, app = self.pending.popitem(last=False)
+                self.running = race_id
+                self.status[race_id]["state"] = "running"
+            state, error = "done", None
+            try:
+                with app.app_context():
+                    self.handler(race_id)
+            except Exception as e:
+                logging.exception("Job for race {nid} failed".format(nid=race_id))
+                state, error = "failed", str(e)
+            with self.cond:
+                self.running = None
+                # A new request may have arrived while running. Then the status remains 'queued'.
+                if race_id not in self.pending:
+                    self.status[race_id].update(state=state, finished=datetime.now(), error=error)
+                    self.evict()
+                self.cond.notify_all()
+
+    def evict(self):
+        """
+        This method will remove the status of the oldest finished jobs if the status is kept for more than max_status
+        races. Must be called with the condition acquired.
+
+        :return:
+        """
+        excess = len(self.status) - self.max_status
+        if excess > 0:
+            finished = [race_id for (race_id, status) in self.status.items() if status["state"] in ("done", "failed")]
+            for race_id in finished[:excess]:
+                del self.status[race_id]
+        return
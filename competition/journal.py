@@ -0,0 +1,312 @@
+"""
+This class consolidates the race-day journal. Finish entries are appended to a local SQLite database, so that the clerk
+does not wait for the Neo4J database. A sync thread applies the entries to Neo4J in order of entry, in batches. Every
+entry has an idempotency key: a form that is submitted twice is registered once.
+
+The sync thread runs in every worker process, a lease in the journal makes sure that one worker applies the entries.
+Entries remain in the journal until they are applied. If Neo4J is not available, the sync thread waits longer before
+each next attempt. An entry that fails too often for another reason is marked as failed. The next entries of the race
+are held until the failed entry is retried, so that an arrival is never added before the previous arrival.
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+
+def database_unavailable(error):
+    """
+    This function will check if the error means that the database is not available, e.g. connection refused or
+    ServiceUnavailable from the Neo4J driver. The check is on class name, so that the journal does not depend on the
+    driver.
+
+    :param error: Exception raised by the handler.
+
+    :return: True if the database is not available, False for other errors.
+    """
+    if isinstance(error, (ConnectionError, TimeoutError)):
+        return True
+    names = ("ServiceUnavailable", "SocketError", "ProtocolError")
+    return any(cls.__name__ in names for cls in type(error).__mro__)
+
+
+class Journal:
+
+    def __init__(self, path, handler=None, batch_size=50, interval=2, lease=30, max_attempts=5, timeout=10,
+                 max_backoff=60):
+        """
+        Method to instantiate the journal. The database is created if it does not exist. The sync thread is started on
+        first append, or by start().
+
+        :param path: Filename of the SQLite database.
+
+        :param handler: Function that applies an entry to Neo4J, called with race_id, person_id, prev_person_id and
+        props. The nids are passed as strings, as the form values, "-1" for the first arrival. The handler must be
+        idempotent: an entry may be applied again after a crash of the sync thread.
+
+        :param batch_size: Number of entries that are taken from the journal in one batch.
+
+        :param interval: Seconds to wait before the next attempt if there are no entries or Neo4J is not available.
+
+        :param lease: Seconds that a worker keeps the sync lease without renewal.
+
+        :param max_attempts: Number of failed attempts before the entry is marked as failed. Attempts while Neo4J is
+        not available are not counted.
+
+        :param timeout: Seconds to wait for a lock held by another worker.
+
+        :param max_backoff: Maximum seconds to wait before the next attempt if Neo4J is not available.
+
+        :return: Object to handle journal commands.
+        """
+        self.path = path
+        self.handler = handler
+        self.batch_size = batch_size
+        self.interval = interval
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self.timeout = timeout
+        self.max_backoff = max_backoff
+        # Seconds to wait before the next attempt, doubled for every attempt while Neo4J is not available.
+        self.delay = interval
+        self.unavailable = database_unavailable
+        self.owner = "{pid}-{token}".format(pid=os.getpid(), token=uuid.uuid4().hex[:8])
+        self.local = threading.local()
+        self.wakeup = threading.Event()
+        self.worker = None
+        self.worker_lock = threading.Lock()
+        # The lease is per worker process, the sync lock serializes sync calls within the process.
+        self.sync_lock = threading.Lock()
+        cur = self.connection()
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS entries
+                (seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                 key TEXT UNIQUE NOT NULL,
+                 race_id TEXT NOT NULL,
+                 person_id TEXT NOT NULL,
+                 prev_person_id TEXT,
+                 props TEXT,
+                 created REAL,
+                 synced REAL,
+                 attempts INTEGER DEFAULT 0,
+                 error TEXT,
+                 failed INTEGER DEFAULT 0)
+        """)
+        cur.execute("CREATE INDEX IF NOT EXISTS entries_pending ON entries (synced, failed, seq)")
+        cur.execute("CREATE TABLE IF NOT EXISTS lease (name TEXT PRIMARY KEY, owner TEXT, expires REAL)")
+        return
+
+    def connection(self):
+        """
+        This method will return the database connection for the current thread. SQLite connections cannot be shared
+        between threads.
+
+        :return: Connection in autocommit mode.
+        """
+        try:
+            return self.local.cnx
+        except AttributeError:
+            cnx = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            cnx.row_factory = sqlite3.Row
+            cnx.execute("PRAGMA journal_mode=WAL")
+            # An entry must survive a power failure of the finish-line laptop.
+            cnx.execute("PRAGMA synchronous=FULL")
+            self.local.cnx = cnx
+            return cnx
+
+    def append(self, race_id, person_id, prev_person_id=None, props=None, key=None):
+        """
+        This method will add a finish entry to the journal. An entry with the same key is registered once.
+
+        :param race_id: nid of the race.
+
+        :param person_id: nid of the person.
+
+        :param prev_person_id: nid of the previous arrival, "-1" for the first arrival.
+
+        :param props: Dictionary with participant properties, e.g. pos.
+
+        :param key: Idempotency key, e.g. from a hidden form field. A new key is created if not provided.
+
+        :return: True if the entry has been added, False if an entry with this key exists already.
+        """
+        key = key or uuid.uuid4().hex
+        cur = self.connection().execute("""
+            INSERT OR IGNORE INTO entries (key, race_id, person_id, prev_person_id, props, created)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, (key, race_id, person_id, None if prev_person_id is None else str(prev_person_id),
+              json.dumps(props or {}), time.time()))
+        self.start()
+        self.wakeup.set()
+        return cur.rowcount == 1
+
+    def pending(self, race_id=None, limit=None, held=True):
+        """
+        This method will return the entries that have not been applied yet, in sequence of entry.
+
+        :param race_id: nid of the race, or None for entries of all races.
+
+        :param limit: Maximum number of entries, or None for all entries.
+
+        :param held: False to skip the entries of races with a failed entry.
+
+        :return: List of dictionaries with seq, key, race_id, person_id, prev_person_id, props, attempts and error.
+        """
+        query = """
+            SELECT seq, key, race_id, person_id, prev_person_id, props, attempts, error FROM entries
+            WHERE synced IS NULL AND failed = 0 AND (? IS NULL OR race_id = ?)
+            AND (? OR race_id NOT IN (SELECT race_id FROM entries WHERE failed = 1))
+            ORDER BY seq LIMIT ?
+        """
+        return self.entries(query, (race_id, race_id, int(held), -1 if limit is None else limit))
+
+    def failed(self, race_id=None):
+        """
+        This method will return the entries that are marked as failed, in sequence of entry.
+
+        :param race_id: nid of the race, or None for entries of all races.
+
+        :return: List of dictionaries with seq, key, race_id, person_id, prev_person_id, props, attempts and error.
+        """
+        query = """
+            SELECT seq, key, race_id, person_id, prev_person_id, props, attempts, error FROM entries
+            WHERE failed = 1 AND (? IS NULL OR race_id = ?)
+            ORDER BY seq
+        """
+        return self.entries(query, (race_id, race_id))
+
+    def retry(self, race_id):
+        """
+        This method will reset the failed entries of the race, so that the entries of the race are applied again.
+
+        :param race_id: nid of the race.
+
+        :return: Number of entries that have been reset.
+        """
+        cur = self.connection().execute("UPDATE entries SET failed = 0, attempts = 0 WHERE failed = 1 AND race_id = ?",
+                                        (race_id,))
+        self.wakeup.set()
+        return cur.rowcount
+
+    def entries(self, query, params):
+        """
+        This method will return the journal entries for the query.
+
+        :param query: Query on the entries table.
+
+        :param params: Query parameters.
+
+        :return: List of dictionaries, props converted from JSON.
+        """
+        rows = self.connection().execute(query, params).fetchall()
+        res = []
+        for row in rows:
+            entry = dict(row)
+            entry["props"] = json.loads(entry["props"])
+            res.append(entry)
+        return res
+
+    def status(self):
+        """
+        This method will return the number of entries per state.
+
+        :return: Dictionary with pending, synced and failed counts. Held is the number of pending entries that wait for
+        a failed entry of the race.
+        """
+        (pending, synced, failed, held) = self.connection().execute("""
+            SELECT coalesce(sum(synced IS NULL AND failed = 0), 0), coalesce(sum(synced IS NOT NULL), 0),
+                   coalesce(sum(failed), 0),
+                   coalesce(sum(synced IS NULL AND failed = 0
+                                AND race_id IN (SELECT race_id FROM entries WHERE failed = 1)), 0)
+            FROM entries
+        """).fetchone()
+        return dict(pending=pending, synced=synced, failed=failed, held=held)
+
+    def acquire_lease(self):
+        """
+        This method will take or renew the sync lease for this worker. The lease is taken if it is free, if it
+        expired or if this worker has the lease already.
+
+        :return: True if this worker has the lease.
+        """
+        now = time.time()
+        cnx = self.connection()
+        with cnx:
+            cnx.execute("BEGIN IMMEDIATE")
+            cnx.execute("INSERT OR IGNORE INTO lease (name, owner, expires) VALUES ('sync', NULL, 0)")
+            cur = cnx.execute("""
+                UPDATE lease SET owner = ?, expires = ?
+                WHERE name = 'sync' AND (owner = ? OR expires < ?)
+            """, (self.owner, now + self.lease, self.owner, now))
+        return cur.rowcount == 1
+
+    def sync(self):
+        """
+        This method will apply a batch of pending entries in sequence of entry. The batch stops at the first entry
+        that fails, so that the next arrivals are not applied before the previous arrival. Entries of races with a
+        failed entry are held. The lease is renewed before every entry, so that no other worker takes an expired lease
+        and applies the same entries.
+
+        :return: Number of entries that have been applied, or None if another worker has the sync lease.
+        """
+        with self.sync_lock:
+            if not self.acquire_lease():
+                return None
+            cnx = self.connection()
+            cnt = 0
+            backoff = self.delay
+            self.delay = self.interval
+            for entry in self.pending(limit=self.batch_size, held=False):
+                if cnt and not self.acquire_lease():
+                    logging.warning("Journal sync lease lost, batch stopped")
+                    break
+                try:
+                    self.handler(entry["race_id"], entry["person_id"], entry["prev_person_id"], entry["props"])
+                except Exception as e:
+                    if self.unavailable(e):
+                        self.delay = min(backoff * 2, self.max_backoff)
+                        logging.warning("Neo4J not available, journal entry {seq} retried in {d} seconds"
+                                        .format(seq=entry["seq"], d=self.delay))
+                        cnx.execute("UPDATE entries SET error = ? WHERE seq = ?", (str(e), entry["seq"]))
+                        break
+                    attempts = entry["attempts"] + 1
+                    logging.exception("Journal entry {seq} failed, attempt {a}".format(seq=entry["seq"], a=attempts))
+                    cnx.execute("UPDATE entries SET attempts = ?, error = ?, failed = ? WHERE seq = ?",
+                                (attempts, str(e), int(attempts >= self.max_attempts), entry["seq"]))
+                    break
+                cnx.execute("UPDATE entries SET synced = ?, error = NULL WHERE seq = ?", (time.time(), entry["seq"]))
+                cnt += 1
+            return cnt
+
+    def start(self):
+        """
+        This method will start the sync thread if it is not running.
+
+        :return:
+        """
+        with self.worker_lock:
+            if self.handler and (self.worker is None or not self.worker.is_alive()):
+                self.worker = threading.Thread(target=self.run, name="journal", daemon=True)
+                self.worker.start()
+        return
+
+    def run(self):
+        """
+        This is the sync loop. Full batches are followed by the next batch immediately, otherwise the loop waits for
+        a new entry or for the interval. The wait is longer while Neo4J is not available.
+
+        :return:
+        """
+        while True:
+            try:
+                cnt = self.sync()
+            except Exception:
+                logging.exception("Journal sync failed")
+                cnt = None
+            if cnt != self.batch_size:
+                self.wakeup.wait(self.delay)
+                self.wakeup.clear()
@@ -1,4 +1,5 @@
 from flask_wtf import FlaskForm as Form
+from flask_wtf.file import FileField, FileRequired
 from wtforms import StringField, SubmitField, PasswordField, BooleanField, SelectField, RadioField, HiddenField
 from wtforms import SelectMultipleField
 from wtforms.fields.html5 import DateField
@@ -19,6 +20,12 @@ class PersonAdd(Form):
     submit = SubmitField('OK')
 
 
+class PersonImport(Form):
+    persons = FileField('Bestand (csv of json): ', validators=[FileRequired()])
+    dry_run = BooleanField('Enkel controleren')
+    submit = SubmitField('OK')
+
+
 class OrganizationAdd(Form):
     name = StringField('Naam', validators=[wtv.InputRequired(), wtv.Length(1, 24)])
     location = SelectField('Locatie: ', coerce=str)
@@ -45,6 +52,8 @@ class ParticipantAdd(Form):
     pos = StringField('Plaats')
     # remark = StringField('Opm.')
     prev_runner = SelectField('Aankomst na:', coerce=str)
+    # Idempotency key for the race-day journal, a form that is submitted twice is registered once.
+    entry_key = HiddenField()
     submit = SubmitField('OK')
 
 
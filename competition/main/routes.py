@@ -1,10 +1,16 @@
 import competition.models_graph as mg
+import time
+import uuid
+from competition import pagecache, snapshot
 # import logging
 # import datetime
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from functools import wraps
 from lib import my_env
 # from lib import neostore
-from flask import render_template, flash, current_app, redirect, url_for, request
-from flask_login import login_required, login_user, logout_user
+from flask import render_template, flash, current_app, redirect, url_for, request, jsonify, Response
+from flask import make_response, session, stream_with_context, copy_current_request_context
+from flask_login import login_required, login_user, logout_user, current_user
 from .forms import *
 from . import main
 # from ..models_sql import User
@@ -18,6 +24,213 @@ released for pip and it may not be required at all: the data may not always be a
 part_config_props = ["pos"]
 
 
+@main.before_app_request
+def begin_version_batch():
+    """
+    The writes of a request are one change of the data version, see NeoStore.begin_version_batch().
+    """
+    mg.ns.begin_version_batch()
+
+
+@main.teardown_app_request
+def end_version_batch(exc):
+    """
+    The data version is incremented at the end of the request, also if the request failed after a write.
+    """
+    try:
+        mg.ns.end_version_batch()
+    except Exception:
+        current_app.logger.exception("Data version not incremented")
+
+
+def conditional_get(f):
+    """
+    This decorator will answer a read route with 304 Not Modified if the data did not change since the client's last
+    load. The ETag is the data version of the neostore combined with the login status, since the pages show actions for
+    logged in users. The data version is a counter in the process or in the shared cache, so the Neo4J database is not
+    queried and no template is rendered for a 304 response.
+    Pages with pending flash messages are always rendered.
+
+    :param f: Route function.
+
+    :return: Decorated route function.
+    """
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        if session.get('_flashes'):
+            return f(*args, **kwargs)
+        (version, modified) = mg.ns.get_version()
+        etag = "{v}-{a}".format(v=version, a=int(current_user.is_authenticated))
+        if request.if_none_match:
+            not_modified = etag in request.if_none_match
+        else:
+            not_modified = request.if_modified_since is not None and modified <= request.if_modified_since
+        if not_modified:
+            response = Response(status=304)
+        else:
+            response = make_response(f(*args, **kwargs))
+            response.last_modified = modified
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
+    return decorated
+
+
+# Cache for the rendered pages that are most expensive to render, see cached_page.
+page_cache = pagecache.PageCache()
+
+
+def cached_page(f):
+    """
+    This decorator will return the rendered page from the page cache if it was rendered for the current data version.
+    The page is rendered and added to the cache otherwise. The cache key is the route with its arguments and the login
+    status. The key includes the request arguments, e.g. season. Pages with pending flash messages are not cached.
+    With multiple worker processes the pages are kept in the shared cache.
+
+    :param f: Route function, returning the rendered page.
+
+    :return: Decorated route function.
+    """
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        if session.get('_flashes'):
+            return f(*args, **kwargs)
+        (version, _) = mg.ns.get_version()
+        key = (request.endpoint, tuple(sorted(kwargs.items())), tuple(sorted(request.args.items())),
+               current_user.is_authenticated)
+        cache = mg.shared_cache or page_cache
+        page = cache.get(key, version)
+        if not page:
+            page = f(*args, **kwargs)
+            cache.put(key, version, page)
+        return page
+    return decorated
+
+
+# Snapshots of the read pages, served if Neo4J is not available. See snapshot_fallback.
+page_snapshots = snapshot.Snapshots()
+# Pages are rendered in these threads, so that the request does not wait longer than the latency budget.
+render_pool = ThreadPoolExecutor(max_workers=4)
+# After a failure the snapshots are served without trying Neo4J until this time.
+neo4j_retry_at = 0
+
+
+def snapshot_fallback(f):
+    """
+    This decorator will answer a read route with the latest snapshot of the page if Neo4J is not available, or if
+    the page is not rendered within the latency budget (FALLBACK_BUDGET seconds, default 2). The snapshot shows the
+    time it was rendered. A render that exceeds the budget continues in the background and updates the snapshot.
+    After a failure, pages with a snapshot are not rendered for FALLBACK_RETRY seconds (default 10). Pages without
+    snapshot are always rendered.
+
+    :param f: Route function.
+
+    :return: Decorated route function.
+    """
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        global neo4j_retry_at
+        store = mg.snapshots or page_snapshots
+        # Login status from the session, current_user may need Neo4J to load the user.
+        key = (request.endpoint, tuple(sorted(kwargs.items())), tuple(sorted(request.args.items())),
+               'user_id' in session)
+        if store.version(key) is None:
+            return render_snapshot(f, store, key, *args, **kwargs)
+        if time.time() < neo4j_retry_at:
+            return snapshot_response(store.get(key))
+        future = render_pool.submit(copy_current_request_context(render_snapshot), f, store, key, *args, **kwargs)
+        try:
+            return future.result(timeout=current_app.config.get('FALLBACK_BUDGET', 2))
+        except TimeoutError:
+            current_app.logger.warning("Page {key} not rendered within budget, snapshot returned".format(key=key))
+        except Exception:
+            current_app.logger.exception("Page {key} not rendered, snapshot returned".format(key=key))
+        neo4j_retry_at = time.time() + current_app.config.get('FALLBACK_RETRY', 10)
+        return snapshot_response(store.get(key))
+    return decorated
+
+
+def render_snapshot(f, store, key, *args, **kwargs):
+    """
+    This function will render the page and keep the page as snapshot. Pages with flash messages are not kept.
+
+    :param f: Route function.
+
+    :param store: Snapshots object.
+
+    :param key: Key of the page.
+
+    :return: Response.
+    """
+    flashes = session.get('_flashes')
+    (version, _) = mg.ns.get_version()
+    response = make_response(f(*args, **kwargs))
+    if response.status_code == 200 and not flashes:
+        store.put(key, version, response.get_data(as_text=True))
+    return response
+
+
+def snapshot_response(snap):
+    """
+    This function will return the snapshot of a page, with a notice that the data may not be up to date. The response
+    is not cached by the client.
+
+    :param snap: Snapshot tuple (page, version, rendered) from Snapshots.get().
+
+    :return: Response.
+    """
+    (page, _, rendered) = snap
+    notice = '<div class="alert alert-warning">De databank is niet bereikbaar, stand van {ts}.</div>'\
+        .format(ts=rendered.strftime("%d/%m/%Y %H:%M"))
+    response = make_response(page.replace("<!-- snapshot -->", notice, 1))
+    response.headers['Warning'] = '110 - "Response is Stale"'
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+
+def page_args(*keys):
+    """
+    This function will return the filters and the page key (after) for a paginated list from the request arguments.
+
+    :param keys: Names of the filter arguments.
+
+    :return: Dictionary with page key and filter values, None for arguments that are not set.
+    """
+    return {key: request.args.get(key) or None for key in ("after",) + keys}
+
+
+def page_urls(filters, next_after):
+    """
+    This function will return the links to the first page and to the next page of a paginated list. The filters are
+    kept in the links.
+
+    :param filters: Dictionary with page key and filter values, see page_args().
+
+    :param next_after: Key for the next page, or None if this is the last page.
+
+    :return: Tuple (url for first page or None if this is the first page, url for next page or None).
+    """
+    args = dict(request.view_args)
+    args.update((key, value) for key, value in filters.items() if value and key != "after")
+    first_url = url_for(request.endpoint, **args) if filters["after"] else None
+    next_url = url_for(request.endpoint, after=next_after, **args) if next_after else None
+    return first_url, next_url
+
+
+def person_page():
+    """
+    This function will return the page of the person list for the request arguments, with the parameters for the
+    person_list and person_filter macros.
+
+    :return: Dictionary with template parameters persons, filters, categories, filter_url, first_url and next_url.
+    """
+    filters = page_args("cat", "mf", "prefix", "season")
+    (persons, next_after) = mg.person_page(**filters)
+    (first_url, next_url) = page_urls(filters, next_after)
+    return dict(persons=persons, filters=filters, categories=mg.get_category_list(),
+                filter_url=url_for(request.endpoint, **request.view_args), first_url=first_url, next_url=next_url)
+
+
 @main.route('/login', methods=['GET', 'POST'])
 def login():
     form = Login()
@@ -82,8 +295,7 @@ def person_add(person_id=None):
         else:
             form = PersonAdd()
         form.category.choices = mg.get_category_list()
-        persons = mg.person_list()
-        return render_template('person_add.html', form=form, persons=persons)
+        return render_template('person_add.html', form=form, **person_page())
     else:
         # request.method == "POST":
         form = PersonAdd()
@@ -117,10 +329,54 @@ def person_edit(pers_id):
     return person_add(person_id=pers_id)
 
 
+@main.route('/person/import', methods=['GET', 'POST'])
+@login_required
+def person_import():
+    """
+    This method will register the persons from a CSV or JSON file. The CSV file has a header line with columns name,
+    mf and category. With dry run the file is validated, but the persons are not created.
+
+    :return: Import form, with the created persons and the conflicts after a file has been submitted.
+    """
+    form = PersonImport()
+    report = None
+    if form.validate_on_submit():
+        upload = form.persons.data
+        fmt = "json" if upload.filename.lower().endswith(".json") else "csv"
+        try:
+            rows = mg.person_import_rows(upload.read().decode("utf-8-sig"), fmt=fmt)
+        except ValueError as e:
+            flash("Bestand kan niet gelezen worden: {e}".format(e=e), "error")
+        else:
+            report = mg.person_import(rows, dry_run=form.dry_run.data)
+            if report["conflicts"]:
+                flash("{cnt} conflicten, niet toegevoegd.".format(cnt=len(report["conflicts"])), "warning")
+    return render_template('person_import.html', form=form, report=report)
+
+
 @main.route('/person/list')
+@snapshot_fallback
+@conditional_get
 def person_list():
-    persons = mg.person_list()
-    return render_template('person_list.html', persons=persons)
+    return render_template('person_list.html', **person_page())
+
+
+@main.route('/api/person/search', methods=['GET'])
+def person_search():
+    """
+    This method will return the persons with a name that matches the search string, for typeahead in the forms.
+    Request arguments are q (search string), k (maximum number of persons, default 10, at most 50) and race_id
+    (optional, only persons that can be added to the race).
+
+    :return: JSON list with nid and name for the matching persons, best match first.
+    """
+    query = request.args.get("q", "")
+    try:
+        limit = min(int(request.args.get("k", 10)), 50)
+    except ValueError:
+        limit = 10
+    race_id = request.args.get("race_id") or None
+    return jsonify(mg.person_search(query, limit=limit, race_id=race_id))
 
 
 @main.route('/person/<pers_id>')
@@ -136,8 +392,7 @@ def person_summary(pers_id):
     races = mg.races4person(pers_id)
     # Don't count on len(races), since this is competition races. Remove person only if not used across all
     # competitions.
-    persons = mg.person_list()
-    return render_template('person_races_list.html', person=person_dict, races=races, persons=persons)
+    return render_template('person_races_list.html', person=person_dict, races=races, **person_page())
 
 
 @main.route('/person/<pers_id>/delete')
@@ -156,14 +411,21 @@ def person_delete(pers_id):
         current_app.logger.warning("Request to delete id {pers_id} but person participates in races"
                                    .format(pers_id=pers_id))
     else:
-        mg.remove_node_force(pers_id)
+        mg.remove_person(pers_id)
     return redirect(url_for('main.person_list'))
 
 
 @main.route('/organization/list')
+@snapshot_fallback
+@conditional_get
 def organization_list():
-    organizations = mg.organization_list()
-    return render_template('organization_list.html', organizations=organizations)
+    filters = page_args("season", "prefix")
+    season = filters["season"] or mg.current_season()
+    (organizations, next_after) = mg.organization_page(after=filters["after"], season=season,
+                                                       prefix=filters["prefix"])
+    (first_url, next_url) = page_urls(filters, next_after)
+    return render_template('organization_list.html', organizations=organizations, season=season,
+                           seasons=mg.season_list(), filters=filters, first_url=first_url, next_url=next_url)
 
 
 @main.route('/organization/add', methods=['GET', 'POST'])
@@ -258,6 +520,7 @@ def organization_delete(org_id):
 
 
 @main.route('/race/<org_id>/list')
+@snapshot_fallback
 def race_list(org_id):
     """
     This method will manage races with an organization. It will get the organization object based on ID. Then it will
@@ -373,6 +636,7 @@ def race_edit(org_id, race_id):
 
 
 @main.route('/participant/<race_id>/list', methods=['GET'])
+@snapshot_fallback
 def participant_list(race_id):
     """
     This method will show the participants in sequence of arrival for a race.
@@ -383,7 +647,8 @@ def participant_list(race_id):
     param_dict = dict(
         race_label=race.get_label(),
         org_id=race.get_org_id(),
-        race_id=race_id
+        race_id=race_id,
+        points_busy=mg.points_queue.is_busy(race_id)
     )
     finishers = mg.participant_seq_list(race_id)
     if finishers:
@@ -391,6 +656,20 @@ def participant_list(race_id):
     return render_template('participant_list.html', **param_dict)
 
 
+@main.route('/participant/<race_id>/stream', methods=['GET'])
+def participant_stream(race_id):
+    """
+    This method will stream the finishers of the race as Server-Sent Events. An event is sent each time the points for
+    the race have been calculated.
+
+    :param race_id: ID of the race.
+
+    :return: text/event-stream response.
+    """
+    channel = "race:{race_id}".format(race_id=race_id)
+    return event_stream(channel)
+
+
 @main.route('/participant/<race_id>/add', methods=['GET', 'POST'])
 @login_required
 def participant_add(race_id):
@@ -403,37 +682,63 @@ def participant_add(race_id):
 
     :return: The person is added or modified as a participant to the race.
     """
-    race = mg.Race(race_id=race_id)
-    race_label = race.get_label()
     if request.method == "POST":
         # Call form to get input values
         form = ParticipantAdd()
         # Add collected info as participant to race.
         runner_id = form.name.data
         prev_runner_id = form.prev_runner.data
-        # Create the participant node, connect to person and to race.
-        part = mg.Participant(race_id=race_id, person_id=runner_id, prev_person_id=prev_runner_id)
+        # The names are not in the form choices, so the person is checked here.
+        pending = mg.journal.pending(race_id=race_id) + mg.journal.failed(race_id=race_id) if mg.journal else []
+        if runner_id not in mg.race_candidates(race_id) or runner_id in [entry["person_id"] for entry in pending]:
+            flash("Selecteer een deelnemer die nog niet aan de wedstrijd deelneemt.", "warning")
+            return redirect(url_for('main.participant_add', race_id=race_id))
         # Collect properties for this participant so that they can be added to the participant node.
         props = {}
         for prop in part_config_props:
             if form.data[prop]:
                 props[prop] = form.data[prop]
-        part.set_props(**props)
+        if mg.journal:
+            # Register the entry in the race-day journal, the sync thread will add the participant.
+            mg.journal.append(race_id, runner_id, prev_runner_id, props, key=form.entry_key.data or None)
+        else:
+            # Create the participant node, connect to person and to race.
+            part = mg.Participant(race_id=race_id, person_id=runner_id, prev_person_id=prev_runner_id)
+            if part.part_node:
+                part.set_props(**props)
+            else:
+                flash("Deelnemer niet toegevoegd, de wedstrijd werd tegelijk aangepast. Probeer opnieuw.", "error")
         return redirect(url_for('main.participant_add', race_id=race_id))
     else:
         # Get method, initialize page.
+        race = mg.Race(race_id=race_id)
+        race_label = race.get_label()
         org_id = race.get_org_id()
-        part_last = mg.participant_last_id(race_id)
+        after_list = mg.participant_after_list(race_id)
+        # Entries in the journal are not yet participants, but the next arrival is after the last entry.
+        pending = mg.journal.pending(race_id=race_id) if mg.journal else []
+        # Failed entries hold the next entries of the race until they are retried.
+        failed = mg.journal.failed(race_id=race_id) if mg.journal else []
+        names = mg.person_names([entry["person_id"] for entry in failed + pending])
+        pending_ids = set(entry["person_id"] for entry in failed + pending)
+        after_list.extend([entry["person_id"], names.get(entry["person_id"], entry["person_id"])]
+                          for entry in sorted(failed + pending, key=lambda entry: entry["seq"]))
         # Initialize Form
-        form = ParticipantAdd(prev_runner=part_last)
-        next_part_nodes = race.get_next_part()
-        form.name.choices = [(x["nid"], x["name"]) for x in next_part_nodes]
-        form.prev_runner.choices = mg.participant_after_list(race_id)
+        form = ParticipantAdd(prev_runner=after_list[-1][0], entry_key=uuid.uuid4().hex)
+        # The names are filled in by the typeahead, from the person search. The persons that can be added to the race
+        # are calculated once for the page, not for every key stroke.
+        mg.race_candidates(race_id)
+        form.name.choices = []
+        form.prev_runner.choices = after_list
         param_dict = dict(
             form=form,
             race_id=race_id,
             race_label=race_label,
-            org_id=org_id
+            org_id=org_id,
+            points_busy=mg.points_queue.is_busy(race_id),
+            pending=[names.get(entry["person_id"], entry["person_id"]) for entry in pending],
+            pending_ids=sorted(pending_ids),
+            failed=[(names.get(entry["person_id"], entry["person_id"]), entry["error"]) for entry in failed]
         )
         finishers = mg.participant_seq_list(race_id)
         if finishers:
@@ -441,6 +746,54 @@ def participant_add(race_id):
         return render_template('participant_add.html', **param_dict)
 
 
+@main.route('/race/<race_id>/points_status', methods=['GET'])
+def race_points_status(race_id):
+    """
+    This method will return the status of the points calculation for the race.
+
+    :param race_id: ID of the race.
+
+    :return: JSON with state (queued, running, done, failed or none), requested and finished timestamp.
+    """
+    status = mg.points_queue.get_status(race_id)
+    if not status:
+        status = dict(state="none", requested=None, finished=None, error=None)
+    for ts in ["requested", "finished"]:
+        if status[ts]:
+            status[ts] = status[ts].strftime("%H:%M:%S")
+    return jsonify(status)
+
+
+@main.route('/journal/<race_id>/retry', methods=['GET', 'POST'])
+@login_required
+def journal_retry(race_id):
+    """
+    This method will apply the failed journal entries of the race again, followed by the entries that were held.
+
+    :param race_id: ID of the race.
+
+    :return: Participant add page for the race.
+    """
+    if mg.journal and mg.journal.retry(race_id):
+        flash("Mislukte deelnemers worden opnieuw verwerkt.", "info")
+    return redirect(url_for('main.participant_add', race_id=race_id))
+
+
+@main.route('/journal/status', methods=['GET'])
+def journal_status():
+    """
+    This method will return the status of the race-day journal.
+
+    :return: JSON with the number of pending, synced, failed and held entries, or enabled False if there is no
+    journal.
+    """
+    if not mg.journal:
+        return jsonify(dict(enabled=False))
+    status = mg.journal.status()
+    status["enabled"] = True
+    return jsonify(status)
+
+
 @main.route('/participant/edit/<part_id>', methods=['GET', 'POST'])
 @login_required
 def participant_edit(part_id):
@@ -507,39 +860,91 @@ def participant_remove(race_id, pers_id):
         if form.submit_ok.data:
     """
     part = mg.Participant(race_id=race_id, person_id=pers_id)
-    part.remove()
+    if not part.remove():
+        flash("Wedstrijd is gewijzigd door een andere gebruiker, deelnemer niet verwijderd.", "warning")
     return redirect(url_for('main.participant_add', race_id=race_id))
 
 
 @main.route('/result_select_cat/<mf>', methods=['GET'])
+@snapshot_fallback
 def result_select_cat(mf):
     params = dict(
         categories=mg.get_category_list(),
-        mf=mf
+        mf=mf,
+        season=request.args.get('season')
     )
     return render_template("result_select_cat.html", **params)
 
 
 @main.route('/result/<mf>/<cat>/', methods=['GET'])
 @main.route('/result/<mf>/<cat>/<person_id>')
+@snapshot_fallback
+@conditional_get
+@cached_page
 def results(mf, cat, person_id=None):
-    result_set = mg.results_for_category(mf=mf, cat=cat)
+    season = request.args.get('season')
+    result_set = mg.results_for_category(mf=mf, cat=cat, season=season)
     cat_name = mg.get_category_name(cat)
     param_dict = dict(
         result_set=result_set,
         cat_nid=cat,
         cat=cat_name,
-        mf=mf
+        mf=mf,
+        season=season,
+        # Live updates are published for the current season only.
+        live=not season or season == mg.current_season()
     )
     if person_id:
-        races = mg.races4person(person_id)
+        races = mg.races4person(person_id, season=season)
         person = mg.Person(person_id)
         person_dict = person.get_dict()
         param_dict["races"] = races
         param_dict["person"] = person_dict
     return render_template("result_list.html", **param_dict)
 
+
+@main.route('/result/<mf>/<cat>/stream', methods=['GET'])
+def results_stream(mf, cat):
+    """
+    This method will stream the standings for mf and category as Server-Sent Events. An event is sent each time the
+    points for a race in the category have been calculated.
+
+    :param mf: Dames OR Heren
+
+    :param cat: nid of the category
+
+    :return: text/event-stream response.
+    """
+    channel = "result:{mf}:{cat}".format(mf=mf, cat=cat)
+    return event_stream(channel)
+
+
+def event_stream(channel):
+    """
+    This method will return the Server-Sent Events response for the channel. Every stream holds a request thread, so
+    the number of streams per process is limited (STREAM_MAX, default 50) and a stream is closed after STREAM_LIFETIME
+    seconds (default 300). The server is started with STREAM_MAX threads on top of WAITRESS_THREADS, see wolse.py.
+
+    :param channel: Name of the publisher channel.
+
+    :return: text/event-stream response, or 503 response if the maximum number of streams is open.
+    """
+    stream = mg.changes.stream(channel, lifetime=current_app.config.get('STREAM_LIFETIME', 300),
+                               max_streams=current_app.config.get('STREAM_MAX', 50))
+    if stream is None:
+        # Keep request threads available for the pages, the browser connects again later.
+        return Response("Too many live streams", status=503, headers={"Retry-After": "30"})
+    headers = {
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no"
+    }
+    return Response(stream_with_context(stream), mimetype="text/event-stream", headers=headers)
+
+
 @main.route('/overview/<mf>', methods=['GET'])
+@snapshot_fallback
+@conditional_get
+@cached_page
 def overview(mf):
     """
     This method shows the results in detail. For every person the result in every race will be shown. Note that
@@ -549,8 +954,9 @@ def overview(mf):
     :return: The Overview list receives the list of races, the result_set with participants in arrival sequence and a
     dictionary with person nid as key. Value is a dictionary the race results per person.
     """
-    org_list = mg.organization_list()
-    result_seq = mg.results_for_mf(mf)
+    season = request.args.get('season')
+    org_list = mg.organization_list(season=season)
+    result_seq = mg.results_for_mf(mf, season=season)
     param_dict = dict(
         org_list=org_list,
         result_set=result_seq,
@@ -560,7 +966,7 @@ def overview(mf):
     # Person nid is 4th element in the tuple
     for person_res in result_seq:
         person_nid = person_res[3]
-        races = mg.races4person_org(person_nid)
+        races = mg.races4person_org(person_nid, season=season)
         result4person[person_nid] = races
     param_dict['result4person'] = result4person
     return render_template("overview_list.html", **param_dict)
@@ -1,7 +1,12 @@
+import csv
 import datetime
+import io
+import json
 import os
+import threading
+from collections import OrderedDict
 from . import lm
-from competition import neostore
+from competition import jobqueue, neostore, personsearch, publisher, scoring
 from flask import current_app
 from flask_login import UserMixin
 from py2neo.types import *
@@ -15,6 +20,9 @@ neo4j_params = dict(
 host=os.environ.get("Neo4J_Host")
 if isinstance(host, str):
     neo4j_params['host'] = host
+pool_size = os.environ.get("Neo4J_PoolSize")
+if isinstance(pool_size, str):
+    neo4j_params['pool_size'] = int(pool_size)
 ns = neostore.NeoStore(**neo4j_params)
 
 # Define Node Labels
@@ -42,11 +50,41 @@ mf_tx = dict(
 # mf_tx_inf translates from Node name to man/vrouw value.
 mf_tx_inv = {y: x for x, y in mf_tx.items()}
 
-# Calculate points
-points_per_deelname = 20
-bonus_pk = 3
-bonus_bk = 5
-bonus_mbk = -10
+# Calculate points. The rules can be replaced by the SCORING_RULES configuration, see check_scoring_rules().
+scoring_rules = scoring.ScoringRules()
+
+# A season starts in July. Organizations before July belong to the season of the previous year.
+season_start_month = 7
+# Current season for the data version, see current_season().
+season_cache = {}
+# Organizations without season and races or participants without derived attributes are updated by migrate(), see
+# tools/derived.py.
+
+# Write serialization for the arrival chain of a race. Writers in this process queue on the race lock, writers in
+# other processes are detected by the version counter on the Race node.
+race_locks = {}
+race_locks_guard = threading.Lock()
+race_write_retries = 5
+
+# Cache for the logged in users, so that authenticated requests do not need a database lookup. See load_user().
+user_cache = OrderedDict()
+user_cache_lock = threading.Lock()
+user_cache_size = 32
+user_cache_generation = None
+
+# Cache shared by the worker processes, see set_shared_cache().
+shared_cache = None
+
+# Race-day journal for finish entries, see set_journal().
+journal = None
+# Shared snapshot store for the read pages, see set_snapshots().
+snapshots = None
+
+# Search index on person names, reloaded when the data version changes. See person_search().
+person_index = personsearch.PersonIndex()
+# Persons that can be added to a race for the data version, see race_candidates().
+race_candidates_cache = {}
+
 
 class User(UserMixin):
     """
@@ -96,8 +134,28 @@ class User(UserMixin):
                 pwd=generate_password_hash(password)
             )
             user_node = ns.create_node(label, **props)
+            user_cache_clear()
             return user_node["nid"]
 
+    def set_password(self, password):
+        """
+        This method will set a new password for the user. The user is removed from the user cache.
+
+        :param password: New password.
+
+        :return: True if the password is set, False if the user is not defined.
+        """
+        if not isinstance(self.user_node, Node):
+            return False
+        props = dict(
+            nid=self.user_node["nid"],
+            pwd=generate_password_hash(password)
+        )
+        ns.node_set_attribs(**props)
+        self.user_node["pwd"] = props["pwd"]
+        user_cache_clear(self.user_node["nid"])
+        return True
+
     def validate_password(self, name, pwd):
         """
         Find the user. If the user exists, verify the password. If the passwords match, return nid of the User node.
@@ -120,18 +178,141 @@ class User(UserMixin):
 def load_user(user_id):
     """
     This function will return the User object. user_id is the nid of the User node.
+    The user object is kept in a least recently used cache, so the User node is read only on first request.
     :param user_id: nid of the user node.
     :return: user object.
     """
-    return User(user_id)
+    user_cache_check()
+    with user_cache_lock:
+        try:
+            user = user_cache[user_id]
+        except KeyError:
+            pass
+        else:
+            user_cache.move_to_end(user_id)
+            return user
+    user = User(user_id)
+    if isinstance(user.user_node, Node):
+        with user_cache_lock:
+            user_cache[user_id] = user
+            while len(user_cache) > user_cache_size:
+                user_cache.popitem(last=False)
+    return user
+
+
+def user_cache_clear(user_id=None):
+    """
+    This function will remove the user from the user cache, or clear the user cache if no user is specified.
+    Other worker processes clear their user cache on next use.
+    :param user_id: nid of the user node, or None to clear all users.
+    :return:
+    """
+    with user_cache_lock:
+        if user_id:
+            user_cache.pop(user_id, None)
+        else:
+            user_cache.clear()
+    if shared_cache:
+        shared_cache.bump_version("users")
+    return
+
+
+def user_cache_check():
+    """
+    This function will clear the user cache if users have been changed in another worker process.
+    :return:
+    """
+    global user_cache_generation
+    if not shared_cache:
+        return
+    (generation, _) = shared_cache.get_version("users")
+    with user_cache_lock:
+        if generation != user_cache_generation:
+            user_cache.clear()
+            user_cache_generation = generation
+    return
+
+
+def set_shared_cache(cache):
+    """
+    This function will use the cache that is shared by the worker processes for the data version, the user cache
+    invalidation and the rendered pages.
+    :param cache: SharedCache object.
+    :return:
+    """
+    global shared_cache
+    shared_cache = cache
+    ns.set_version_store(cache)
+    return
+
+
+def set_journal(jrnl, app):
+    """
+    This function will register finish entries in the race-day journal, instead of writing them to Neo4J in the
+    request. The journal sync thread is started, so that entries from before a restart are applied.
+
+    :param jrnl: Journal object.
+
+    :param app: Application object, the entries are applied in the context of this application.
+
+    :return:
+    """
+    global journal
+
+    def apply_entry(race_id, person_id, prev_person_id, props):
+        with app.app_context(), ns.version_batch():
+            journal_apply(race_id, person_id, prev_person_id, props)
+
+    jrnl.handler = apply_entry
+    journal = jrnl
+    journal.start()
+    return
+
+
+def set_snapshots(store):
+    """
+    This function will keep the snapshots of the read pages in the store, instead of in memory of the worker process.
+
+    :param store: Snapshots object.
+
+    :return:
+    """
+    global snapshots
+    snapshots = store
+    return
+
+
+def journal_apply(race_id, person_id, prev_person_id, props):
+    """
+    This function will add the participant for a journal entry. If the person is a participant in the race already,
+    then only the properties are set, so an entry can be applied more than once.
+
+    :param race_id: nid of the race.
+
+    :param person_id: nid of the person.
+
+    :param prev_person_id: nid of the previous arrival, or "-1" for the first arrival.
+
+    :param props: Dictionary with participant properties.
+
+    :return:
+    """
+    part = Participant(race_id=race_id, person_id=person_id, prev_person_id=prev_person_id)
+    if not part.part_node:
+        raise RuntimeError("Participant {p} not added to race {r}".format(p=person_id, r=race_id))
+    if props:
+        part.set_props(**props)
+    return
 
 
 class Participant:
 
+    __slots__ = ("part_node", "_race", "_person")
     # List of calculated properties for the participant node.
     calc_props = ["nid", "points", "rel_pos"]
 
-    def __init__(self, part_id=None, race_id=None, person_id=None, prev_person_id=None):
+    def __init__(self, part_id=None, race_id=None, person_id=None, prev_person_id=None,
+                 part_node=None, race=None, person=None):
         """
         A Participant Object is the path: (person)-[:is]->(participant)-[:participates]->(race).
         If participant id is provided, then find race id and person id.
@@ -148,20 +329,26 @@ class Participant:
 
         :param prev_person_id: nid of the previous arrival in the race.
 
+        :param part_node: Participant node, to create the object without database lookup. Race and person objects
+        should be provided as well, see participants_for_race().
+
+        :param race: Race object for the participant node.
+
+        :param person: Person object for the participant node.
+
         :return: Participant object with participant node and nid, race nid and person nid are set.
         """
-        # Todo: rework classes so that objects are kept, not nids - replace race_nid with race_obj, ...
         self.part_node = None
-        if part_id:
-            # I have a participant ID, find race and person information
+        self._race = race
+        self._person = person
+        if part_node:
+            self.part_node = part_node
+        elif part_id:
+            # I have a participant ID, race and person are found on first use.
             self.part_node = ns.node(part_id)
-            race_node = ns.get_endnode(start_node=self.part_node, rel_type=part2race)
-            self.race = Race(race_id=race_node["nid"])
-            person_node = ns.get_startnode(end_node=self.part_node, rel_type=person2participant)
-            self.person = Person(person_id=person_node["nid"])
         elif person_id and race_id:
-            self.race = Race(race_id=race_id)
-            self.person = Person(person_id=person_id)
+            self._race = Race(race_id=race_id)
+            self._person = Person(person_id=person_id)
             self.part_node = ns.get_participant_in_race(pers_id=person_id, race_id=race_id)
             if not self.part_node:
                 current_app.logger.debug("Trying to add previous person to {n}".format(n=self.person.get_name()))
@@ -172,6 +359,26 @@ class Participant:
             raise ValueError("CannotCreateObject")
         return
 
+    @property
+    def race(self):
+        """
+        Race object for the participant, found on first use.
+        """
+        if self._race is None:
+            race_node = ns.get_endnode(start_node=self.part_node, rel_type=part2race)
+            self._race = Race(race_node=race_node)
+        return self._race
+
+    @property
+    def person(self):
+        """
+        Person object for the participant, found on first use.
+        """
+        if self._person is None:
+            person_node = ns.get_startnode(end_node=self.part_node, rel_type=person2participant)
+            self._person = Person(person_node=person_node)
+        return self._person
+
     def add(self, prev_person_id=None):
         """
         This method will add the participant in the chain of arrivals. At time of calling, the current participant node
@@ -182,63 +389,99 @@ class Participant:
         participant is the first arrival.
         Is there a next arrival for this runner? Remove relation between previous and next, remember next.
         Now link current participant to previous arrival and to next arrival.
+        Multiple clerks can add finishers to the same race, also from other worker processes. The race lock serializes
+        the writers in this process. The race version is claimed in the transaction that modifies the chain. If
+        another writer changed the chain in the meantime, the previous and next arrival are calculated again.
 
         :param prev_person_id: nid of previous arrival, or -1 if current participant is first arrival
 
-        :return:
+        :return: True if the participant is added, False if the race version could not be claimed.
+        """
+        race_id = self.race.get_nid()
+        with race_lock(race_id):
+            for attempt in range(race_write_retries):
+                version = ns.get_race_version(race_id)
+                # Another clerk may have registered this person while waiting for the lock.
+                part_node = ns.get_participant_in_race(pers_id=self.person.get_nid(), race_id=race_id)
+                if part_node:
+                    current_app.logger.info("{n} already registered in race".format(n=self.person.get_name()))
+                    self.part_node = part_node
+                    return True
+                (prev_arrival_nid, next_arrival_nid) = self.get_arrival_neighbours(prev_person_id)
+                # Create participant and relations, the link between previous and next arrival is replaced.
+                part_node = ns.add_participant(race_id, self.person.get_nid(), version,
+                                               prev_nid=prev_arrival_nid, next_nid=next_arrival_nid)
+                if part_node:
+                    break
+                current_app.logger.warning("Race {nid} modified by another writer, retry {a}"
+                                           .format(nid=race_id, a=attempt + 1))
+            else:
+                current_app.logger.error("Could not add {n} to race {nid} after {r} attempts"
+                                         .format(n=self.person.get_name(), nid=race_id, r=race_write_retries))
+                return False
+            self.part_node = part_node
+        # Calculate points after adding participant. The chain is consistent, so this does not need the race lock.
+        self.race.schedule_points()
+        return True
+
+    def get_arrival_neighbours(self, prev_person_id=None):
+        """
+        This method will find the participant nids between which the current participant needs to be added in the
+        chain of arrivals. The chain is not modified.
+
+        :param prev_person_id: nid of previous arrival, or -1 if current participant is first arrival
+
+        :return: Tuple of previous arrival nid and next arrival nid. Each of them is False if not available.
         """
         # Count total number of arrivals.
         participants = ns.get_startnodes(end_node=self.race.get_node(), rel_type=part2race)
-        if participants:
-            # Process required only if there is more than one participant in the race
-            if prev_person_id != "-1":
-                current_app.logger.debug("Previous runner found: {nid}".format(nid=prev_person_id))
-                # There is an arrival before current participant
-                # Find participant nid for this person
-                prev_arrival_obj = Participant(race_id=self.race.get_nid(), person_id=prev_person_id)
-                prev_arrival_nid = prev_arrival_obj.get_id()
-                # This can be linked to a next_arrival. Current participant will break this link
-                next_arrival_nid = prev_arrival_obj.next_runner()
-                if next_arrival_nid:
-                    ns.remove_relation(start_nid=next_arrival_nid, end_nid=prev_arrival_nid, rel_type="after")
-            else:
-                current_app.logger.debug("First arrival in the race!")
-                # This participant is the first one in the race. Find the next participant.
-                # Be careful, method 'participant_first_id' requires valid chain. So this needs to run before
-                # set_part_race()
-                first_arrival_in_race = participant_first_id(self.race.get_nid())
-                prev_arrival_nid = False
-                # Get participant nid for person nid first arrival.
-                next_arrival_obj = Participant(race_id=self.race.get_nid(), person_id=first_arrival_in_race)
-                next_arrival_nid = next_arrival_obj.get_id()
-            # Previous and next arrival have been calculated, create participant and create required relations
-            self.set_part_race()
-            if prev_arrival_nid:
-                self.set_relation(next_id=self.part_node["nid"], prev_id=prev_arrival_nid)
-            if next_arrival_nid:
-                self.set_relation(next_id=next_arrival_nid, prev_id=self.part_node["nid"])
-        else:
+        if not participants:
             # This runner is first one in the race
-            self.set_part_race()
-        # Calculate points after adding participant
-        self.race.calculate_points()
-        return
+            return False, False
+        if prev_person_id != "-1":
+            current_app.logger.debug("Previous runner found: {nid}".format(nid=prev_person_id))
+            # There is an arrival before current participant
+            # Find participant nid for this person
+            prev_arrival_obj = Participant(race_id=self.race.get_nid(), person_id=prev_person_id)
+            prev_arrival_nid = prev_arrival_obj.get_id()
+            # This can be linked to a next_arrival.
+            next_arrival_nid = prev_arrival_obj.next_runner()
+        else:
+            current_app.logger.debug("First arrival in the race!")
+            # This participant is the first one in the race. Find the next participant.
+            # Be careful, method 'participant_first_id' requires valid chain. So this needs to run before
+            # the participant is added.
+            first_arrival_in_race = participant_first_id(self.race.get_nid())
+            prev_arrival_nid = False
+            # Get participant nid for person nid first arrival.
+            next_arrival_obj = Participant(race_id=self.race.get_nid(), person_id=first_arrival_in_race)
+            next_arrival_nid = next_arrival_obj.get_id()
+        return prev_arrival_nid, next_arrival_nid
 
     def remove(self):
         """
         This method will remove the participant from the race.
         Recalculate points for the race.
-        @return:
-        """
-        if self.prev_runner() and self.next_runner():
-            # There is a previous and next runner, link them
-            ns.create_relation(from_node=ns.node(self.next_runner()), rel="after", to_node=ns.node(self.prev_runner()))
-        # Remove Participant Node
-        ns.remove_node_force(self.part_node["nid"])
+        The previous and next arrival are linked in the transaction that removes the participant and claims the race
+        version, see add().
+        @return: True if the participant is removed, False if the race version could not be claimed.
+        """
+        race_id = self.race.get_nid()
+        with race_lock(race_id):
+            for attempt in range(race_write_retries):
+                version = ns.get_race_version(race_id)
+                if ns.remove_participant(race_id, self.part_node["nid"], version):
+                    break
+                current_app.logger.warning("Race {nid} modified by another writer, retry {a}"
+                                           .format(nid=race_id, a=attempt + 1))
+            else:
+                current_app.logger.error("Could not remove participant {p} from race {nid} after {r} attempts"
+                                         .format(p=self.part_node["nid"], nid=race_id, r=race_write_retries))
+                return False
         # Reset Object
         self.part_node = None
-        self.race.calculate_points()
-        return
+        self.race.schedule_points()
+        return True
 
     def get_id(self):
         """
@@ -279,19 +522,6 @@ class Participant:
         """
         return self.race.get_nid()
 
-    def set_part_race(self):
-        """
-        This method will link the person to the race. This is done by creating an Participant Node. This function will
-        not link the participant to the previous or next participant.
-        The method will set the participant node.
-
-        :return: Node ID of the participant node.
-        """
-        self.part_node = ns.create_node("Participant")
-        ns.create_relation(from_node=self.part_node, rel=part2race, to_node=self.race.get_node())
-        ns.create_relation(from_node=self.person.get_node(), rel=person2participant, to_node=self.part_node)
-        return
-
     def set_props(self, **props):
         """
         This method will set the properties for the node. The calculated properties (points, rel_pos, ...) will be
@@ -309,22 +539,10 @@ class Participant:
                 props[attrib] = part_dict[attrib]
             except KeyError:
                 pass
-        return ns.node_update(**props)
-
-    @staticmethod
-    def set_relation(next_id=None, prev_id=None):
-        """
-        This method will connect the next runner with the previous runner. The next runner is after the previous runner.
-        @param next_id: Node ID of the next runner
-        @param prev_id: Node ID of the previous runner
-        @return:
-        """
-        prev_part_node = ns.node(prev_id)
-        next_part_node = ns.node(next_id)
-        if neostore.validate_node(prev_part_node, "Participant") \
-                and neostore.validate_node(next_part_node, "Participant"):
-            ns.create_relation(from_node=next_part_node, rel="after", to_node=prev_part_node)
-        return
+        part_node = ns.node_update(**props)
+        # Derived attributes are removed by the update.
+        ns.set_derived(part_id=props["nid"])
+        return part_node
 
     def prev_runner(self):
         """
@@ -363,11 +581,26 @@ class Person:
     # Todo: add a person.remove() method: remove MF link, check no participant links available.
     # Todo: add voornaam/familienaam
 
-    def __init__(self, person_id=None):
-        if person_id:
-            self.person_node = self.get_node(person_id)
-        else:
-            self.person_node = None
+    __slots__ = ("person_node", "cat_node")
+
+    def __init__(self, person_id=None, person_node=None, cat_node=None):
+        """
+        Define the Person object. The category is found on first use, unless it is provided.
+
+        :param person_id: nid of the person.
+
+        :param person_node: Person node, to create the object without database lookup.
+
+        :param cat_node: Category node of the person, False if the person has no category.
+
+        :return:
+        """
+        self.person_node = None
+        if person_node:
+            self.person_node = person_node
+        elif person_id:
+            self.get_node(person_id)
+        self.cat_node = cat_node
 
     @staticmethod
     def find(name):
@@ -406,6 +639,7 @@ class Person:
                 name=props["name"]
             )
             self.person_node = ns.create_node("Person", **person_props)
+            ns.bump_version("persons")
             # Link to MF
             link_mf(props["mf"], self.person_node, person2mf)
             self.set_category(props["category"])
@@ -429,7 +663,8 @@ class Person:
                 return False
             else:
                 self.set_name(props["name"])
-        link_mf(props["mf"], self.person_node, person2mf)
+        if link_mf(props["mf"], self.person_node, person2mf):
+            ns.set_derived(person_nids=[self.person_node["nid"]])
         self.set_category(props["category"])
         return True
 
@@ -484,6 +719,7 @@ class Person:
         """
         if person_id:
             self.person_node = ns.node(person_id)
+            self.cat_node = None
         return self.person_node
 
     def get_category(self):
@@ -492,9 +728,10 @@ class Person:
 
         :return: Category Node, or False if person not set to category.
         """
-        cat_node = ns.get_endnode(start_node=self.person_node, rel_type=person2category)
-        if isinstance(cat_node, Node):
-            return cat_node
+        if self.cat_node is None:
+            self.cat_node = ns.get_endnode(start_node=self.person_node, rel_type=person2category)
+        if isinstance(self.cat_node, Node):
+            return self.cat_node
         else:
             return False
 
@@ -537,6 +774,7 @@ class Person:
             props = ns.node_props(self.person_node["nid"])
             props["name"] = name
             ns.node_update(**props)
+            ns.bump_version("persons")
             return True
 
     def set_category(self, cat_nid):
@@ -560,6 +798,8 @@ class Person:
         # No category for person (anymore), add person to category
         cat_node = ns.node(cat_nid)
         ns.create_relation(from_node=self.person_node, to_node=cat_node, rel=person2category)
+        ns.set_derived(person_nids=[self.person_node["nid"]])
+        self.cat_node = cat_node
         return True
 
 
@@ -573,9 +813,11 @@ class Organization:
 
     :return: Object
     """
-    def __init__(self, org_id=None):
-        self.org_node = None
-        if org_id:
+    __slots__ = ("org_node",)
+
+    def __init__(self, org_id=None, org_node=None):
+        self.org_node = org_node
+        if org_id and not org_node:
             self.org_node = self.get_node(org_id)
 
     def add(self, **org_dict):
@@ -649,6 +891,8 @@ class Organization:
             ns.remove_node(curr_loc_node)
         # Check Date
         self.set_date(ds=properties["datestamp"])
+        # Name, location, date and type are copied on the races and participants.
+        ns.set_derived(org_id=self.get_org_id())
         return True
 
     def get_label(self):
@@ -720,7 +964,8 @@ class Organization:
         """
         This method will return all participants in this organization.
 
-        :return: list of person nodes for persons that do participate in a race for this organization.
+        :return: list of dictionaries with nid and name for persons that do participate in a race for this
+        organization.
         """
         return ns.get_part_for_org(self.get_org_id())
 
@@ -765,6 +1010,8 @@ class Organization:
         # Create new (or updated) link from organization to date
         date_node = ns.date_node(ds)  # Get Date (day) node
         ns.create_relation(from_node=self.org_node, rel=org2date, to_node=date_node)
+        # The organization date defines the season.
+        ns.node_set_attribs(nid=self.org_node["nid"], season=season4date(ds))
         return
 
     def set_location(self, loc=None):
@@ -777,7 +1024,7 @@ class Organization:
         :return: Nothing - relation between organization and location is established.
         """
         loc_node = Location(loc).get_node()   # Get Location Node based on city
-        ns.create_relation(from_node=self.org_node, to_node=loc_node, rel=org2loc)
+        ns.merge_relation(from_node=self.org_node, to_node=loc_node, rel=org2loc)
         return
 
     def set_org_type(self, org_type):
@@ -814,23 +1061,40 @@ class Race:
     consisting of links to the categories, mf and organization.
     """
 
-    def __init__(self, org_id=None, race_id=None):
+    __slots__ = ("race_node", "_org")
+
+    def __init__(self, org_id=None, race_id=None, race_node=None, org_node=None):
         """
         Define the Race object.
 
         :param org_id: Node ID of the Organization, used to create a new race.
 
-        :param race_id: Node ID of the Race, to handle an existing race. Organization will be calculated from race.
+        :param race_id: Node ID of the Race, to handle an existing race. Organization will be calculated from race on
+        first use.
+
+        :param race_node: Race node, to create the object without database lookup.
+
+        :param org_node: Organization node for the race node.
 
         :return:
         """
-        self.org = None
-        self.race_node = None
+        self._org = None
+        self.race_node = race_node
+        if org_node:
+            self._org = Organization(org_node=org_node)
         if org_id:
-            self.org = Organization(org_id=org_id)
-        elif race_id:
+            self._org = Organization(org_id=org_id)
+        elif race_id and not race_node:
             self.race_node = ns.node(nid=race_id)
+
+    @property
+    def org(self):
+        """
+        Organization object for the race, found on first use.
+        """
+        if self._org is None and self.race_node:
             self.set_org()
+        return self._org
 
     def add(self, **props):
         """
@@ -853,11 +1117,13 @@ class Race:
         ns.create_relation(from_node=self.org.get_node(), rel=org2race, to_node=self.race_node)
         # Create link between race node and each category - this should also work for empty category list?
         if isinstance(categorie_nodes, list):
-            for categorie_node in categorie_nodes:
-                ns.create_relation(from_node=self.race_node, rel=race2category, to_node=categorie_node)
+            ns.create_relations([(self.race_node["nid"], race2category, categorie_node["nid"])
+                                 for categorie_node in categorie_nodes],
+                                from_label=racelabel, to_label="Category")
         # Categories set, now set the race sequence number
         self.set_seq()
         link_mf(mf=props["mf"], node=self.race_node, rel=race2mf)
+        ns.set_derived(race_id=self.race_node["nid"])
         return self.race_node["racename"]
 
     def edit(self, **props):
@@ -880,9 +1146,9 @@ class Race:
         # Get existing categories
         current_cat_nodes = ns.get_endnodes(start_node=self.race_node, rel_type=race2category)
         # Add new links
-        add_rels = [node for node in categorie_nodes if node not in current_cat_nodes]
-        for end_node in add_rels:
-            ns.create_relation(from_node=self.race_node, rel=race2category, to_node=end_node)
+        add_rels = [(self.race_node["nid"], race2category, node["nid"])
+                    for node in categorie_nodes if node not in current_cat_nodes]
+        ns.create_relations(add_rels, from_label=racelabel, to_label="Category")
         # Remove category links that do no longer exist.
         remove_rels = [node for node in current_cat_nodes if node not in categorie_nodes]
         for end_node in remove_rels:
@@ -890,6 +1156,7 @@ class Race:
         # Categories set, now set the race sequence number
         self.set_seq()
         link_mf(mf=props["mf"], node=self.race_node, rel=race2mf)
+        ns.set_derived(race_id=self.race_node["nid"])
         return self.race_node["racename"]
 
     def calculate_points(self):
@@ -899,39 +1166,39 @@ class Race:
 
         :return: All participants in the race have the correct points and position.
         """
-        race_type = self.get_racetype()
-        node_list = ns.get_participant_seq_list(self.race_node["nid"])
-        if node_list:
-            cat_cnt = {}
-            cat_lst = self.get_cat_nids()
-            for k in cat_lst:
-                cat_cnt[k] = 0
-            cnt = 0
-            for part in node_list:
-                cat = get_cat4part(part["nid"])
-                cat_cnt[cat] += 1
-                cnt += 1
-                if race_type == "Wedstrijd":
-                    points = points_race(cat_cnt[cat])
-                elif race_type == "Short":
-                    points = points_short(cnt)
-                elif race_type == "Deelname":
-                    points = 20
-                else:
-                    current_app.logger.error("Race Type {rt} not defined.".format(rt=race_type))
-                    points = 20
-                rel_pos = cnt
-                # Set points for participant - Participant node is identified on nid.
-                props = dict(nid=part["nid"], points=points, rel_pos=rel_pos)
-                ns.node_set_attribs(**props)
+        finishers = ns.get_participant_seq_list(self.race_node["nid"])
+        if finishers:
+            ns.set_points(self.points_for_finishers(finishers))
         return
 
+    def points_for_finishers(self, finishers):
+        """
+        This method will apply the scoring rules on the finishers of the race.
+
+        :param finishers: Finishers in sequence of arrival, as returned by ns.get_participant_seq_list.
+
+        :return: List of dictionaries with participant nid, points and rel_pos.
+        """
+        race_type = self.get_racetype()
+        race_points = scoring_rules.race_points(race_type, [part["cat_nid"] for part in finishers])
+        return [dict(nid=part["nid"], points=points, rel_pos=rel_pos)
+                for part, (points, rel_pos) in zip(finishers, race_points)]
+
+    def schedule_points(self):
+        """
+        This method will request the calculation of the points for the race in the background. Requests for a race
+        that is waiting for calculation already are combined.
+
+        :return: Status dictionary of the calculation job.
+        """
+        return points_queue.submit(self.race_node["nid"])
+
     def get_next_part(self):
         """
         This method will get the list of people that need to be added as participant to the race. So these are people in
         race categories and MF that are not listed as participant yet.
 
-        :return: list of next participant nodes
+        :return: list of dictionaries with nid and name of the next participants
         """
         next_part_nodes = ns.get_next_parts_for_race(race_id=self.race_node["nid"])
         return next_part_nodes
@@ -941,7 +1208,7 @@ class Race:
         This method will get the range of people that can participate in the race. So everyone who is in a race
         category and required MF.
 
-        :return: list of the range of potential participants for the race.
+        :return: list of dictionaries with nid and name of the range of potential participants for the race.
         """
         prange_nodes = ns.get_part_range_for_race(race_id=self.race_node["nid"])
         return prange_nodes
@@ -1043,7 +1310,7 @@ class Race:
         :return: (nothing, organization object will be set.)
         """
         org_node = ns.get_startnode(end_node=self.race_node, rel_type=org2race)
-        self.org = Organization(org_id=org_node["nid"])
+        self._org = Organization(org_node=org_node)
         return
 
     def set_seq(self):
@@ -1099,14 +1366,42 @@ class Location:
         return node
 
 
-def organization_list():
+def organization_list(season=None):
     """
     This function will return a list of organizations. Each item in the list is a dictionary with fields date,
     organization, city, id (for organization nid) and type.
 
+    :param season: Name of the season, default is the current season.
+
     :return:
     """
-    return ns.get_organization_list()
+    return ns.get_organization_list(season=season or current_season())
+
+
+def organization_page(after=None, page_size=50, season=None, prefix=None):
+    """
+    This function will return a page of the organization list, in sequence of date.
+
+    :param after: Key of the last organization on the previous page, as returned for the previous page, or None for
+    the first page.
+
+    :param page_size: Number of organizations on the page.
+
+    :param season: Name of the season, default is the current season.
+
+    :param prefix: Start of the organization name, or None for all organizations.
+
+    :return: Tuple (list of organizations, key for the next page or None if this is the last page). Each organization
+    is a dictionary with fields date, organization, city, id (for organization nid) and type.
+    """
+    if after:
+        after = tuple(after.split("|", 1))
+    res = ns.get_organization_page(after=after, page_size=page_size, season=season or current_season(),
+                                   prefix=prefix)
+    if len(res) > page_size:
+        res = res[:page_size]
+        return res, "{key}|{nid}".format(key=res[-1]["day_key"], nid=res[-1]["id"])
+    return res, None
 
 
 def organization_delete(org_id=None):
@@ -1120,24 +1415,14 @@ def organization_delete(org_id=None):
     :return:
     """
     org = Organization(org_id=org_id)
-    org_node = org.get_node()
     org_label = org.get_label()
-    if ns.get_endnodes(start_node=org_node, rel_type="has"):
-        current_app.logger.info("Organization {label} cannot be removed, races are attached.".format(label=org_label))
-        return False
-    else:
-        # Remove Organization
-        current_app.logger.debug("Trying to remove organization {l}".format(l=org_label))
-        ns.remove_node_force(nid=org_id)
-        # Check if this results in orphan dates, remove these dates
-        current_app.logger.debug("Then remove all orphan dates")
-        ns.clear_date()
-        # Check if this results in orphan locations, remove these locations.
-        current_app.logger.debug("Trying to delete orphan organizations.")
-        ns.clear_locations()
-        current_app.logger.debug("All done")
+    # Remove Organization, with orphan date and orphan location, if there are no races attached.
+    if ns.remove_organization(org_id):
         current_app.logger.info("Organization {l} removed.".format(l=org_label))
         return True
+    else:
+        current_app.logger.info("Organization {label} cannot be removed, races are attached.".format(label=org_label))
+        return False
 
 
 def get_org_id(race_id):
@@ -1201,7 +1486,7 @@ def link_mf(mf, node, rel):
 
     :param rel: relation
 
-    :return:
+    :return: True if the link has been changed, False if the node was linked to the mf already.
     """
     current_app.logger.info("mf: {mf}, rel: {rel}".format(mf=mf, rel=rel))
     # Translate web property to node name
@@ -1215,12 +1500,12 @@ def link_mf(mf, node, rel):
         else:
             current_app.logger.info("No changes required...")
             # Link from race to mf exist, all OK!
-            return
+            return False
     # Create link between race node and MF.
     mf_node = get_mf_node(mf_name)
     current_app.logger.info("Creating connection to node {mf}".format(mf=mf_node))
     ns.create_relation(from_node=node, rel=rel, to_node=mf_node)
-    return
+    return True
 
 
 def get_race_list(org_id):
@@ -1234,7 +1519,7 @@ def get_race_list(org_id):
     return ns.get_race_list(org_id)
 
 
-def races4person(pers_id):
+def races4person(pers_id, season=None):
     """
     This method is pass-through for a method in neostore module.
     This method will get a list of race_ids per person, sorted on date. The information per race will be provided in
@@ -1242,25 +1527,29 @@ def races4person(pers_id):
 
     :param pers_id:
 
+    :param season: Name of the season, default is the current season.
+
     :return: list of Participant (part),race, date, organization (org) and racetype Node dictionaries in date
     sequence.
     """
-    recordlist = ns.get_race4person(pers_id)
+    recordlist = ns.get_race4person(pers_id, season=season or current_season())
     # races = [{'race_id': record["race_id"], 'race_label': race_label(record["race_id"])} for record in recordlist]
     return recordlist
 
 
-def races4person_org(pers_id):
+def races4person_org(pers_id, season=None):
     """
     This method gets the result of races4person method, then converts the result in a dictionary with key org_nid and
     value race dictionary.
 
     :param pers_id:
 
+    :param season: Name of the season, default is the current season.
+
     :return: Dictionary with key org_nid and value dictionary of node race attributes for the person. This can be used
     for the Results Overview page.
     """
-    races = races4person(pers_id=pers_id)
+    races = races4person(pers_id=pers_id, season=season)
     race_org = {}
     for race in races:
         race_org[race["org"]["nid"]] = dict(
@@ -1330,54 +1619,290 @@ def race_delete(race_id=None):
 
 def races_generate(org_id):
     """
-    This method will generate all races (combination of MF and categories) for an organization.
+    This method will generate all races (combination of MF and categories) for an organization. The races are
+    created in a single statement.
 
     :param org_id: nid of the organization.
 
     :return:
     """
-    categories = ns.get_nodes("Category")
-    for cat_node in categories:
-        for mf in ['man', 'vrouw']:
-            race_props = dict(
-                categories=[cat_node["nid"]],
-                mf=mf,
-                short=False,
-                name=False
-            )
-            Race(org_id=org_id).add(**race_props)
+    cat_nids = [cat_node["nid"] for cat_node in ns.get_category_nodes()]
+    mf_names = [mf_tx[mf] for mf in ['man', 'vrouw']]
+    cnt = ns.create_races(org_id, cat_nids, mf_names)
+    current_app.logger.info("{cnt} races generated for organization {org_id}".format(cnt=cnt, org_id=org_id))
+    return
+
+
+def person_page(after=None, page_size=50, cat=None, mf=None, prefix=None, season=None):
+    """
+    This function will return a page of the person list, in sequence of name.
+
+    :param after: Name of the last person on the previous page, or None for the first page.
+
+    :param page_size: Number of persons on the page.
+
+    :param cat: Category nid, or None for all categories.
+
+    :param mf: man / vrouw, or None for all persons.
+
+    :param prefix: Start of the person name, or None for all persons.
+
+    :param season: Name of the season to select persons that participated in the season, or None for all persons.
+
+    :return: Tuple (list of persons, key for the next page or None if this is the last page). Each person is
+    represented as a dictionary with person nid, name, category, category sequence (cat_seq), mf and number of races.
+    """
+    res = ns.get_person_page(after=after, page_size=page_size, cat=cat, mf=mf_tx.get(mf), prefix=prefix,
+                             season=season)
+    if len(res) > page_size:
+        res = res[:page_size]
+        return res, res[-1]["name"]
+    return res, None
+
+
+def person_index_check():
+    """
+    This function will load the person search index on first use, or if persons have been added, renamed or removed.
+    Other writes do not change the persons version.
+
+    :return:
+    """
+    (version, _) = ns.get_version("persons")
+    if person_index.version != version:
+        person_index.load(ns.get_person_names(), version=version)
     return
 
 
-def person_list():
+def person_names(nids):
+    """
+    This function will return the names of the persons from the search index.
+
+    :param nids: List of person nids.
+
+    :return: Dictionary with nid as key and name as value.
+    """
+    person_index_check()
+    return person_index.get_names(nids)
+
+
+def person_search(query, limit=10, race_id=None):
+    """
+    This function will return the persons with a name that matches the query, best match first.
+
+    :param query: Part of the person name, upper case and accents are ignored.
+
+    :param limit: Maximum number of persons returned.
+
+    :param race_id: nid of the race to return only persons that can be added to the race, or None for all persons.
+
+    :return: List of dictionaries with person nid and name.
+    """
+    person_index_check()
+    nids = race_candidates(race_id) if race_id else None
+    return person_index.search(query, limit=limit, nids=nids)
+
+
+def race_candidates(race_id):
     """
-    Return the list of persons as person objects.
+    This function will return the persons that can be added to the race: persons in the race categories and mf that
+    are not a participant in the organization yet. The set is calculated once for the data version, so that the
+    typeahead does not query Neo4J on every key stroke.
+
+    :param race_id: nid of the race.
 
-    :return: List of persons objects. Each person is represented as a dictionary with person nid, name, category,
-    category sequence (cat_seq), mf and number of races. The list is sorted on Category, MF and name.
+    :return: Set of person nids.
     """
-    res = ns.get_nodes('Person')
-    person_arr = []
-    for node in res:
-        person = Person(person_id=node["nid"])
-        cat_node = person.get_category()
-        if cat_node:
-            category = cat_node["name"]
-            cat_seq = cat_node["seq"]
+    (version, _) = ns.get_version()
+    try:
+        (cand_version, nids) = race_candidates_cache[race_id]
+    except KeyError:
+        pass
+    else:
+        if cand_version == version:
+            return nids
+    nids = set(rec["nid"] for rec in ns.get_next_parts_for_race(race_id))
+    # Sets of a previous data version are outdated.
+    for key in [key for key, (cand_version, _) in race_candidates_cache.items() if cand_version != version]:
+        race_candidates_cache.pop(key, None)
+    race_candidates_cache[race_id] = (version, nids)
+    return nids
+
+
+def person_import_rows(content, fmt="csv"):
+    """
+    This function will read the persons from an import file. A CSV file has a header line with columns name, mf and
+    category. A JSON file has a list of objects with name, mf and category.
+
+    :param content: Content of the file (string).
+
+    :param fmt: csv or json.
+
+    :return: List of dictionaries with name, mf and category as in the file.
+    """
+    if fmt == "json":
+        rows = json.loads(content)
+        if not isinstance(rows, list) or not all(isinstance(row, dict) for row in rows):
+            raise ValueError("JSON import must be a list of persons with name, mf and category")
+        return rows
+    return list(csv.DictReader(io.StringIO(content)))
+
+
+def person_import(rows, dry_run=False):
+    """
+    This function will register the persons from an import file. Every row is validated: the name is required, mf is
+    man / vrouw (or Heren / Dames) and category is the name or nid of a category. Names are deduplicated within the
+    file and against the registered persons, ignoring case and accents. Valid persons are created in one transaction,
+    all other rows are reported as conflicts.
+
+    :param rows: List of dictionaries with name, mf and category, see person_import_rows().
+
+    :param dry_run: If True, then the rows are validated but the persons are not created.
+
+    :return: Dictionary with created (list of names) and conflicts (list of dictionaries with line, name and reason).
+    Line 1 is the first person in the file.
+    """
+    categories = category_lookup()
+    mf_names = dict(mf_tx)
+    mf_names.update((name.lower(), name) for name in mf_tx.values())
+    registered = {personsearch.normalize(rec["name"]): rec["name"] for rec in ns.get_person_names()}
+    persons = []
+    conflicts = []
+    for (line, row) in enumerate(rows, start=1):
+        name = " ".join(str(row.get("name") or "").split())
+        mf = mf_names.get(str(row.get("mf") or "").strip().lower())
+        category = categories.get(str(row.get("category") or "").strip().lower())
+        norm = personsearch.normalize(name)
+        if not name or len(name) > 24:
+            reason = "Name is required, at most 24 characters"
+        elif not mf:
+            reason = "Unknown mf {mf}".format(mf=row.get("mf"))
+        elif not category:
+            reason = "Unknown category {cat}".format(cat=row.get("category"))
+        elif norm in registered:
+            reason = "Person {name} exists already".format(name=registered[norm])
         else:
-            category = "Not defined"
-            cat_seq = 100000
-        person_dict = dict(
-            nid=person.get_node()["nid"],
-            name=person.get_name(),
-            category=category,
-            cat_seq=cat_seq,
-            mf=person.get_mf()["name"],
-            races=len(person.get_races4person())
-        )
-        person_arr.append(person_dict)
-    persons_sorted = sorted(person_arr, key=lambda x: (x["cat_seq"], x["mf"], x["name"]))
-    return persons_sorted
+            registered[norm] = name
+            persons.append(dict(name=name, mf=mf, category=category, line=line))
+            continue
+        conflicts.append(dict(line=line, name=name, reason=reason))
+    if dry_run:
+        created = [person["name"] for person in persons]
+    else:
+        (created, exists) = ns.create_persons(persons)
+        if created:
+            ns.bump_version("persons")
+        # Persons registered by another user during the import.
+        conflicts.extend(dict(line=person["line"], name=person["name"], reason="Person exists already")
+                         for person in persons if person["name"] in exists)
+        conflicts.sort(key=lambda conflict: conflict["line"])
+    return dict(created=created, conflicts=conflicts)
+
+
+def category_rollover(mapping=None, birth_years=None, season=None, dry_run=False):
+    """
+    This function will move persons to a new category, e.g. at the start of a season. The new category is found in the
+    mapping from current category to new category, or in the birth year rule. All category relations are replaced in
+    one transaction. Then the races of the season with a moved person as participant are rescored, since the position
+    in the category is used for the points. The new category is copied on the participants of the season only, the
+    participants and points of other seasons keep the category in which they raced. Archive a finished season before
+    the rollover.
+
+    :param mapping: Dictionary with current category (name or nid) as key and new category (name or nid) as value.
+
+    :param birth_years: Dictionary with category (name or nid) as key and list [first year, last year] of birth years
+    as value. This is applied to persons with a birth date (born property), before the mapping.
+
+    :param season: Season to rescore, default is the current season.
+
+    :param dry_run: If True, then the moves are reported but the categories and points are not changed.
+
+    :return: Dictionary with moves (list of dictionaries with nid, name, old and new category nid), unknown (list of
+    categories in mapping or rule that do not exist), races (number of rescored races) and points (number of
+    participants with changed points).
+    """
+    categories = category_lookup()
+    unknown = []
+
+    def cat_nid(category):
+        try:
+            return categories[str(category).strip().lower()]
+        except KeyError:
+            unknown.append(category)
+            return None
+
+    cat_map = {cat_nid(old_cat): cat_nid(new_cat) for (old_cat, new_cat) in (mapping or {}).items()}
+    year_rule = [(cat_nid(cat), int(first), int(last)) for (cat, (first, last)) in (birth_years or {}).items()]
+    if unknown:
+        return dict(moves=[], unknown=unknown, races=0, points=0)
+    moves = []
+    for person in ns.get_person_categories():
+        new_cat = None
+        if person["born"]:
+            year = int(str(person["born"])[:4])
+            new_cat = next((cat for (cat, first, last) in year_rule if first <= year <= last), None)
+        new_cat = new_cat or cat_map.get(person["category"])
+        if new_cat and new_cat != person["category"]:
+            moves.append(dict(nid=person["nid"], name=person["name"], old=person["category"], category=new_cat))
+    if dry_run or not moves:
+        return dict(moves=moves, unknown=unknown, races=0, points=0)
+    season = season or current_season()
+    moved = ns.set_categories([dict(nid=move["nid"], category=move["category"]) for move in moves], season=season)
+    race_nids = ns.get_race_nids(season=season, person_nids=moved)
+    diff = []
+    for race_nid in race_nids:
+        diff.extend(rescore_race(race_nid))
+    ns.set_points(diff)
+    moved = set(moved)
+    return dict(moves=[move for move in moves if move["nid"] in moved], unknown=unknown, races=len(race_nids),
+                points=len(diff))
+
+
+def category_lookup():
+    """
+    This function will return the lookup from category name or nid to category nid, e.g. for import files where the
+    category can be given by name.
+
+    :return: Dictionary with lower case category name and category nid as keys, category nid as value.
+    """
+    categories = {}
+    for (cat_nid, cat_name) in get_category_list():
+        categories[cat_nid.lower()] = cat_nid
+        categories[cat_name.lower()] = cat_nid
+    return categories
+
+
+def participants_for_race(race_id, select_related=True):
+    """
+    This function will return the participants of the race as Participant objects, in sequence of arrival.
+
+    :param race_id: nid of the race.
+
+    :param select_related: If True, then the person (with category), race and organization are loaded with the
+    participants in one query. If False, then the related objects are loaded per participant on first use.
+
+    :return: List of Participant objects.
+    """
+    if not select_related:
+        return [Participant(part_id=part["nid"]) for part in ns.get_participant_seq_list(race_id) or []]
+    res = ns.get_participants_related(race_id)
+    if not res:
+        return []
+    race = Race(race_node=res[0]["race"], org_node=res[0]["org"])
+    return [Participant(part_node=rec["part"], race=race,
+                        person=Person(person_node=rec["person"], cat_node=rec["cat"] or False))
+            for rec in res]
+
+
+def persons_related(nids):
+    """
+    This function will return the Person objects for a list of person nids, with the category loaded in the same
+    query.
+
+    :param nids: List of person nids.
+
+    :return: List of Person objects. Nids without person are not in the list.
+    """
+    return [Person(person_node=rec["person"], cat_node=rec["cat"] or False) for rec in ns.get_persons_related(nids)]
 
 
 def get_cat4part(part_nid):
@@ -1503,17 +2028,7 @@ def points_race(pos):
 
     :return: Points associated for this position. Minimum is one point.
     """
-    if pos == 1:
-        points = 25
-    elif pos == 2:
-        points = 20
-    elif pos == 3:
-        points = 18
-    else:
-        points = 20-pos
-    if points < 1:
-        points = 1
-    return points
+    return scoring_rules.points("Wedstrijd", pos)
 
 
 def points_short(pos):
@@ -1525,55 +2040,45 @@ def points_short(pos):
 
     :return: Points associated for this position. Minimum is one point.
     """
-    if pos == 1:
-        points = 20
-    elif pos == 2:
-        points = 17
-    else:
-        points = 18-pos
-    if points < 1:
-        points = 1
-    return points
+    return scoring_rules.points("Short", pos)
 
 
 def points_sum(point_list):
     """
-    This function will calculate the total of the points for this participant. For now, the sum of all points is
-    calculated.
+    This function will calculate the total of the points for this participant. The best results are counted, every
+    additional result gives a bonus.
 
     :param point_list: list of the points for the participant.
 
     :return: sum of the points
     """
-    # Todo: points for 'deelname' should be calculated separately and in full
-    nr_races = 6
-    add_points_per_race = 5
-    max_list = sorted(point_list)[-nr_races:]
-    if len(point_list) > nr_races:
-        add_points = (len(point_list) - nr_races) * add_points_per_race
-    else:
-        add_points = 0
-    points = sum(max_list) + add_points
-    return points
+    return scoring_rules.total(point_list)
 
 
-def results_for_category(mf, cat):
+def results_for_category(mf, cat, season=None):
     """
     This method will calculate the points for all participants in mf and category. Split up in points for wedstrijd and
     points for deelname at this point.
+    The standings of an archived season are returned from the archive.
 
     :param mf: Dames / Heren
 
     :param cat: NID for the category
 
+    :param season: Name of the season, default is the current season.
+
     :return: Sorted list with tuples (name, points, number of races, nid for person).
     """
-    # Get participants for 'PK' and 'BK'
-    pk_list = ns.get_persons_in_organization("PK")
-    bk_list = ns.get_persons_in_organization("BK")
-    mbk_list = ns.get_persons_in_organization("MBK")
+    if season and season != current_season():
+        archive = season_standings(season)
+        if archive:
+            return archive[mf].get(cat, [])
+    season = season or current_season()
+    # Get participants for the organizations with a bonus ('PK', 'BK', ...)
+    bonus_lists = [(set(ns.get_persons_in_organization(org_name, season=season)), bonus)
+                   for org_name, bonus in scoring_rules.org_bonus.items()]
     # Wedstrijden
-    res_wedstrijd = ns.points_race(mf=mf, cat=cat, orgtype="Wedstrijd")
+    res_wedstrijd = ns.points_race(mf=mf, cat=cat, orgtype="Wedstrijd", season=season)
     result_list = {}
     for df_line in res_wedstrijd.iterrows():
         rec = df_line[1].to_dict()
@@ -1586,11 +2091,11 @@ def results_for_category(mf, cat):
     for nid in result_list:
         params = dict(
             wedstrijd_nr=len(result_list[nid]),
-            wedstrijd_points=points_sum(result_list[nid])
+            wedstrijd_points=scoring_rules.total(result_list[nid])
         )
         wedstrijd_total[nid] = params
     # Deelname
-    res_deelname = ns.points_race(mf=mf, cat=cat, orgtype="Deelname")
+    res_deelname = ns.points_race(mf=mf, cat=cat, orgtype="Deelname", season=season)
     result_list = {}
     for df_line in res_deelname.iterrows():
         rec = df_line[1].to_dict()
@@ -1603,7 +2108,7 @@ def results_for_category(mf, cat):
     for nid in result_list:
         params = dict(
             deelname_nr=len(result_list[nid]),
-            deelname_points=len(result_list[nid] * points_per_deelname)
+            deelname_points=len(result_list[nid]) * scoring_rules.participation_points
         )
         deelname_total[nid] = params
     # Merge wedstrijd_total and deelname_total
@@ -1627,16 +2132,13 @@ def results_for_category(mf, cat):
         wedstrijd_total[nid]["nr"] = wedstrijd_total[nid]["wedstrijd_nr"] + wedstrijd_total[nid]["deelname_nr"]
         wedstrijd_total[nid]["points"] = wedstrijd_total[nid]["wedstrijd_points"] + \
                                          wedstrijd_total[nid]["deelname_points"]
-        if nid in pk_list:
-            wedstrijd_total[nid]["points"] += bonus_pk
-        if nid in bk_list:
-            wedstrijd_total[nid]["points"] += bonus_bk
-        if nid in mbk_list:
-            wedstrijd_total[nid]["points"] += bonus_mbk
+        for (person_list, bonus) in bonus_lists:
+            if nid in person_list:
+                wedstrijd_total[nid]["points"] += bonus
     # Then convert dictionary in sorted list
     result_total = []
-    for nid in wedstrijd_total:
-        person = Person(nid)
+    for person in persons_related(wedstrijd_total.keys()):
+        nid = person.get_nid()
         cat = person.get_category()
         result_total.append([person.get_name(), wedstrijd_total[nid]["points"], wedstrijd_total[nid]["nr"],
                              nid, cat["name"], cat["seq"]])
@@ -1644,41 +2146,269 @@ def results_for_category(mf, cat):
     return result_sorted
 
 
-def results_for_mf(mf):
+def results_for_mf(mf, season=None):
     """
     This method will consolidate results for all categories for the MF.
 
     :param mf: Dames / Heren
 
+    :param season: Name of the season, default is the current season.
+
     :return: List sorted per category and on points within category
     """
     results = []
     category_list = ns.get_category_nodes()
     for cat in category_list:
-        result_cat = results_for_category(mf, cat["nid"])
+        result_cat = results_for_category(mf, cat["nid"], season=season)
         results.extend(result_cat)
     return results
 
 
+def points_for_race(race_id):
+    """
+    This method will calculate the points for the race. It is the handler for the points job queue.
+
+    :param race_id: Node nid of the race.
+
+    :return:
+    """
+    race = Race(race_id=race_id)
+    # The points of all participants are one change of the data version.
+    with ns.version_batch():
+        race.calculate_points()
+    publish_race(race)
+    return
+
+
+def rescore_race(race_id):
+    """
+    This method will calculate the points for the race according to the current scoring rules, without updating the
+    participants. Used for a full season rescore, where the updates are written in batches.
+
+    :param race_id: Node nid of the race.
+
+    :return: List of dictionaries for participants with changed points or position: nid, points and rel_pos for the
+    update, race_id, person_name, old_points and old_rel_pos for the report.
+    """
+    finishers = ns.get_participant_seq_list(race_id)
+    if not finishers:
+        return []
+    race = Race(race_id=race_id)
+    diff = []
+    for part, new in zip(finishers, race.points_for_finishers(finishers)):
+        if part["points"] != new["points"] or part["rel_pos"] != new["rel_pos"]:
+            new.update(race_id=race_id, person_name=part["person_name"],
+                       old_points=part["points"], old_rel_pos=part["rel_pos"])
+            diff.append(new)
+    return diff
+
+
+def publish_race(race):
+    """
+    This method will publish the finishers of the race and the standings for the race categories to the subscribed
+    browsers. The finishers and standings are calculated only if there are subscribers, and only once for all
+    subscribers.
+
+    :param race: Race object for which points have been calculated.
+
+    :return:
+    """
+    race_id = race.get_nid()
+    publish_channel("race:{race_id}".format(race_id=race_id))
+    mf = ns.get_endnode(start_node=race.get_node(), rel_type=race2mf)["name"]
+    for cat in race.get_cat_nids():
+        publish_channel("result:{mf}:{cat}".format(mf=mf, cat=cat))
+    return
+
+
+def publish_channel(channel):
+    """
+    This method will publish the current state of the channel, if there are subscribers. It is the refresh function of
+    the publisher, for changes in another worker process.
+
+    :param channel: race:<race_id> for the finishers of the race, result:<mf>:<cat> for the standings.
+
+    :return:
+    """
+    if not changes.has_subscribers(channel):
+        return
+    (kind, _, args) = channel.partition(":")
+    if kind == "race":
+        finishers = []
+        for (person, part) in participant_seq_list(args) or []:
+            finishers.append(dict(
+                nid=person["nid"],
+                name=person["label"],
+                pos=part.get("pos") or part.get("rel_pos"),
+                points=part.get("points")
+            ))
+        changes.publish(channel, "finishers", finishers)
+    elif kind == "result":
+        (mf, _, cat) = args.partition(":")
+        standings = [dict(name=row[0], points=row[1], nr=row[2], nid=row[3])
+                     for row in results_for_category(mf=mf, cat=cat)]
+        changes.publish(channel, "standings", standings)
+    return
+
+
+# Background calculation of race points, see Race.schedule_points().
+points_queue = jobqueue.JobQueue(points_for_race, name="points")
+# Publisher for race and standings changes, see publish_race(). Changes in other worker processes are found from the
+# data version.
+changes = publisher.Publisher(version=lambda: ns.get_version()[0], refresh=publish_channel)
+
+
+def load_scoring_rules():
+    """
+    This function will load the scoring rules from the SCORING_RULES configuration, if available. Must be called in
+    application context.
+
+    :return:
+    """
+    global scoring_rules
+    rules = current_app.config.get("SCORING_RULES")
+    if rules:
+        scoring_rules = scoring.ScoringRules(rules)
+    return
+
+
+def check_scoring_rules():
+    """
+    This function will load the scoring rules. If the rules are different from the rules that were used to calculate
+    the stored points, then all races of the current season are scheduled for recalculation. Must be called in
+    application context.
+
+    :return: Number of races that are scheduled for recalculation.
+    """
+    load_scoring_rules()
+    fingerprint = ns.get_scoring_fingerprint()
+    if fingerprint == scoring_rules.fingerprint:
+        return 0
+    ns.set_scoring_fingerprint(scoring_rules.fingerprint)
+    if not fingerprint and scoring.ScoringRules().fingerprint == scoring_rules.fingerprint:
+        # First fingerprint, points have been calculated with the default rules.
+        return 0
+    race_nids = ns.get_race_nids(season=current_season())
+    current_app.logger.info("Scoring rules changed, recalculate {cnt} races".format(cnt=len(race_nids)))
+    for race_id in race_nids:
+        points_queue.submit(race_id)
+    return len(race_nids)
+
+
+def season4date(ds):
+    """
+    This method will return the season for a date.
+
+    :param ds: Date as datetime.date or as string YYYY-MM-DD.
+
+    :return: Name of the season, e.g. 2018-2019
+    """
+    if isinstance(ds, str):
+        ds = datetime.datetime.strptime(ds, "%Y-%m-%d").date()
+    if ds.month >= season_start_month:
+        year = ds.year
+    else:
+        year = ds.year - 1
+    return "{y1}-{y2}".format(y1=year, y2=year + 1)
+
+
+def migrate():
+    """
+    This function will update a database from before the seasons and the derived attributes were introduced.
+    Organizations get their season, races and participants get the derived attributes. Nodes that have the attributes
+    already are not changed. The function is called from tools/derived.py, not on startup, so that workers and tools do
+    not write to the graph on import.
+
+    :return: Tuple (number of organizations with a new season, number of participants updated).
+    """
+    orgs = ns.set_seasons(season_start_month)
+    # set_seasons() sets the derived attributes if organizations have been updated.
+    parts = ns.init_derived() if not orgs else 0
+    return orgs, parts
+
+
+def current_season():
+    """
+    This method will return the current season. This is the most recent season with organizations, or the season for
+    today if there are no organizations.
+
+    :return: Name of the current season.
+    """
+    (version, _) = ns.get_version()
+    try:
+        return season_cache[version]
+    except KeyError:
+        pass
+    season = ns.get_current_season() or season4date(datetime.date.today())
+    season_cache.clear()
+    season_cache[version] = season
+    return season
+
+
+def season_list():
+    """
+    This method will return the seasons with organizations, most recent season first.
+
+    :return: List of dictionaries with season name and archived timestamp (None if not archived).
+    """
+    return ns.get_seasons()
+
+
+def season_standings(season):
+    """
+    This method will return the archived standings for the season.
+
+    :param season: Name of the season.
+
+    :return: Dictionary with mf as key. Value is a dictionary with category nid as key and the standings list (see
+    results_for_category) as value. False if the season is not archived.
+    """
+    archive = ns.get_season_archive(season)
+    if archive:
+        return json.loads(archive)
+    return False
+
+
+def season_archive(season):
+    """
+    This method will freeze the standings of the season. The standings for every mf and category are calculated and
+    stored in the Season node. The archive is read-only: standings for the season are read from the archive from now on.
+
+    :param season: Name of the season.
+
+    :return: Number of standings lines in the archive.
+    """
+    standings = {}
+    cnt = 0
+    for mf in mf_tx.values():
+        standings[mf] = {}
+        for cat in ns.get_category_nodes():
+            result_cat = results_for_category(mf, cat["nid"], season=season)
+            standings[mf][cat["nid"]] = result_cat
+            cnt += len(result_cat)
+    ns.set_season_archive(season, json.dumps(standings, separators=(",", ":")))
+    current_app.logger.info("Season {s} archived with {cnt} standings lines".format(s=season, cnt=cnt))
+    return cnt
+
+
 def participant_seq_list(race_id):
     """
     This method will collect the people in a race in sequence of arrival.
 
     :param race_id: nid of the race for which the participants are returned in sequence of arrival.
 
-    :return: List of participants items in the race. Each item is a tuple of the person dictionary (from the person
-     object) and the participant dictionary (the properties of the participant node). False if no participants in the
-     list.
+    :return: List of participants items in the race. Each item is a tuple of the person dictionary (nid and label) and
+     the participant dictionary (nid, pos, points and rel_pos from the participant node). False if no participants in
+     the list.
     """
-    node_list = ns.get_participant_seq_list(race_id)
-    if node_list:
+    finishers = ns.get_participant_seq_list(race_id)
+    if finishers:
         finisher_list = []
-        # If there are finishers, then recordlist has one element, which is a nodelist
-        for part in node_list:
-            part_obj = Participant(part_id=part["nid"])
-            person_obj = Person(person_id=part_obj.get_person_nid())
-            person_dict = person_obj.get_dict()
-            pers_part_tuple = (person_dict, dict(part))
+        for rec in finishers:
+            person_dict = dict(nid=rec["person_nid"], label=rec["person_name"])
+            # Only properties that are set, templates check if pos or rel_pos is available.
+            part_dict = {prop: rec[prop] for prop in ["nid", "pos", "points", "rel_pos"] if rec[prop] is not None}
+            pers_part_tuple = (person_dict, part_dict)
             finisher_list.append(pers_part_tuple)
         return finisher_list
     else:
@@ -1738,6 +2468,36 @@ def participant_first_id(race_id):
         return False
 
 
+def race_lock(race_id):
+    """
+    This method will return the write lock for the arrival chain of the race. The lock is created on first request.
+    The lock is re-entrant, since adding a participant can create Participant objects for the same race.
+
+    :param race_id: Node nid of the race.
+
+    :return: Re-entrant lock for the race.
+    """
+    with race_locks_guard:
+        try:
+            return race_locks[race_id]
+        except KeyError:
+            race_locks[race_id] = threading.RLock()
+            return race_locks[race_id]
+
+
+def remove_person(person_id):
+    """
+    This function will remove the person. The person must not participate in races.
+
+    :param person_id: nid of the person.
+
+    :return: True if the person is removed, False otherwise.
+    """
+    res = ns.remove_node_force(person_id)
+    ns.bump_version("persons")
+    return res
+
+
 def remove_node_force(node_id):
     """
     This function will remove the node with node ID node_id, including relations with the node.
@@ -4,36 +4,207 @@ This class consolidates functions related to the neo4J datastore.
 
 import logging
 import sys
+import threading
 import uuid
+from contextlib import contextmanager
 from datetime import datetime, date
-from flask import current_app
+from flask import current_app, g, has_request_context
+from itertools import islice
 from pandas import DataFrame
-from py2neo import Graph, Node, Relationship, NodeSelector
+from py2neo import Graph, Node, Relationship, NodeSelector, remote
 from py2neo.database import DBMS
 from py2neo.ext.calendar import GregorianCalendar
 
 
 class NeoStore:
 
-    def __init__(self, **neo4j_params):
-        """
-        Method to instantiate the class in an object for the neostore.
+    # Attributes that are copied on Race and Participant nodes, so that lists and points calculation read the node
+    # instead of walking the graph. The value is the Cypher expression in the match of set_derived().
+    race_derived = [
+        ("org_nid", "org.nid"),
+        ("org_name", "org.name"),
+        ("orgtype", "orgtype.name"),
+        ("day_key", "day.key"),
+        ("season", "org.season"),
+        ("city", "loc.city"),
+        ("mf", "mf.name")
+    ]
+    part_derived = [
+        ("race_nid", "race.nid"),
+        ("person_nid", "person.nid"),
+        ("mf", "mf.name"),
+        ("cat_nid", "cat.nid"),
+        ("cat_seq", "cat.seq"),
+        ("orgtype", "race.orgtype"),
+        ("day_key", "race.day_key"),
+        ("season", "race.season")
+    ]
+
+    def __init__(self, pool_size=10, **neo4j_params):
+        """
+        Method to instantiate the class in an object for the neostore. The object is shared by all request threads.
+        Every statement runs in its own session from the connection pool, the node selector and the calendar are
+        created per thread.
+
+        :param pool_size: Number of database sessions that are kept open for reuse. This should be at least the number
+        of request threads.
 
         :param neo4j_params: dictionary with Neo4J User, Pwd and Database. If host is not default localhost, it also
         needs to be defined in the dictionary.
 
         :return: Object to handle neostore commands.
         """
-        self.graph = self.connect2db(**neo4j_params)
-        self.calendar = GregorianCalendar(self.graph)
-        self.selector = NodeSelector(self.graph)
+        self.graph = self.connect2db(pool_size, **neo4j_params)
+        self.local = threading.local()
+        # Shared version store for multi-process serving, see set_version_store(). Without version store, the data
+        # version is a counter in this process, with a start token for every start of the application.
+        self.version_store = None
+        self.versions = {}
+        self.versions_lock = threading.Lock()
+        self.versions_start = uuid.uuid4().hex[:8]
+        self.versions_started = datetime.utcnow().replace(microsecond=0)
+        return
+
+    @property
+    def calendar(self):
+        """
+        Calendar for the date nodes of the current thread.
+        """
+        try:
+            return self.local.calendar
+        except AttributeError:
+            self.local.calendar = GregorianCalendar(self.graph)
+            return self.local.calendar
+
+    @property
+    def selector(self):
+        """
+        Node selector of the current thread.
+        """
+        try:
+            return self.local.selector
+        except AttributeError:
+            self.local.selector = NodeSelector(self.graph)
+            return self.local.selector
+
+    def bump_version(self, name="data"):
+        """
+        This method will increment the data version. It must be called by every method that writes to the graph, so
+        that read pages can check if anything changed since the client's last load.
+        Within a version batch (see begin_version_batch()) the version is incremented once, at the end of the batch.
+        Without version store, the data version is a counter in this process. The start token distinguishes the
+        versions of an application that has been restarted.
+
+        :param name: Name of the version, data for every write or e.g. persons for changes in person names only.
+
+        :return: New data version, or None if the increment is done at the end of the batch.
+        """
+        batch = getattr(self.local, "version_batch", None)
+        if batch is not None:
+            batch.add(name)
+            return None
+        if has_request_context():
+            g.pop("neo_versions", None)
+        if self.version_store:
+            return self.version_store.bump_version(name)
+        modified = datetime.utcnow().replace(microsecond=0)
+        with self.versions_lock:
+            version = self.versions.get(name, (0, None))[0] + 1
+            self.versions[name] = (version, modified)
+        return version
+
+    def get_version(self, name="data"):
+        """
+        This method will return the data version and the time of the last write. The version is read once per request.
+
+        :param name: Name of the version.
+
+        :return: Tuple with version tag (string) and UTC datetime of the last write.
+        """
+        if has_request_context():
+            versions = g.setdefault("neo_versions", {})
+            if name not in versions:
+                versions[name] = self.read_version(name)
+            return versions[name]
+        return self.read_version(name)
+
+    def read_version(self, name):
+        """
+        This method will read the data version from the version store, or from the counter in this process.
+
+        :param name: Name of the version.
+
+        :return: Tuple with version tag (string) and UTC datetime of the last write.
+        """
+        if self.version_store:
+            return self.version_store.get_version(name)
+        with self.versions_lock:
+            (version, modified) = self.versions.get(name, (0, self.versions_started))
+        return "{start}-{version}".format(start=self.versions_start, version=version), modified
+
+    def begin_version_batch(self):
+        """
+        This method will start a version batch for the current thread: the versions are incremented once at the end of
+        the batch, instead of on every write. A batch is a logical operation, e.g. a request or a points calculation.
+        Batches can be nested, the versions are incremented at the end of the outer batch.
+
+        :return:
+        """
+        self.local.version_depth = getattr(self.local, "version_depth", 0) + 1
+        if self.local.version_depth == 1:
+            self.local.version_batch = set()
+        return
+
+    def end_version_batch(self):
+        """
+        This method will end the version batch for the current thread and increment the versions that have been
+        bumped in the batch.
+
+        :return:
+        """
+        depth = getattr(self.local, "version_depth", 0)
+        if not depth:
+            return
+        self.local.version_depth = depth - 1
+        if self.local.version_depth:
+            return
+        names = self.local.version_batch
+        self.local.version_batch = None
+        for name in sorted(names):
+            self.bump_version(name)
+        return
+
+    @contextmanager
+    def version_batch(self):
+        """
+        Context manager for a version batch, see begin_version_batch().
+        """
+        self.begin_version_batch()
+        try:
+            yield
+        finally:
+            self.end_version_batch()
+
+    def set_version_store(self, version_store):
+        """
+        This method will keep the data version in a store that is shared with other processes on this server, instead
+        of in this process. Tools that write to the graph must use the same store, i.e. the same CACHE_PATH. Without
+        version store, writes by tools are seen by the application after a restart.
+
+        :param version_store: Object with bump_version() and get_version() methods, e.g. SharedCache.
+
+        :return:
+        """
+        self.version_store = version_store
         return
 
     @staticmethod
-    def connect2db(**neo4j_params):
+    def connect2db(pool_size, **neo4j_params):
         """
         Internal method to create a database connection. This method is called during object initialization.
 
+        :param pool_size: Number of bolt sessions that are kept open for reuse.
+
         :return: Database handle and cursor for the database.
         """
         neo4j_config = {
@@ -47,6 +218,8 @@ class NeoStore:
             host = "localhost"
         # Connect to Graph
         graph = Graph(**neo4j_config)
+        # Sessions are returned to the driver pool after every statement. Keep a session for every request thread.
+        graph.driver.max_pool_size = pool_size
         # Check that we are connected to the expected Neo4J Store - to avoid accidents...
         uri = "bolt://{host}:7687/".format(host=host)
         dbname = DBMS(uri).database_name
@@ -92,11 +265,66 @@ class NeoStore:
         current_app.logger.warning("Trying to create node with params {p}".format(p=props))
         component = Node(*labels, **props)
         self.graph.create(component)
+        self.bump_version()
         return component
 
     def create_relation(self, from_node=None, rel=None, to_node=None):
         """
-        Function to create relationship between nodes.
+        Function to create relationship between nodes. The relation is created without check on an existing relation,
+        so this must be used only if the relation cannot exist yet, e.g. for a node that has just been created. Use
+        merge_relation otherwise.
+
+        :param from_node: Start node for the relation
+
+        :param rel: Relation type
+
+        :param to_node: End node for the relation
+
+        :return:
+        """
+        rel = Relationship(from_node, rel, to_node)
+        self.graph.create(rel)
+        self.bump_version()
+        return
+
+    def create_relations(self, triples, from_label=None, to_label=None):
+        """
+        Function to create many relationships in one transaction. There is one UNWIND ... CREATE statement for every
+        relation type. No check is done on existing relations.
+
+        :param triples: List of tuples (from_nid, rel_type, to_nid).
+
+        :param from_label: Label of all start nodes, if known. This allows to find the start nodes on the nid index.
+
+        :param to_label: Label of all end nodes, if known.
+
+        :return: Number of relations that have been created.
+        """
+        rels = {}
+        for (from_nid, rel_type, to_nid) in triples:
+            rels.setdefault(rel_type, []).append(dict(from_nid=from_nid, to_nid=to_nid))
+        if not rels:
+            return 0
+        from_label = ":" + from_label if from_label else ""
+        to_label = ":" + to_label if to_label else ""
+        cnt = 0
+        tx = self.graph.begin()
+        for rel_type, rows in rels.items():
+            query = """
+                UNWIND {{rows}} AS row
+                MATCH (from_node{from_label} {{nid: row.from_nid}})
+                MATCH (to_node{to_label} {{nid: row.to_nid}})
+                CREATE (from_node)-[:{rel_type}]->(to_node)
+                RETURN count(*) AS cnt
+            """.format(from_label=from_label, to_label=to_label, rel_type=rel_type)
+            cnt += tx.run(query, rows=rows).data()[0]["cnt"]
+        tx.commit()
+        self.bump_version()
+        return cnt
+
+    def merge_relation(self, from_node=None, rel=None, to_node=None):
+        """
+        Function to create relationship between nodes, on condition that the relationship does not exist yet.
 
         :param from_node: Start node for the relation
 
@@ -108,8 +336,88 @@ class NeoStore:
         """
         rel = Relationship(from_node, rel, to_node)
         self.graph.merge(rel)
+        self.bump_version()
         return
 
+    def create_races(self, org_id, cat_nids, mf_names):
+        """
+        This method will create a race for every combination of category and mf in the organization. All races are
+        created in a single statement. The racename is category name and mf, the race sequence is the category sequence.
+
+        :param org_id: nid of the organization.
+
+        :param cat_nids: List of category nids.
+
+        :param mf_names: List of MF node names (Heren, Dames).
+
+        :return: Number of races created.
+        """
+        rows = [dict(nid=str(uuid.uuid4()), cat_nid=cat_nid, mf=mf_name)
+                for cat_nid in cat_nids for mf_name in mf_names]
+        query = """
+            MATCH (org:Organization {nid: {org_id}})
+            UNWIND {rows} AS row
+            MATCH (cat:Category {nid: row.cat_nid}), (mf:MF {name: row.mf})
+            CREATE (org)-[:has]->(race:Race {nid: row.nid, racename: cat.name + ' - ' + mf.name, seq: cat.seq}),
+                   (race)-[:forCategory]->(cat),
+                   (race)-[:forMF]->(mf)
+            RETURN count(race) AS cnt
+        """
+        res = self.graph.data(query, org_id=org_id, rows=rows)
+        self.set_derived(org_id=org_id)
+        return res[0]["cnt"]
+
+    def remove_organization(self, org_id):
+        """
+        This method will remove the organization, on condition that there are no races attached. The date (day, month
+        and year) and the location of the organization are removed if no longer used. Everything is done in a single
+        transaction.
+
+        :param org_id: nid of the organization.
+
+        :return: True if the organization is removed, False otherwise.
+        """
+        tx = self.graph.begin()
+        query = """
+            MATCH (org:Organization {nid: {org_id}})
+            WHERE NOT (org)-[:has]->()
+            OPTIONAL MATCH (org)-[:On]->(day:Day)
+            OPTIONAL MATCH (org)-[:In]->(loc:Location)
+            DETACH DELETE org
+            RETURN id(day) AS day_id, id(loc) AS loc_id
+        """
+        res = tx.run(query, org_id=org_id).data()
+        if not res:
+            tx.rollback()
+            return False
+        day_id = res[0]["day_id"]
+        loc_id = res[0]["loc_id"]
+        # Remaining relation of an orphan date node is the link to the next level up in the calendar.
+        query = """
+            MATCH (day:Day)--(month:Month)--(year:Year)
+            WHERE id(day) = {day_id} AND size((day)--()) = 1
+            DETACH DELETE day
+            WITH month, year
+            WHERE size((month)--()) = 1
+            DETACH DELETE month
+            WITH year
+            WHERE size((year)--()) = 1
+            DETACH DELETE year
+        """
+        tx.run(query, day_id=day_id)
+        query = """
+            MATCH (loc:Location)
+            WHERE id(loc) = {loc_id} AND NOT (loc)--()
+            WITH loc, loc.city AS city
+            DELETE loc
+            RETURN city
+        """
+        for rec in tx.run(query, loc_id=loc_id).data():
+            current_app.logger.info("Remove location {city}".format(city=rec["city"]))
+        tx.commit()
+        self.bump_version()
+        return True
+
     def clear_date_node(self, label):
         """
         This method will clear every date node as specified by label. Label can be Day, Month or Year. The node will be
@@ -128,6 +436,7 @@ class NeoStore:
             DETACH DELETE n
         """.format(label=label.capitalize())
         self.graph.run(query)
+        self.bump_version()
         return
 
     def clear_date(self):
@@ -166,6 +475,7 @@ class NeoStore:
                 return False
         if isinstance(ds, date):
             date_node = self.calendar.date(ds.year, ds.month, ds.day).day   # Get Date (day) node
+            self.bump_version()
             # Check if a new node has been created and nid is set
             self.get_nodes_no_nid()
             return date_node
@@ -185,20 +495,103 @@ class NeoStore:
 
         :return: End Node, or False.
         """
-        # First get Node from end node ID
-        try:
-            rel = next(item for item in self.graph.match(start_node=start_node, rel_type=rel_type))
-        except StopIteration:
-            logging.warning("No end node found for start node ID: {nid} and relation: {rel}"
-                            .format(nid=start_node["nid"], rel=rel_type))
+        return self.get_relnode(start_node, rel_type, outgoing=True)
+
+    def get_endnode_map(self, start_nodes, rel_type=None):
+        """
+        This method will calculate the end node for a list of start nodes and a relation type in a single query.
+        This is the batched version of get_endnode.
+
+        :param start_nodes: List of start nodes.
+
+        :param rel_type: Relation type
+
+        :return: Dictionary with start node nid as key and end node as value. Start nodes without end node are not in
+        the dictionary.
+        """
+        return self.get_relnode_map(start_nodes, rel_type, outgoing=True)
+
+    def get_relnode(self, node, rel_type=None, outgoing=True):
+        """
+        This method will find the single node on the other side of a relation. The query stops after the second
+        relation, which is sufficient to detect that there is more than one.
+
+        :param node: Node for which the related node is required.
+
+        :param rel_type: Relation type, or None for any relation type.
+
+        :param outgoing: True to find the end node of the relation, False to find the start node.
+
+        :return: Related node, or False.
+        """
+        if not isinstance(node, Node):
+            logging.error("Attribute not type Node (instead type {t})".format(t=type(node)))
+            return False
+        direction = "end" if outgoing else "start"
+        query = """
+            MATCH (node) WHERE id(node) = {node_id}
+            MATCH {pattern}
+            RETURN other
+            LIMIT 2
+        """.format(pattern=self.relation_pattern(rel_type, outgoing))
+        res = self.graph.data(query, node_id=remote(node)._id)
+        if not res:
+            logging.warning("No {d} node found for node ID {nid} and relation {rel}"
+                            .format(d=direction, nid=node["nid"], rel=rel_type))
             return False
+        if len(res) > 1:
+            logging.warning("More than one {d} node found for node ID {nid} and relation {rel}, returning first"
+                            .format(d=direction, nid=node["nid"], rel=rel_type))
+        return res[0]["other"]
+
+    def get_relnode_map(self, nodes, rel_type=None, outgoing=True):
+        """
+        This method will find the node on the other side of a relation for a list of nodes in a single query.
+
+        :param nodes: List of nodes.
+
+        :param rel_type: Relation type, or None for any relation type.
+
+        :param outgoing: True to find the end node of the relation, False to find the start node.
+
+        :return: Dictionary with node nid as key and related node as value. Nodes without related node are not in
+        the dictionary.
+        """
+        if not nodes:
+            return {}
+        query = """
+            UNWIND {node_ids} AS node_id
+            MATCH (node) WHERE id(node) = node_id
+            MATCH {pattern}
+            WITH node, collect(other)[0..2] AS others
+            RETURN node.nid AS nid, others
+        """.format(pattern=self.relation_pattern(rel_type, outgoing))
+        res = self.graph.data(query, node_ids=[remote(node)._id for node in nodes])
+        rel_map = {}
+        for rec in res:
+            if len(rec["others"]) > 1:
+                logging.warning("More than one related node found for node ID {nid} and relation {rel},"
+                                " returning first".format(nid=rec["nid"], rel=rel_type))
+            rel_map[rec["nid"]] = rec["others"][0]
+        return rel_map
+
+    @staticmethod
+    def relation_pattern(rel_type, outgoing):
+        """
+        This method will return the Cypher pattern from node to other for the relation type. Relation types cannot be
+        query parameters, so only relation types defined in the application must be used.
+
+        :param rel_type: Relation type, or None for any relation type.
+
+        :param outgoing: True if node is the start node of the relation, False if node is the end node.
+
+        :return: Pattern string.
+        """
+        rel = "[:{rel_type}]".format(rel_type=rel_type) if rel_type else "[]"
+        if outgoing:
+            return "(node)-{rel}->(other)".format(rel=rel)
         else:
-            # Check if there are more elements in the iterator.
-            if len([item for item in self.graph.match(start_node=start_node, rel_type=rel_type)]) > 1:
-                logging.warning("More than one end node found for start node ID {nid} and relation {rel},"
-                                " returning first".format(nid=start_node["nid"], rel=rel_type))
-            end_node = rel.end_node()
-            return end_node
+            return "(node)<-{rel}-(other)".format(rel=rel)
 
     def get_endnodes(self, start_node=None, rel_type=None):
         """
@@ -273,13 +666,14 @@ class NeoStore:
 
         :return: node that fulfills the criteria, or False if there is no node
         """
-        nodes = self.get_nodes(*labels, **props)
+        # The second node is sufficient to detect that there is more than one.
+        nodes = list(islice(self.iter_nodes(*labels, page_size=2, **props), 2))
         if not nodes:
             current_app.logger.info("Expected 1 node for label {l} and props {p}, found none.".format(l=labels, p=props))
             return False
         elif len(nodes) > 1:
-            logging.error("Expected 1 node for label {l} and props {p}, found many {m}."
-                          .format(l=labels, p=props, m=len(nodes)))
+            logging.error("Expected 1 node for label {l} and props {p}, found more than one."
+                          .format(l=labels, p=props))
         return nodes[0]
 
     def get_nodes(self, *labels, **props):
@@ -290,16 +684,80 @@ class NeoStore:
 
         :param props:
 
-        :return: list of nodes that fulfill the criteria, or False if no nodes are found.
+        :return: list of nodes that fulfill the criteria, or False if no nodes are found. Use iter_nodes or count_nodes
+        for many nodes.
         """
-        nodes = self.selector.select(*labels, **props)
-        nodelist = list(nodes)
+        nodelist = list(self.iter_nodes(*labels, **props))
         if len(nodelist) == 0:
             # No nodes found that fulfil the criteria
             return False
         else:
             return nodelist
 
+    def iter_nodes(self, *labels, page_size=500, **props):
+        """
+        This method will return the nodes that have labels and properties, one page of nodes at a time. Use this method
+        for operations on many nodes, the memory usage is limited to one page.
+
+        :param labels:
+
+        :param page_size: Number of nodes that are fetched in one query.
+
+        :param props:
+
+        :return: Generator for the nodes, in sequence of node ID.
+        """
+        conditions = ["n.{prop} = {{p{cnt}}}".format(prop=prop, cnt=cnt) for cnt, prop in enumerate(props)]
+        params = {"p{cnt}".format(cnt=cnt): value for cnt, value in enumerate(props.values())}
+        query = """
+            MATCH (n{labels})
+            WHERE {conditions}
+            RETURN id(n) AS node_id, n AS node
+            ORDER BY node_id
+            LIMIT {{page_size}}
+        """.format(labels="".join(":" + label for label in labels),
+                   conditions=" AND ".join(["id(n) > {last_key}"] + conditions))
+        for rec in self.iter_query(query, "node_id", page_size=page_size, **params):
+            yield rec["node"]
+
+    def iter_query(self, query, key, page_size=500, first_key=-1, **params):
+        """
+        This method will run a query in pages, using the last key of a page as the start for the next page (keyset
+        pagination). The query must select on key > {last_key}, order on the key and limit the result to {page_size}
+        records.
+
+        :param query: Cypher query with {last_key} and {page_size} parameters.
+
+        :param key: Name of the key field in the result records.
+
+        :param page_size: Number of records that are fetched in one query.
+
+        :param first_key: Key value that is lower than the key of the first record.
+
+        :param params: Other query parameters.
+
+        :return: Generator for the result records.
+        """
+        last_key = first_key
+        while True:
+            res = self.graph.data(query, last_key=last_key, page_size=page_size, **params)
+            for rec in res:
+                yield rec
+            if len(res) < page_size:
+                return
+            last_key = res[-1][key]
+
+    def count_nodes(self, *labels):
+        """
+        This method will count the nodes that have labels.
+
+        :param labels:
+
+        :return: Number of nodes.
+        """
+        query = "MATCH (n{labels}) RETURN count(n) AS cnt".format(labels="".join(":" + label for label in labels))
+        return self.graph.data(query)[0]["cnt"]
+
     def get_nodes_no_nid(self):
         """
         This method will select all nodes that have no nid. These should be limited to Calendar nodes. A nid will be
@@ -314,40 +772,379 @@ class NeoStore:
             cnt += 1
         return cnt
 
-    def get_organization_list(self):
+    def get_organization_list(self, season=None):
         """
         This method will get a list of all organizations. Each item in the list is a dictionary with fields date,
         organization, city, id (for organization nid) and type.
 
+        :param season: Name of the season (e.g. 2018-2019), or None for organizations of all seasons.
+
         :return:
         """
         query = """
             MATCH (day:Day)<-[:On]-(org:Organization)-[:In]->(loc:Location),
                   (org)-[:type]->(ot:OrgType)
+            WHERE {season} IS NULL OR org.season = {season}
             RETURN day.key as date, org.name as organization, loc.city as city, org.nid as id, ot.name as type
             ORDER BY day.key ASC
         """
-        res = self.graph.run(query).data()
+        res = self.graph.run(query, season=season).data()
         # Convert date key from YYYY-MM-DD to DD-MM-YYYY
         for rec in res:
             rec["date"] = datetime.strptime(rec["date"], "%Y-%m-%d").strftime("%d-%m-%Y")
         return res
 
+    def get_organization_page(self, after=None, page_size=50, season=None, prefix=None):
+        """
+        This method will get a page of the organization list, in sequence of date. The page starts after the
+        organization with date and nid in after (keyset pagination), so the query does not need to skip the previous
+        pages.
+
+        :param after: Tuple (date key YYYY-MM-DD, organization nid) of the last organization on the previous page, or
+        None for the first page.
+
+        :param page_size: Number of organizations on the page.
+
+        :param season: Name of the season, or None for organizations of all seasons.
+
+        :param prefix: Start of the organization name, or None for all organizations.
+
+        :return: List of dictionaries with fields date (DD-MM-YYYY), day_key (YYYY-MM-DD), organization, city, id (for
+        organization nid) and type. One organization more than page_size is returned if there is a next page.
+        """
+        conditions = []
+        params = dict(page_size=page_size + 1)
+        if after:
+            conditions.append("(day.key > {after_key} OR (day.key = {after_key} AND org.nid > {after_nid}))")
+            (params["after_key"], params["after_nid"]) = after
+        if season:
+            conditions.append("org.season = {season}")
+            params["season"] = season
+        if prefix:
+            conditions.append("org.name STARTS WITH {prefix}")
+            params["prefix"] = prefix
+        query = """
+            MATCH (day:Day)<-[:On]-(org:Organization)
+            {where}
+            WITH day, org
+            ORDER BY day.key, org.nid
+            LIMIT {{page_size}}
+            MATCH (org)-[:In]->(loc:Location), (org)-[:type]->(ot:OrgType)
+            RETURN day.key as day_key, org.name as organization, loc.city as city, org.nid as id, ot.name as type
+            ORDER BY day_key, id
+        """.format(where="WHERE " + " AND ".join(conditions) if conditions else "")
+        res = self.graph.data(query, **params)
+        for rec in res:
+            rec["date"] = datetime.strptime(rec["day_key"], "%Y-%m-%d").strftime("%d-%m-%Y")
+        return res
+
+    def get_person_page(self, after=None, page_size=50, cat=None, mf=None, prefix=None, season=None):
+        """
+        This method will get a page of the person list, in sequence of name. The page starts after the name in after
+        (keyset pagination), so that the name index is used and the previous pages are not read.
+
+        :param after: Name of the last person on the previous page, or None for the first page.
+
+        :param page_size: Number of persons on the page.
+
+        :param cat: Category nid, or None for all categories.
+
+        :param mf: MF node name (Heren, Dames), or None for all persons.
+
+        :param prefix: Start of the person name, or None for all persons.
+
+        :param season: Name of the season to select persons that participated in the season, or None for all
+        persons.
+
+        :return: List of dictionaries with person nid, name, category, cat_seq, mf and number of races. One person
+        more than page_size is returned if there is a next page.
+        """
+        conditions = []
+        params = dict(page_size=page_size + 1)
+        if after:
+            conditions.append("person.name > {after}")
+            params["after"] = after
+        if prefix:
+            conditions.append("person.name STARTS WITH {prefix}")
+            params["prefix"] = prefix
+        if mf:
+            conditions.append("mf.name = {mf}")
+            params["mf"] = mf
+        if cat:
+            conditions.append("(person)-[:inCategory]->(:Category {nid: {cat}})")
+            params["cat"] = cat
+        if season:
+            conditions.append("(person)-[:is]->(:Participant)-[:participates]->(:Race)"
+                              "<-[:has]-(:Organization {season: {season}})")
+            params["season"] = season
+        query = """
+            MATCH (person:Person)-[:mf]->(mf:MF)
+            {where}
+            WITH person, mf
+            ORDER BY person.name
+            LIMIT {{page_size}}
+            OPTIONAL MATCH (person)-[:inCategory]->(cat:Category)
+            OPTIONAL MATCH (person)-[:is]->(:Participant)-[:participates]->(race:Race)
+            RETURN person.nid AS nid, person.name AS name, coalesce(cat.name, 'Not defined') AS category,
+                   coalesce(cat.seq, 100000) AS cat_seq, mf.name AS mf, count(DISTINCT race) AS races
+            ORDER BY name
+        """.format(where="WHERE " + " AND ".join(conditions) if conditions else "")
+        return self.graph.data(query, **params)
+
+    def get_person_names(self):
+        """
+        This method will return nid and name for all persons, e.g. to build a search index.
+
+        :return: List of dictionaries with person nid and name.
+        """
+        query = """
+            MATCH (person:Person)
+            RETURN person.nid AS nid, person.name AS name
+        """
+        return self.graph.data(query)
+
+    def create_persons(self, persons):
+        """
+        This method will create the person nodes with relation to category and MF in one transaction. The names are
+        checked on the Person name index in the transaction. Persons with a name that exists already are not created.
+        The check does not lock: if another user registers the same name before the commit, the uniqueness constraint
+        on the Person name (see init_graph) rejects the transaction and no person is created. Names that only differ
+        in case or accents are not detected between concurrent imports.
+
+        :param persons: List of dictionaries with name, category (nid) and mf (MF node name).
+
+        :return: Tuple (list of names that have been created, list of names that exist already).
+        """
+        if not persons:
+            return [], []
+        rows = [dict(nid=str(uuid.uuid4()), name=person["name"], category=person["category"], mf=person["mf"])
+                for person in persons]
+        tx = self.graph.begin()
+        query = """
+            UNWIND {names} AS name
+            MATCH (person:Person {name: name})
+            RETURN person.name AS name
+        """
+        exists = [rec["name"] for rec in tx.run(query, names=[row["name"] for row in rows]).data()]
+        query = """
+            UNWIND {rows} AS row
+            MATCH (cat:Category {nid: row.category})
+            MATCH (mf:MF {name: row.mf})
+            CREATE (person:Person {nid: row.nid, name: row.name}),
+                   (person)-[:inCategory]->(cat),
+                   (person)-[:mf]->(mf)
+            RETURN person.name AS name
+        """
+        new_rows = [row for row in rows if row["name"] not in exists]
+        created = [rec["name"] for rec in tx.run(query, rows=new_rows).data()] if new_rows else []
+        tx.commit()
+        if created:
+            self.bump_version()
+        return created, exists
+
+    def get_person_categories(self):
+        """
+        This method will return the category and the birth date (if known) for all persons.
+
+        :return: List of dictionaries with person nid, name, born and category (nid, or None if the person has no
+        category).
+        """
+        query = """
+            MATCH (person:Person)
+            OPTIONAL MATCH (person)-[:inCategory]->(cat:Category)
+            RETURN person.nid AS nid, person.name AS name, person.born AS born, cat.nid AS category
+        """
+        return self.graph.data(query)
+
+    def set_categories(self, moves, season=None):
+        """
+        This method will move persons to a new category in one transaction. The current category relation of the
+        person is replaced. Persons that are in the new category already are not changed.
+
+        :param moves: List of dictionaries with person nid and category (nid of the new category).
+
+        :param season: Season for which the category is copied on the participants, or None for all seasons.
+        Participants in other seasons keep the category of that season.
+
+        :return: List of nids for the persons that have been moved.
+        """
+        if not moves:
+            return []
+        query = """
+            UNWIND {moves} AS row
+            MATCH (person:Person {nid: row.nid})
+            MATCH (cat:Category {nid: row.category})
+            WHERE NOT (person)-[:inCategory]->(cat)
+            OPTIONAL MATCH (person)-[rel:inCategory]->(:Category)
+            DELETE rel
+            WITH DISTINCT person, cat
+            CREATE (person)-[:inCategory]->(cat)
+            RETURN person.nid AS nid
+        """
+        tx = self.graph.begin()
+        moved = [rec["nid"] for rec in tx.run(query, moves=moves).data()]
+        tx.commit()
+        if moved:
+            self.set_derived(person_nids=moved, season=season)
+        return moved
+
+    def derived_queries(self, org_id=None, race_id=None, part_id=None, person_nids=None, season=None):
+        """
+        This method will return the match part of the queries for the derived attributes of races and participants.
+        The race query is None if only participants of persons are in scope.
+
+        :param org_id: nid of the organization, for the races and participants of the organization.
+
+        :param race_id: nid of the race, for the race and its participants.
+
+        :param part_id: nid of the participant.
+
+        :param person_nids: List of person nids, for the participants of the persons.
+
+        :param season: Name of the season, for the participants in races of the season.
+
+        :return: Tuple (race query, participant query). The queries end with WITH race / part and the derived
+        values as variables new_<attribute name>.
+        """
+        race_cond = []
+        part_cond = []
+        if org_id:
+            race_cond.append("org.nid = {org_id}")
+            part_cond.append("race.org_nid = {org_id}")
+        if race_id:
+            race_cond.append("race.nid = {race_id}")
+            part_cond.append("race.nid = {race_id}")
+        if part_id:
+            part_cond.append("part.nid = {part_id}")
+        if person_nids is not None:
+            part_cond.append("person.nid IN {person_nids}")
+        if season:
+            race_cond.append("org.season = {season}")
+            part_cond.append("race.season = {season}")
+        race_query = """
+            MATCH (org:Organization)-[:has]->(race:Race)
+            {where}
+            OPTIONAL MATCH (org)-[:type]->(orgtype:OrgType)
+            OPTIONAL MATCH (org)-[:On]->(day:Day)
+            OPTIONAL MATCH (org)-[:In]->(loc:Location)
+            OPTIONAL MATCH (race)-[:forMF]->(mf:MF)
+            WITH race, {values}
+        """.format(where="WHERE " + " AND ".join(race_cond) if race_cond else "",
+                   values=", ".join("{expr} AS new_{attr}".format(attr=attr, expr=expr)
+                                    for (attr, expr) in self.race_derived))
+        part_query = """
+            MATCH (person:Person)-[:is]->(part:Participant)-[:participates]->(race:Race)
+            {where}
+            OPTIONAL MATCH (person)-[:mf]->(mf:MF)
+            OPTIONAL MATCH (person)-[:inCategory]->(cat:Category)
+            WITH part, {values}
+        """.format(where="WHERE " + " AND ".join(part_cond) if part_cond else "",
+                   values=", ".join("{expr} AS new_{attr}".format(attr=attr, expr=expr)
+                                    for (attr, expr) in self.part_derived))
+        if part_id or person_nids is not None:
+            race_query = None
+        return race_query, part_query
+
+    def set_derived(self, org_id=None, race_id=None, part_id=None, person_nids=None, season=None):
+        """
+        This method will set the derived attributes on the races and participants in scope, in one transaction. It
+        must be called by every write that changes one of the attributes in race_derived or part_derived. Without
+        scope all races and participants are updated.
+
+        :param org_id: nid of the organization.
+
+        :param race_id: nid of the race.
+
+        :param part_id: nid of the participant.
+
+        :param person_nids: List of person nids.
+
+        :param season: Name of the season.
+
+        :return: Number of participants that have been updated.
+        """
+        (race_query, part_query) = self.derived_queries(org_id=org_id, race_id=race_id, part_id=part_id,
+                                                        person_nids=person_nids, season=season)
+        params = dict(org_id=org_id, race_id=race_id, part_id=part_id, person_nids=person_nids, season=season)
+        tx = self.graph.begin()
+        if race_query:
+            tx.run(race_query + self.derived_set("race", self.race_derived), **params)
+        query = part_query + self.derived_set("part", self.part_derived) + " RETURN count(part) AS cnt"
+        cnt = tx.run(query, **params).data()[0]["cnt"]
+        tx.commit()
+        self.bump_version()
+        return cnt
+
+    @staticmethod
+    def derived_set(node, attribs):
+        """
+        This method will return the SET clause for the derived attributes, after the query from derived_queries().
+
+        :param node: Name of the node variable, race or part.
+
+        :param attribs: race_derived or part_derived.
+
+        :return: SET clause.
+        """
+        return "SET " + ", ".join("{n}.{a} = new_{a}".format(n=node, a=attr) for (attr, _) in attribs)
+
+    def init_derived(self):
+        """
+        This method will set the derived attributes if there are races or participants without the attributes, e.g.
+        for a database from before the attributes were introduced.
+
+        :return: Number of participants that have been updated, 0 if all attributes were set already.
+        """
+        query = """
+            OPTIONAL MATCH (race:Race) WHERE NOT EXISTS(race.org_nid)
+            WITH count(race) AS races
+            OPTIONAL MATCH (part:Participant) WHERE NOT EXISTS(part.person_nid)
+            RETURN races + count(part) AS cnt
+        """
+        if self.graph.data(query)[0]["cnt"]:
+            return self.set_derived()
+        return 0
+
+    def verify_derived(self):
+        """
+        This method will check the derived attributes on all races and participants.
+
+        :return: List of dictionaries with label, nid and attrib (name of the first attribute that is not correct).
+        """
+
+        def mismatch(node, attribs):
+            # Attribute is correct if the values are equal, or if both values are NULL.
+            same = ["coalesce({n}.{a} = new_{a}, {n}.{a} IS NULL AND new_{a} IS NULL)".format(n=node, a=attr)
+                    for (attr, _) in attribs]
+            wrong = ", ".join("CASE WHEN NOT {s} THEN '{a}' END".format(s=check, a=attr)
+                              for (check, (attr, _)) in zip(same, attribs))
+            return """
+                WHERE NOT ({same})
+                RETURN {n}.nid AS nid, [attr IN [{wrong}] WHERE attr IS NOT NULL][0] AS attrib
+            """.format(same=" AND ".join(same), n=node, wrong=wrong)
+
+        (race_query, part_query) = self.derived_queries()
+        res = []
+        for (label, query) in [("Race", race_query + mismatch("race", self.race_derived)),
+                               ("Participant", part_query + mismatch("part", self.part_derived))]:
+            res.extend(dict(label=label, nid=rec["nid"], attrib=rec["attrib"]) for rec in self.graph.data(query))
+        return res
+
     def get_part_for_org(self, org_id):
         """
-        This method will return a list of people that participate in a race for this organization.
+        This method will return a list of people that participate in a race for this organization. Only nid and name
+        of the person are returned.
 
         :param org_id: Nid of the organization
 
-        :return:
+        :return: List of dictionaries with person nid and name.
         """
         query = """
             MATCH (n:Organization)-[:has]->(m:Race)<-[:participates]-(d:Participant)<-[:is]-(p:Person)
-            WHERE n.nid = '{org_id}'
-            RETURN p
-        """.format(org_id=org_id)
-        res = self.graph.run(query)
-        return nodelist_from_cursor(res)
+            WHERE n.nid = {org_id}
+            RETURN DISTINCT p.nid AS nid, p.name AS name
+        """
+        return self.graph.data(query, org_id=org_id)
 
     def get_next_parts_for_race(self, race_id):
         """
@@ -356,7 +1153,7 @@ class NeoStore:
 
         :param race_id: Nid of the race.
 
-        :return: Person node list for potential participants.
+        :return: List of dictionaries with nid and name for potential participants.
         """
         #  Todo: Next participant should not occur anywhere in the organization.
         query = """
@@ -364,12 +1161,11 @@ class NeoStore:
                 (race)-[:forMF]-(mf:MF),
                 (person:Person)-[:inCategory]->(cat),
                 (person)-[:mf]->(mf)
-            WHERE race.nid='{race_id}'
+            WHERE race.nid={race_id}
             AND NOT EXISTS ((person)-[:is]->(:Participant)-[:participates]->(:Race)<-[:has]-(org:Organization))
-            RETURN person
-        """.format(race_id=race_id)
-        res = self.graph.run(query)
-        return nodelist_from_cursor(res)
+            RETURN DISTINCT person.nid AS nid, person.name AS name
+        """
+        return self.graph.data(query, race_id=race_id)
 
     def get_part_range_for_race(self, race_id):
         """
@@ -378,34 +1174,36 @@ class NeoStore:
 
         :param race_id:
 
-        :return:
+        :return: List of dictionaries with nid and name for the people that can participate.
         """
         query = """
             MATCH (race:Race)-[:forCategory]->(cat:Category),
                 (race)-[:forMF]-(mf:MF),
                 (person:Person)-[:inCategory]->(cat),
                 (person)-[:mf]->(mf)
-                WHERE race.nid='{race_id}'
-                RETURN (person)
-        """.format(race_id=race_id)
-        res = self.graph.run(query)
-        return nodelist_from_cursor(res)
+                WHERE race.nid={race_id}
+                RETURN DISTINCT person.nid AS nid, person.name AS name
+        """
+        return self.graph.data(query, race_id=race_id)
 
-    def get_persons_in_organization(self, org_name):
+    def get_persons_in_organization(self, org_name, season=None):
         """
         This method will get the person nids for the participants in an organization. This can be used to do the special
         point calculation, e.g. +3 points for PK, +10 points for BK, ...
 
         :param org_name: Name of the organization
 
+        :param season: Name of the season, or None for all seasons.
+
         :return: list of person nids that participate in the organization
         """
         query = """
             MATCH (person:Person)-[:is]->(part:Participant)-[:participates]->(race:Race),
             (race)<-[:has]-(org {name: {org_name}})
+            WHERE {season} IS NULL OR org.season = {season}
             RETURN person.nid as person_nid
         """
-        res = self.graph.data(query, org_name=org_name)
+        res = self.graph.data(query, org_name=org_name, season=season)
         person_list = []
         for rec in res:
             person_list.append(rec["person_nid"])
@@ -424,11 +1222,11 @@ class NeoStore:
         """
         query = """
             MATCH (pers:Person)-[:is]->(part:Participant)-[:participates]->(race:Race)
-            WHERE pers.nid='{pers_id}' AND race.nid='{race_id}'
-            RETURN part
-        """.format(pers_id=pers_id, race_id=race_id)
-        res = self.graph.run(query)
-        nodes = nodelist_from_cursor(res)
+            WHERE pers.nid = {pers_id} AND race.nid = {race_id}
+            RETURN DISTINCT part
+            LIMIT 2
+        """
+        nodes = [rec["part"] for rec in self.graph.data(query, pers_id=pers_id, race_id=race_id)]
         if len(nodes) > 1:
             logging.error("More than one ({nr}) Participant node for Person {pnid} and Race {rnid}"
                           .format(pnid=pers_id, rnid=race_id, nr=len(nodes)))
@@ -438,30 +1236,79 @@ class NeoStore:
 
     def get_participant_seq_list(self, race_id):
         """
-        This method will return a list of participant nodes in sequence of arrival for a particular race.
+        This method will return the participants in sequence of arrival for a particular race. Only the fields that are
+        required for lists and points calculation are returned, no nodes.
 
         :param race_id:
 
-        :return: Node list
+        :return: List of dictionaries with participant nid, pos, points and rel_pos, person_nid, person_name and
+        cat_nid (category of the person), or False if there are no participants.
         """
         query = """
             MATCH race_ptn = (race)<-[:participates]-(participant),
                   participants = (participant)<-[:after*0..]-()
-            WHERE race.nid = '{race_id}'
+            WHERE race.nid = {race_id}
             WITH COLLECT(participants) AS results, MAX(length(participants)) AS maxLength
             WITH FILTER(result IN results WHERE length(result) = maxLength) AS result_coll
-            UNWIND result_coll as result
-            RETURN nodes(result)
-        """.format(race_id=race_id)
-        # Get the result of the query in a recordlist
-        cursor = self.graph.run(query)
-        try:
-            rec = cursor.next()
-        except StopIteration:
+            WHERE size(result_coll) > 0
+            WITH nodes(result_coll[0]) AS parts
+            UNWIND range(0, size(parts) - 1) AS idx
+            WITH idx, parts[idx] AS part
+            MATCH (person:Person)-[:is]->(part)
+            OPTIONAL MATCH (person)-[:inCategory]->(cat:Category)
+            RETURN part.nid AS nid, part.pos AS pos, part.points AS points, part.rel_pos AS rel_pos,
+                   person.nid AS person_nid, person.name AS person_name, cat.nid AS cat_nid
+            ORDER BY idx
+        """
+        res = self.graph.data(query, race_id=race_id)
+        if not res:
             return False
-        return rec["nodes(result)"]
+        return res
+
+    def get_participants_related(self, race_id):
+        """
+        This method will return the participants in sequence of arrival for a race, together with the person, the
+        category of the person, the race and the organization nodes. This allows to create the participant objects
+        without further database lookups.
+
+        :param race_id: nid of the race.
+
+        :return: List of dictionaries with part, person, cat, race and org nodes. Empty list if there are no
+        participants.
+        """
+        query = """
+            MATCH (org:Organization)-[:has]->(race:Race {nid: {race_id}})
+            MATCH race_ptn = (race)<-[:participates]-(participant),
+                  participants = (participant)<-[:after*0..]-()
+            WITH org, race, COLLECT(participants) AS results, MAX(length(participants)) AS maxLength
+            WITH org, race, FILTER(result IN results WHERE length(result) = maxLength) AS result_coll
+            WHERE size(result_coll) > 0
+            WITH org, race, nodes(result_coll[0]) AS parts
+            UNWIND range(0, size(parts) - 1) AS idx
+            WITH org, race, idx, parts[idx] AS part
+            MATCH (person:Person)-[:is]->(part)
+            OPTIONAL MATCH (person)-[:inCategory]->(cat:Category)
+            RETURN part, person, cat, race, org
+            ORDER BY idx
+        """
+        return self.graph.data(query, race_id=race_id)
+
+    def get_persons_related(self, nids):
+        """
+        This method will return the person nodes with their category node for a list of person nids.
+
+        :param nids: List of person nids.
+
+        :return: List of dictionaries with person and cat (None if the person has no category) nodes.
+        """
+        query = """
+            MATCH (person:Person) WHERE person.nid IN {nids}
+            OPTIONAL MATCH (person)-[:inCategory]->(cat:Category)
+            RETURN person, cat
+        """
+        return self.graph.data(query, nids=list(nids))
 
-    def points_race(self, mf, cat, orgtype):
+    def points_race(self, mf, cat, orgtype, season=None):
         """
         This query will for the specified mf and category collect every participatant and points for the participation
         for every person in the category.
@@ -472,17 +1319,17 @@ class NeoStore:
 
         :param orgtype: Wedstrijd / Deelname
 
+        :param season: Name of the season, or None for all seasons.
+
         :return: A dataframe with records having the person_nid and points for each participation on every race.
         """
         query = """
-            MATCH (person:Person)-[:mf]->(mf:MF  {name: {mf}}),
-                  (person)-[:inCategory]->(cat:Category {nid: {cat}}),
-                  (person)-[:is]->(part)-[:participates]-(race:Race),
-                  (race)<-[:has]-(org:Organization),
-                  (org)-[:type]->(orgtype:OrgType {name: {orgtype}})
-            RETURN person.nid as person_nid, part.points as points
+            MATCH (part:Participant {cat_nid: {cat}})
+            WHERE part.mf = {mf} AND part.orgtype = {orgtype}
+              AND ({season} IS NULL OR part.season = {season})
+            RETURN part.person_nid as person_nid, part.points as points
         """
-        res = self.graph.data(query, mf=mf, cat=cat, orgtype=orgtype)
+        res = self.graph.data(query, mf=mf, cat=cat, orgtype=orgtype, season=season)
         return DataFrame(res)
 
     def get_race_list(self, org_id):
@@ -515,38 +1362,359 @@ class NeoStore:
             res_arr.append(race_nodes)
         return res_arr
 
-    def get_race4person(self, person_id):
+    def get_race4person(self, person_id, season=None):
         """
         This method will get a list of participant information for a  person, sorted on date. The information will be
         provided in a list of dictionaries. The dictionary values are the corresponding node dictionaries.
 
+        Only the properties that are shown on the pages are returned.
+
         :param person_id:
 
-        :return: list of Participant (part),race, date, organization (org) and racetype Node dictionaries in date
+        :param season: Name of the season, or None for races in all seasons.
+
+        :return: list of Participant (part),race, date, organization (org) and racetype dictionaries in date
         sequence.
         """
         race4person = []
         query = """
-            MATCH (person:Person)-[:is]->(part:Participant)-[:participates]->(race:Race),
-                  (race)<-[:has]-(org:Organization)-[:On]->(day:Day),
-                  (org)-[:type]->(orgtype),
-                  (org)-[:In]->(loc:Location)
-            WHERE person.nid='{pers_id}'
-            RETURN race, part, day, org, orgtype, loc
-            ORDER BY day.key ASC
-        """.format(pers_id=person_id)
-        cursor = self.graph.run(query)
-        while cursor.forward():
-            rec = cursor.current()
-            res_dict = dict(part=dict(rec['part']),
-                            race=dict(rec['race']),
-                            date=dict(rec['day']),
-                            org=dict(rec['org']),
-                            orgtype=dict(rec['orgtype']),
-                            loc=dict(rec['loc']))
+            MATCH (part:Participant {person_nid: {pers_id}})-[:participates]->(race:Race)
+            WHERE {season} IS NULL OR race.season = {season}
+            RETURN part.nid AS part_nid, part.pos AS pos, part.points AS points, part.rel_pos AS rel_pos,
+                   race.nid AS race_nid, race.racename AS racename, race.day_key AS day_key,
+                   race.org_nid AS org_nid, race.org_name AS org_name, race.orgtype AS orgtype, race.city AS city
+            ORDER BY race.day_key ASC
+        """
+        for rec in self.graph.data(query, pers_id=person_id, season=season):
+            part = dict(nid=rec["part_nid"], pos=rec["pos"], points=rec["points"], rel_pos=rec["rel_pos"])
+            res_dict = dict(part={k: v for k, v in part.items() if v is not None},
+                            race=dict(nid=rec["race_nid"], racename=rec["racename"]),
+                            date=dict(key=rec["day_key"]),
+                            org=dict(nid=rec["org_nid"], name=rec["org_name"]),
+                            orgtype=dict(name=rec["orgtype"]),
+                            loc=dict(city=rec["city"]))
             race4person.append(res_dict)
         return race4person
 
+    def get_race_count4person(self, person_id):
+        """
+        This method will count the races for a person.
+
+        :param person_id: nid of the person.
+
+        :return: Number of races for the person.
+        """
+        query = """
+            MATCH (person:Person)-[:is]->(part:Participant)-[:participates]->(race:Race)
+            WHERE person.nid={pers_id}
+            RETURN count(DISTINCT race) AS cnt
+        """
+        return self.graph.data(query, pers_id=person_id)[0]["cnt"]
+
+    def get_race_version(self, race_id):
+        """
+        This method will return the write version of the race. The version is incremented on every change in the
+        arrival chain of the race, so that concurrent writers can detect that the chain was modified while they were
+        preparing their update.
+
+        :param race_id: nid of the race.
+
+        :return: Version number of the race, 0 if no version has been set yet.
+        """
+        query = "MATCH (race:Race {nid: {race_id}}) RETURN coalesce(race.version, 0) AS version"
+        res = self.graph.data(query, race_id=race_id)
+        if not res:
+            logging.error("No race found for nid {race_id}".format(race_id=race_id))
+            return 0
+        return res[0]["version"]
+
+    def set_race_version(self, race_id, version=None):
+        """
+        This method will increment the write version of the race, on condition that the current version is still
+        equal to version (compare-and-set). The first SET takes the write lock on the race node, so the version check
+        is done on the latest committed value.
+        If version is not specified, then the version is incremented unconditionally.
+
+        :param race_id: nid of the race.
+
+        :param version: Version that was read by the caller before preparing the update.
+
+        :return: True if the version has been incremented, False if the race was modified by another writer.
+        """
+        query = """
+            MATCH (race:Race {nid: {race_id}})
+            SET race.version = coalesce(race.version, 0)
+            WITH race
+            WHERE {version} IS NULL OR race.version = {version}
+            SET race.version = race.version + 1
+            RETURN race.version AS version
+        """
+        res = self.graph.data(query, race_id=race_id, version=version)
+        if res:
+            self.bump_version()
+            return True
+        else:
+            return False
+
+    def add_participant(self, race_id, person_id, version, prev_nid=None, next_nid=None):
+        """
+        This method will add the participant for the person in the chain of arrivals of the race, in a single
+        transaction. The race version is claimed first, this takes the write lock on the race node. If the version is
+        no longer equal to version, then another writer has modified the chain and nothing is changed.
+
+        :param race_id: nid of the race.
+
+        :param person_id: nid of the person.
+
+        :param version: Race version that was read before the previous and next arrival were calculated.
+
+        :param prev_nid: nid of the participant of the previous arrival, or None if this is the first arrival.
+
+        :param next_nid: nid of the participant of the next arrival, or None if this is the last arrival.
+
+        :return: Participant node, or False if the race was modified by another writer.
+        """
+        tx = self.graph.begin()
+        query = """
+            MATCH (race:Race {nid: {race_id}})
+            SET race.version = coalesce(race.version, 0)
+            WITH race
+            WHERE race.version = {version}
+            SET race.version = race.version + 1
+            RETURN race.version AS version
+        """
+        if not tx.run(query, race_id=race_id, version=version).data():
+            tx.rollback()
+            return False
+        if prev_nid and next_nid:
+            query = """
+                MATCH (next_part:Participant {nid: {next_nid}})-[rel:after]->(prev_part:Participant {nid: {prev_nid}})
+                DELETE rel
+            """
+            tx.run(query, prev_nid=prev_nid, next_nid=next_nid)
+        query = """
+            MATCH (race:Race {nid: {race_id}}), (person:Person {nid: {person_id}})
+            CREATE (person)-[:is]->(part:Participant {nid: {nid}})-[:participates]->(race)
+            WITH part
+            OPTIONAL MATCH (prev_part:Participant {nid: {prev_nid}})
+            FOREACH (prev IN CASE WHEN prev_part IS NULL THEN [] ELSE [prev_part] END |
+                CREATE (part)-[:after]->(prev))
+            WITH part
+            OPTIONAL MATCH (next_part:Participant {nid: {next_nid}})
+            FOREACH (next IN CASE WHEN next_part IS NULL THEN [] ELSE [next_part] END |
+                CREATE (next)-[:after]->(part))
+            RETURN part
+        """
+        nid = str(uuid.uuid4())
+        res = tx.run(query, race_id=race_id, person_id=person_id, nid=nid,
+                     prev_nid=prev_nid or None, next_nid=next_nid or None).data()
+        if not res:
+            logging.error("Race {r} or person {p} not found".format(r=race_id, p=person_id))
+            tx.rollback()
+            return False
+        # The derived attributes are set in the same transaction, so that lists and points find the participant.
+        (_, part_query) = self.derived_queries(part_id=nid)
+        query = part_query + self.derived_set("part", self.part_derived) + " RETURN part"
+        res = tx.run(query, part_id=nid).data()
+        tx.commit()
+        self.bump_version()
+        return res[0]["part"]
+
+    def remove_participant(self, race_id, part_id, version):
+        """
+        This method will remove the participant from the chain of arrivals of the race, in a single transaction. The
+        race version is claimed first, as in add_participant(). The previous and next arrival are linked and the
+        participant node is removed.
+
+        :param race_id: nid of the race.
+
+        :param part_id: nid of the participant.
+
+        :param version: Race version that was read before the removal.
+
+        :return: True if the participant is removed, False if the race was modified by another writer.
+        """
+        tx = self.graph.begin()
+        query = """
+            MATCH (race:Race {nid: {race_id}})
+            SET race.version = coalesce(race.version, 0)
+            WITH race
+            WHERE race.version = {version}
+            SET race.version = race.version + 1
+            RETURN race.version AS version
+        """
+        if not tx.run(query, race_id=race_id, version=version).data():
+            tx.rollback()
+            return False
+        query = """
+            MATCH (part:Participant {nid: {part_id}})
+            OPTIONAL MATCH (part)-[:after]->(prev_part:Participant)
+            OPTIONAL MATCH (next_part:Participant)-[:after]->(part)
+            FOREACH (next IN CASE WHEN prev_part IS NULL OR next_part IS NULL THEN [] ELSE [next_part] END |
+                CREATE (next)-[:after]->(prev_part))
+            DETACH DELETE part
+        """
+        tx.run(query, part_id=part_id)
+        tx.commit()
+        self.bump_version()
+        return True
+
+    def get_current_season(self):
+        """
+        This method will return the most recent season with organizations.
+
+        :return: Name of the season, or False if no organization has a season.
+        """
+        query = "MATCH (org:Organization) WHERE EXISTS(org.season) RETURN max(org.season) AS season"
+        res = self.graph.data(query)
+        if res and res[0]["season"]:
+            return res[0]["season"]
+        return False
+
+    def get_seasons(self):
+        """
+        This method will return the seasons with organizations, and the archive timestamp for archived seasons.
+
+        :return: List of dictionaries with season name and archived (timestamp or None), most recent season first.
+        """
+        query = """
+            MATCH (org:Organization) WHERE EXISTS(org.season)
+            WITH DISTINCT org.season AS season
+            OPTIONAL MATCH (s:Season {name: season})
+            RETURN season, s.archived AS archived
+            ORDER BY season DESC
+        """
+        return self.graph.data(query)
+
+    def set_seasons(self, start_month):
+        """
+        This method will set the season for organizations that do not have a season yet. The season is calculated from
+        the organization date.
+
+        :param start_month: First month of the season. Dates before this month belong to the previous season.
+
+        :return: Number of organizations updated.
+        """
+        query = """
+            MATCH (org:Organization)-[:On]->(day:Day)
+            WHERE NOT EXISTS(org.season)
+            WITH org, CASE WHEN day.month >= {start_month} THEN day.year ELSE day.year - 1 END AS year
+            SET org.season = toString(year) + '-' + toString(year + 1)
+            RETURN count(org) AS cnt
+        """
+        res = self.graph.data(query, start_month=start_month)
+        if res[0]["cnt"]:
+            self.set_derived()
+        return res[0]["cnt"]
+
+    def get_season_archive(self, season):
+        """
+        This method will return the archived standings for the season.
+
+        :param season: Name of the season.
+
+        :return: Standings as JSON string, or False if the season is not archived.
+        """
+        query = "MATCH (s:Season {name: {season}}) RETURN s.standings AS standings"
+        res = self.graph.data(query, season=season)
+        if res and res[0]["standings"]:
+            return res[0]["standings"]
+        return False
+
+    def set_season_archive(self, season, standings):
+        """
+        This method will store the standings for the season in the Season node.
+
+        :param season: Name of the season.
+
+        :param standings: Standings as JSON string.
+
+        :return:
+        """
+        query = """
+            MERGE (s:Season {name: {season}})
+            ON CREATE SET s.nid = {nid}
+            SET s.standings = {standings}, s.archived = {archived}
+        """
+        self.graph.run(query, season=season, standings=standings, nid=str(uuid.uuid4()),
+                       archived=datetime.now().strftime("%Y-%m-%d %H:%M"))
+        self.bump_version()
+        return
+
+    def get_race_nids(self, season=None, person_nids=None):
+        """
+        This method will return the nids of the races in the season.
+
+        :param season: Name of the season, or None for all seasons.
+
+        :param person_nids: List of person nids to return only the races with one of the persons as participant, or
+        None for all races.
+
+        :return: List of race nids, in sequence of organization date.
+        """
+        if person_nids is None:
+            match = ""
+        else:
+            match = "MATCH (person:Person)-[:is]->(:Participant)-[:participates]->(race) " \
+                    "WHERE person.nid IN {person_nids}"
+        query = """
+            MATCH (org:Organization)-[:has]->(race:Race),
+                  (org)-[:On]->(day:Day)
+            WHERE {{season}} IS NULL OR org.season = {{season}}
+            {match}
+            RETURN DISTINCT race.nid AS nid, day.key AS day_key, race.seq AS seq
+            ORDER BY day_key, seq
+        """.format(match=match)
+        return [rec["nid"] for rec in self.graph.data(query, season=season, person_nids=person_nids)]
+
+    def get_scoring_fingerprint(self):
+        """
+        This method will return the fingerprint of the scoring rules that were used to calculate the points.
+
+        :return: Fingerprint, or False if no fingerprint has been stored.
+        """
+        query = "MATCH (s:Scoring {name: 'rules'}) RETURN s.fingerprint AS fingerprint"
+        res = self.graph.data(query)
+        if res and res[0]["fingerprint"]:
+            return res[0]["fingerprint"]
+        return False
+
+    def set_scoring_fingerprint(self, fingerprint):
+        """
+        This method will store the fingerprint of the scoring rules that are used to calculate the points.
+
+        :param fingerprint: Fingerprint of the scoring rules.
+
+        :return:
+        """
+        query = """
+            MERGE (s:Scoring {name: 'rules'})
+            ON CREATE SET s.nid = {nid}
+            SET s.fingerprint = {fingerprint}
+        """
+        self.graph.run(query, fingerprint=fingerprint, nid=str(uuid.uuid4()))
+        return
+
+    def set_points(self, points):
+        """
+        This method will set points and relative position for the participants in a single statement.
+
+        :param points: List of dictionaries with participant nid, points and rel_pos.
+
+        :return: Number of participants that have been updated.
+        """
+        if not points:
+            return 0
+        query = """
+            UNWIND {points} AS row
+            MATCH (part:Participant {nid: row.nid})
+            SET part.points = row.points, part.rel_pos = row.rel_pos
+            RETURN count(part) AS cnt
+        """
+        res = self.graph.data(query, points=points)
+        self.bump_version()
+        return res[0]["cnt"]
+
     def get_race_seq(self, race_id):
         """
         This method will calculate the sequence for the race with nid race_id. The calculated sequence is the lowest
@@ -580,25 +1748,24 @@ class NeoStore:
         :return: Node nid of the start Node, or False.
         """
         # Todo: try to phase out this method in favour of get_startnode, a method that works on nodes instead of IDs.
-        # First get Node from end node ID
-        end_node = self.node(end_node_id)
-        if end_node:
-            # Then get relation to end node.
-            try:
-                rel = next(item for item in self.graph.match(end_node=end_node, rel_type=rel_type))
-            except StopIteration:
-                logging.warning("No start node found for end node ID {nid} and relation {rel}"
-                                .format(nid=end_node_id, rel=rel_type))
-            else:
-                # Check if there are more elements in the iterator.
-                if len([item for item in self.graph.match(end_node=end_node, rel_type=rel_type)]) > 1:
-                    logging.warning("More than one start node found for end node ID {nid} and relation {rel},"
-                                    " returning first".format(nid=end_node_id, rel=rel_type))
-                start_node_id = self.node_id(rel.start_node())
-                return start_node_id
-        else:
+        query = """
+            MATCH (node {{nid: {{nid}}}})
+            OPTIONAL MATCH {pattern}
+            RETURN other.nid AS nid
+            LIMIT 2
+        """.format(pattern=self.relation_pattern(rel_type, outgoing=False))
+        res = self.graph.data(query, nid=end_node_id)
+        if not res:
             logging.error("Non-existing end node ID: {end_node_id}".format(end_node_id=end_node_id))
             return False
+        if res[0]["nid"] is None:
+            logging.warning("No start node found for end node ID {nid} and relation {rel}"
+                            .format(nid=end_node_id, rel=rel_type))
+            return False
+        if len(res) > 1:
+            logging.warning("More than one start node found for end node ID {nid} and relation {rel},"
+                            " returning first".format(nid=end_node_id, rel=rel_type))
+        return res[0]["nid"]
 
     def get_startnode(self, end_node=None, rel_type=None):
         """
@@ -613,18 +1780,21 @@ class NeoStore:
 
         :return: Start Node, or False.
         """
-        try:
-            rel = next(item for item in self.graph.match(end_node=end_node, rel_type=rel_type))
-        except StopIteration:
-            logging.warning("No start node found for end node ID {nid} and relation {rel}"
-                            .format(nid=end_node["nid"], rel=rel_type))
-            return False
-        else:
-            # Check if there are more elements in the iterator.
-            if len([item for item in self.graph.match(end_node=end_node, rel_type=rel_type)]) > 1:
-                logging.warning("More than one start node found for end node ID {nid} and relation {rel},"
-                                " returning first".format(nid=end_node["nid"], rel=rel_type))
-            return rel.start_node()
+        return self.get_relnode(end_node, rel_type, outgoing=False)
+
+    def get_startnode_map(self, end_nodes, rel_type=None):
+        """
+        This method will calculate the start node for a list of end nodes and a relation type in a single query.
+        This is the batched version of get_startnode.
+
+        :param end_nodes: List of end nodes.
+
+        :param rel_type: Relation type
+
+        :return: Dictionary with end node nid as key and start node as value. End nodes without start node are not in
+        the dictionary.
+        """
+        return self.get_relnode_map(end_nodes, rel_type, outgoing=False)
 
     def get_startnodes(self, end_node=None, rel_type=None):
         """
@@ -665,6 +1835,14 @@ class NeoStore:
         stmt = "CREATE CONSTRAINT ON (n:{nid_label}) ASSERT n.nid IS UNIQUE"
         for nid_label in nid_labels:
             self.graph.run(stmt.format(nid_label=nid_label))
+        self.graph.run("CREATE INDEX ON :Organization(season)")
+        self.graph.run("CREATE INDEX ON :Organization(name)")
+        self.graph.run("CREATE INDEX ON :Day(key)")
+        # Derived attributes, see set_derived().
+        self.graph.run("CREATE INDEX ON :Participant(cat_nid)")
+        self.graph.run("CREATE INDEX ON :Participant(person_nid)")
+        self.graph.run("CREATE CONSTRAINT ON (n:Season) ASSERT n.name IS UNIQUE")
+        self.bump_version()
 
         # RaceType
         """
@@ -771,6 +1949,7 @@ class NeoStore:
                 my_node[prop] = properties[prop]
             # Now push the changes to Neo4J database.
             self.graph.push(my_node)
+            self.bump_version()
             return True
         else:
             logging.error("No node found for NID {nid}".format(nid=properties["nid"]))
@@ -787,25 +1966,26 @@ class NeoStore:
 
         :return: Updated node if successful, False otherwise.
         """
-        try:
-            my_node = self.node(properties["nid"])
-        except KeyError:
+        if "nid" not in properties:
             logging.error("Attribute 'nid' missing, required in dictionary.")
             return False
-        if isinstance(my_node, Node):
-            curr_props = self.node_props(properties["nid"])
-            # Remove properties
-            remove_props = [prop for prop in curr_props if prop not in properties]
-            for prop in remove_props:
-                # Set value to None to remove a key.
-                del my_node[prop]
-            # Modify properties and add new properties
-            # So I'm sure that nid is still in the property dictionary
-            for prop in properties:
-                my_node[prop] = properties[prop]
-            # Now push the changes to Neo4J database.
-            self.graph.push(my_node)
-            return my_node
+        # The write version of a race is maintained by set_race_version and add_participant, the derived attributes
+        # by set_derived. They are kept as is. The first SET takes the write lock, so that the kept values are not
+        # read before the update.
+        kept = ["version"] + sorted(set(attr for (attr, _) in self.race_derived + self.part_derived))
+        props = {key: value for (key, value) in properties.items() if key not in kept and value is not None}
+        query = """
+            MATCH (node {{nid: {{nid}}}})
+            SET node.version = node.version
+            WITH node, {{{kept}}} AS kept
+            SET node = {{props}}
+            SET node += kept
+            RETURN node
+        """.format(kept=", ".join("{a}: node.{a}".format(a=attr) for attr in kept))
+        res = self.graph.data(query, nid=properties["nid"], props=props)
+        if res:
+            self.bump_version()
+            return res[0]["node"]
         else:
             logging.error("No node found for NID {nid}".format(nid=properties["nid"]))
             return False
@@ -836,6 +2016,7 @@ class NeoStore:
         if isinstance(node, Node):
             if self.graph.degree(node) == 0:
                 self.graph.delete(node)
+                self.bump_version()
                 return True
             else:
                 msg = "Request to delete node nid {node_id}, but {x} relations found. Node not deleted"\
@@ -857,6 +2038,7 @@ class NeoStore:
         """
         query = "MATCH (n) WHERE n.nid='{nid}' DETACH DELETE n".format(nid=nid)
         self.graph.run(query)
+        self.bump_version()
         return
 
     def remove_relation(self, start_nid=None, end_nid=None, rel_type=None):
@@ -880,6 +2062,7 @@ class NeoStore:
             DELETE rel_type
         """.format(rel_type=rel_type, start_nid=start_nid, end_nid=end_nid)
         self.graph.run(query)
+        self.bump_version()
         return
 
     def remove_relation_node(self, start_node=None, end_node=None, rel_type=None):
@@ -900,6 +2083,7 @@ class NeoStore:
         # Do I need to merge first?
         self.graph.merge(rel)
         self.graph.separate(rel)
+        self.bump_version()
         return
 
     def set_node_nid(self, node_id):
@@ -910,26 +2094,10 @@ class NeoStore:
         """
         query = "MATCH (n) WHERE id(n)={node_id} SET n.nid='{nid}' RETURN n.nid"
         self.graph.run(query.format(node_id=node_id, nid=str(uuid.uuid4())))
+        self.bump_version()
         return
 
 
-def nodelist_from_cursor(cursor):
-    """
-    The py2neo Cursor will return a result list that is not necessarily unique. This function gets a cursor from
-    a query where the cypher return argument is a single node. The function will return the list of unique nodes.
-
-    :param cursor: Result of a query with single node per result line.
-
-    :return: list of unique nodes, or empty list if there are no nodes.
-    """
-    node_list = set()
-    while cursor.forward():
-        current = cursor.current()
-        (node, ) = current.values()
-        node_list.add(node)
-    return list(node_list)
-
-
 def validate_node(node, label):
     """
     BE CAREFUL: has_label does not always work for unknown reason.
@@ -0,0 +1,108 @@
+"""
+This class consolidates the cache for rendered pages. Pages are stored compressed, together with the data version for
+which they were rendered. A page rendered for an older data version is not returned. The cache is limited in number of
+pages and in total compressed size, the least recently used pages are removed first.
+"""
+
+import logging
+import threading
+import zlib
+from collections import OrderedDict
+
+
+class PageCache:
+
+    def __init__(self, max_entries=64, max_bytes=4 * 1024 * 1024):
+        """
+        Method to instantiate the page cache.
+
+        :param max_entries: Maximum number of pages in the cache.
+
+        :param max_bytes: Maximum total size of the compressed pages in the cache.
+
+        :return: Object to handle page cache commands.
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.pages = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        return
+
+    def get(self, key, version):
+        """
+        This method will return the page for the key, on condition that it was rendered for the data version.
+
+        :param key: Key of the page, e.g. route name and arguments.
+
+        :param version: Current data version.
+
+        :return: Rendered page (string), or False if the page is not in the cache for this version.
+        """
+        with self.lock:
+            try:
+                (page_version, data) = self.pages[key]
+            except KeyError:
+                self.misses += 1
+                return False
+            if page_version != version:
+                self.remove(key)
+                self.misses += 1
+                return False
+            self.pages.move_to_end(key)
+            self.hits += 1
+        return zlib.decompress(data).decode("utf-8")
+
+    def put(self, key, version, page):
+        """
+        This method will add the rendered page to the cache. Least recently used pages are removed if the cache exceeds
+        the limits. A page that is larger than the cache is not stored.
+
+        :param key: Key of the page.
+
+        :param version: Data version for which the page was rendered.
+
+        :param page: Rendered page (string).
+
+        :return:
+        """
+        data = zlib.compress(page.encode("utf-8"))
+        if len(data) > self.max_bytes:
+            logging.warning("Page {key} too large for cache ({s} bytes)".format(key=key, s=len(data)))
+            return
+        with self.lock:
+            self.remove(key)
+            self.pages[key] = (version, data)
+            self.size += len(data)
+            while len(self.pages) > self.max_entries or self.size > self.max_bytes:
+                (_, (_, old_data)) = self.pages.popitem(last=False)
+                self.size -= len(old_data)
+        return
+
+    def remove(self, key):
+        """
+        This method will remove the page from the cache. Must be called with the lock acquired.
+
+        :param key: Key of the page.
+
+        :return:
+        """
+        try:
+            (_, data) = self.pages.pop(key)
+        except KeyError:
+            return
+        self.size -= len(data)
+        return
+
+    def clear(self):
+        """
+        This method will remove all pages from the cache.
+
+        :return:
+        """
+        with self.lock:
+            self.pages.clear()
+            self.size = 0
+        return
@@ -0,0 +1,126 @@
+"""
+This class consolidates the search index for person names. The index is kept in memory: every name is split in
+trigrams, a search is a lookup of the trigrams of the query followed by a ranking of the candidates. Upper case and
+accents are ignored, so 'baill' finds 'Jan Baillevier' and 'noel' finds 'Noël'.
+
+Ranking: names where a word starts with the query first, then names that contain the query, then names that share
+most trigrams with the query (typing errors). Names that share less than half of the trigrams are not returned.
+"""
+
+import threading
+import unicodedata
+
+
+def normalize(name):
+    """
+    This function will convert the name to lower case without accents.
+
+    :param name: Name of a person or query string.
+
+    :return: Normalized name.
+    """
+    name = unicodedata.normalize("NFKD", name.strip().lower())
+    return "".join(char for char in name if not unicodedata.combining(char))
+
+
+def trigrams(name):
+    """
+    This function will return the trigrams for the normalized name. The name is padded, so that the start of a word
+    gives a trigram with a space.
+
+    :param name: Normalized name.
+
+    :return: Set of trigrams.
+    """
+    padded = "  " + name + " "
+    return {padded[pos:pos + 3] for pos in range(len(padded) - 2)}
+
+
+class PersonIndex:
+
+    def __init__(self):
+        """
+        Method to instantiate the person index. The index is empty until it is loaded.
+
+        :return: Object to handle person search commands.
+        """
+        self.lock = threading.Lock()
+        self.version = None
+        self.names = {}
+        self.grams = {}
+        return
+
+    def load(self, persons, version=None):
+        """
+        This method will replace the index with the persons.
+
+        :param persons: List of dictionaries with nid and name.
+
+        :param version: Data version for which the index is loaded.
+
+        :return:
+        """
+        names = {}
+        grams = {}
+        for person in persons:
+            norm = normalize(person["name"])
+            names[person["nid"]] = (person["name"], norm)
+            for gram in trigrams(norm):
+                grams.setdefault(gram, set()).add(person["nid"])
+        with self.lock:
+            self.names = names
+            self.grams = grams
+            self.version = version
+        return
+
+    def get_names(self, nids):
+        """
+        This method will return the names for the person nids.
+
+        :param nids: List of person nids.
+
+        :return: Dictionary with nid as key and name as value, for the nids in the index.
+        """
+        with self.lock:
+            names = self.names
+        return {nid: names[nid][0] for nid in nids if nid in names}
+
+    def search(self, query, limit=10, nids=None):
+        """
+        This method will return the persons that best match the query.
+
+        :param query: Part of the name.
+
+        :param limit: Maximum number of persons returned.
+
+        :param nids: Set of person nids to search in, or None to search all persons.
+
+        :return: List of dictionaries with nid and name, best match first.
+        """
+        norm = normalize(query)
+        if not norm:
+            return []
+        with self.lock:
+            names = self.names
+            grams = self.grams
+        query_grams = trigrams(norm)
+        counts = {}
+        for gram in query_grams:
+            for nid in grams.get(gram, ()):
+                counts[nid] = counts.get(nid, 0) + 1
+        ranked = []
+        for nid, cnt in counts.items():
+            if nids is not None and nid not in nids:
+                continue
+            (name, person_norm) = names[nid]
+            if person_norm.startswith(norm) or (" " + norm) in person_norm:
+                rank = 0
+            elif norm in person_norm:
+                rank = 1
+            elif cnt * 2 >= len(query_grams):
+                rank = 2
+            else:
+                continue
+            ranked.append((rank, -cnt / len(query_grams), name, nid))
+        ranked.sort()
+        return [dict(nid=nid, name=name) for (_, _, name, nid) in ranked[:limit]]
@@ -0,0 +1,206 @@
+"""
+This class consolidates the publishing of changes to subscribed browsers. A change is serialized once and then handed
+to every subscriber on the channel, so the number of viewers does not add to the cost of the change. The subscribers
+receive the changes as Server-Sent Events.
+
+Every stream holds a request thread of the web server, so the number of streams is limited and a stream is closed
+after a while. The browser then connects again. Changes published in another worker process are not received by this
+publisher: the streams poll the shared data version and the publisher refreshes its channels when the version changed.
+"""
+
+import json
+import logging
+import queue
+import threading
+import time
+import uuid
+
+
+class Publisher:
+
+    def __init__(self, maxsize=20, version=None, refresh=None, poll=2):
+        """
+        Method to instantiate the publisher.
+
+        :param maxsize: Maximum number of messages waiting for a subscriber. If a subscriber is slower, then the oldest
+        message is dropped. Each message has the full state of the channel, so the subscriber only misses intermediate
+        states.
+
+        :param version: Function that returns the data version shared by the worker processes, or None.
+
+        :param refresh: Function that publishes the current state of a channel, called with the channel name if the
+        data version has changed.
+
+        :param poll: Seconds between checks of the data version.
+
+        :return: Object to handle publisher commands.
+        """
+        self.maxsize = maxsize
+        self.version = version
+        self.refresh = refresh
+        self.poll = poll
+        self.lock = threading.Lock()
+        self.channels = {}
+        # Open streams, token with time after which the stream is closed.
+        self.streams = {}
+        self.seen = None
+        self.checked = 0
+        return
+
+    def subscribe(self, channel):
+        """
+        This method will register a subscriber on the channel.
+
+        :param channel: Name of the channel, e.g. race:<race_id>
+
+        :return: Queue on which the messages for the subscriber will arrive.
+        """
+        q = queue.Queue(maxsize=self.maxsize)
+        with self.lock:
+            self.channels.setdefault(channel, set()).add(q)
+        logging.debug("Subscriber added to channel {c}".format(c=channel))
+        return q
+
+    def unsubscribe(self, channel, q):
+        """
+        This method will remove the subscriber from the channel.
+
+        :param channel: Name of the channel.
+
+        :param q: Queue that was returned on subscribe.
+
+        :return:
+        """
+        with self.lock:
+            subscribers = self.channels.get(channel, set())
+            subscribers.discard(q)
+            if not subscribers:
+                self.channels.pop(channel, None)
+        logging.debug("Subscriber removed from channel {c}".format(c=channel))
+        return
+
+    def has_subscribers(self, channel):
+        """
+        This method will check if there are subscribers on the channel. This allows to skip the calculation of a change
+        if no one is listening.
+
+        :param channel: Name of the channel.
+
+        :return: True if there are subscribers, False otherwise.
+        """
+        with self.lock:
+            return channel in self.channels
+
+    def publish(self, channel, event, data):
+        """
+        This method will send the data to all subscribers on the channel. The data is converted to a Server-Sent Event
+        message once.
+
+        :param channel: Name of the channel.
+
+        :param event: Event name, e.g. finishers or standings.
+
+        :param data: Data for the event, must be serializable to JSON.
+
+        :return: Number of subscribers that received the message.
+        """
+        msg = "event: {event}\ndata: {data}\n\n".format(event=event, data=json.dumps(data))
+        with self.lock:
+            subscribers = list(self.channels.get(channel, set()))
+        for q in subscribers:
+            try:
+                q.put_nowait(msg)
+            except queue.Full:
+                # Slow subscriber, drop oldest message.
+                try:
+                    q.get_nowait()
+                except queue.Empty:
+                    pass
+                q.put_nowait(msg)
+        return len(subscribers)
+
+    def check(self):
+        """
+        This method will refresh the channels with subscribers if the data version has changed, e.g. by a write in
+        another worker process. The version is checked at most once per poll interval for all streams.
+
+        :return: Number of channels that have been refreshed.
+        """
+        if not (self.version and self.refresh):
+            return 0
+        now = time.time()
+        with self.lock:
+            if now < self.checked + self.poll:
+                return 0
+            self.checked = now
+        version = self.version()
+        with self.lock:
+            changed = self.seen is not None and version != self.seen
+            self.seen = version
+            channels = list(self.channels) if changed else []
+        for channel in channels:
+            try:
+                self.refresh(channel)
+            except Exception:
+                logging.exception("Refresh of channel {c} failed".format(c=channel))
+        return len(channels)
+
+    def stream(self, channel, keepalive=15, lifetime=300, max_streams=50):
+        """
+        This method will open a stream on the channel. A stream that did not end properly, e.g. because the browser
+        disconnected before the first message, is no longer counted after its lifetime.
+
+        :param channel: Name of the channel.
+
+        :param keepalive: Seconds between keepalive messages.
+
+        :param lifetime: Seconds after which the stream is closed. The browser connects again after the retry time.
+
+        :param max_streams: Maximum number of open streams.
+
+        :return: Generator of Server-Sent Event messages, or None if the maximum number of streams is open.
+        """
+        now = time.time()
+        with self.lock:
+            for token in [token for (token, end) in self.streams.items() if end + self.poll < now]:
+                del self.streams[token]
+            if len(self.streams) >= max_streams:
+                logging.warning("Maximum number of streams open, stream for {c} refused".format(c=channel))
+                return None
+            token = uuid.uuid4().hex
+            self.streams[token] = now + lifetime
+        return self.events(channel, token, keepalive)
+
+    def events(self, channel, token, keepalive):
+        """
+        This method is the generator for a Server-Sent Events response. A comment line is sent if no message arrived
+        within keepalive seconds, so that the browser and proxies keep the connection open. The generator stops at the
+        end of the stream lifetime.
+
+        :param channel: Name of the channel.
+
+        :param token: Token of the stream, from stream().
+
+        :param keepalive: Seconds between keepalive messages.
+
+        :return: Generator of Server-Sent Event messages.
+        """
+        q = self.subscribe(channel)
+        try:
+            yield "retry: 5000\n\n"
+            wait = min(keepalive, self.poll)
+            sent = time.time()
+            while time.time() < self.streams.get(token, 0):
+                try:
+                    msg = q.get(timeout=wait)
+                except queue.Empty:
+                    self.check()
+                    if time.time() < sent + keepalive:
+                        continue
+                    msg = ": keepalive\n\n"
+                sent = time.time()
+                yield msg
+        finally:
+            self.unsubscribe(channel, q)
+            with self.lock:
+                self.streams.pop(token, None)
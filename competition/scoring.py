@@ -0,0 +1,136 @@
+"""
+This class consolidates the scoring rules for the competition. The rules are declared in a dictionary and converted
+into point tables once, so that the points for a race are a table lookup per finisher.
+
+Rules per race type:
+table: points for position 1, 2, 3, ...
+beyond: points for positions after the table.
+position: 'category' if the position is counted within the category of the runner, 'overall' if the position is
+counted over all finishers in the race.
+
+Rules for the standings:
+best_n: number of best results that are counted.
+surplus_bonus: points for every result above best_n.
+participation_points: points for every participation in a Deelname organization.
+org_bonus: bonus points for participation in an organization with this name.
+"""
+
+import hashlib
+import json
+import logging
+
+default_rules = {
+    "race_types": {
+        "Wedstrijd": {
+            "table": [25, 20, 18] + list(range(16, 0, -1)),
+            "beyond": 1,
+            "position": "category"
+        },
+        "Short": {
+            "table": [20, 17] + list(range(15, 0, -1)),
+            "beyond": 1,
+            "position": "overall"
+        },
+        "Deelname": {
+            "table": [],
+            "beyond": 20,
+            "position": "overall"
+        }
+    },
+    "default_points": 20,
+    "best_n": 6,
+    "surplus_bonus": 5,
+    "participation_points": 20,
+    "org_bonus": {
+        "PK": 3,
+        "BK": 5,
+        "MBK": -10
+    }
+}
+
+
+class ScoringRules:
+
+    def __init__(self, rules=None, max_positions=1000):
+        """
+        Method to instantiate the scoring rules. The point table for every race type is precomputed for max_positions
+        positions.
+
+        :param rules: Dictionary with the rules, see module documentation. Default rules are used if not specified.
+
+        :param max_positions: Length of the precomputed point tables.
+
+        :return: Object to handle scoring commands.
+        """
+        self.rules = rules or default_rules
+        self.tables = {}
+        self.position = {}
+        for race_type, rule in self.rules["race_types"].items():
+            table = list(rule["table"])[:max_positions]
+            table.extend([rule["beyond"]] * (max_positions - len(table)))
+            self.tables[race_type] = tuple(table)
+            self.position[race_type] = rule["position"]
+        self.beyond = {race_type: rule["beyond"] for race_type, rule in self.rules["race_types"].items()}
+        self.default_points = self.rules["default_points"]
+        self.best_n = self.rules["best_n"]
+        self.surplus_bonus = self.rules["surplus_bonus"]
+        self.participation_points = self.rules["participation_points"]
+        self.org_bonus = dict(self.rules["org_bonus"])
+        self.fingerprint = hashlib.sha1(json.dumps(self.rules, sort_keys=True).encode("utf-8")).hexdigest()
+        return
+
+    def points(self, race_type, pos):
+        """
+        This method will return the points for a position in a race.
+
+        :param race_type: Wedstrijd, Short or Deelname.
+
+        :param pos: Position in the race (first position is 1).
+
+        :return: Points for this position.
+        """
+        try:
+            table = self.tables[race_type]
+        except KeyError:
+            logging.error("Race Type {rt} not defined.".format(rt=race_type))
+            return self.default_points
+        try:
+            return table[pos - 1]
+        except IndexError:
+            return self.beyond[race_type]
+
+    def race_points(self, race_type, cat_nids):
+        """
+        This method will calculate the points for all finishers in a race.
+
+        :param race_type: Wedstrijd, Short or Deelname.
+
+        :param cat_nids: Category nid for every finisher, in sequence of arrival.
+
+        :return: List of tuples (points, rel_pos) in sequence of arrival. rel_pos is the overall position.
+        """
+        if race_type not in self.tables:
+            logging.error("Race Type {rt} not defined.".format(rt=race_type))
+            return [(self.default_points, cnt) for cnt in range(1, len(cat_nids) + 1)]
+        if self.position[race_type] == "category":
+            cat_cnt = {}
+            positions = []
+            for cat in cat_nids:
+                cat_cnt[cat] = cat_cnt.get(cat, 0) + 1
+                positions.append(cat_cnt[cat])
+        else:
+            positions = range(1, len(cat_nids) + 1)
+        return [(self.points(race_type, pos), cnt) for cnt, pos in enumerate(positions, start=1)]
+
+    def total(self, point_list):
+        """
+        This method will calculate the total of the points for a participant. The best_n results are counted, every
+        result above best_n gives the surplus bonus.
+
+        :param point_list: list of the points for the participant.
+
+        :return: sum of the points
+        """
+        max_list = sorted(point_list)[-self.best_n:]
+        add_points = max(len(point_list) - self.best_n, 0) * self.surplus_bonus
+        return sum(max_list) + add_points
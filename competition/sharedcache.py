@@ -0,0 +1,179 @@
+"""
+This class consolidates the cache that is shared by the worker processes of the application. It is a local SQLite
+database with the data version counters and the rendered pages. A write in one worker increments the data version for
+all workers, so pages and cached data from before the write are no longer used by any worker.
+
+The interface for the pages is the interface of the PageCache, so the shared cache can replace the page cache of a
+single process.
+"""
+
+import logging
+import sqlite3
+import threading
+import time
+import uuid
+import zlib
+from datetime import datetime
+
+
+class SharedCache:
+
+    def __init__(self, path, max_entries=256, max_bytes=16 * 1024 * 1024, timeout=10, touch=60):
+        """
+        Method to instantiate the shared cache. The database is created if it does not exist.
+
+        :param path: Filename of the SQLite database.
+
+        :param max_entries: Maximum number of pages in the cache.
+
+        :param max_bytes: Maximum total size of the compressed pages in the cache.
+
+        :param timeout: Seconds to wait for a lock held by another worker.
+
+        :param touch: Seconds after which a cache hit updates the time of last use of the page. A read does not take
+        the write lock for a page that has been used recently.
+
+        :return: Object to handle shared cache commands.
+        """
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        self.touch = touch
+        self.local = threading.local()
+        self.hits = 0
+        self.misses = 0
+        cur = self.connection()
+        cur.execute("CREATE TABLE IF NOT EXISTS versions (name TEXT PRIMARY KEY, version INTEGER, modified TEXT)")
+        cur.execute("CREATE TABLE IF NOT EXISTS pages (key TEXT PRIMARY KEY, version TEXT, data BLOB, used REAL)")
+        cur.execute("CREATE INDEX IF NOT EXISTS pages_used ON pages (used)")
+        # Start token distinguishes the versions of this cache from the versions of a cache that has been removed.
+        cur.execute("INSERT OR IGNORE INTO versions (name, version, modified) VALUES ('start', 0, ?)",
+                    (uuid.uuid4().hex[:8],))
+        self.start = cur.execute("SELECT modified FROM versions WHERE name = 'start'").fetchone()[0]
+        return
+
+    def connection(self):
+        """
+        This method will return the database connection for the current thread. SQLite connections cannot be shared
+        between threads.
+
+        :return: Connection in autocommit mode.
+        """
+        try:
+            return self.local.cnx
+        except AttributeError:
+            cnx = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            cnx.execute("PRAGMA journal_mode=WAL")
+            cnx.execute("PRAGMA synchronous=NORMAL")
+            self.local.cnx = cnx
+            return cnx
+
+    def bump_version(self, name="data"):
+        """
+        This method will increment the version counter. Pages rendered for an older data version are removed.
+
+        :param name: Name of the counter, e.g. data or users.
+
+        :return: New version.
+        """
+        cnx = self.connection()
+        modified = datetime.utcnow().replace(microsecond=0).isoformat()
+        with cnx:
+            cnx.execute("BEGIN IMMEDIATE")
+            cnx.execute("INSERT OR IGNORE INTO versions (name, version, modified) VALUES (?, 0, ?)", (name, modified))
+            cnx.execute("UPDATE versions SET version = version + 1, modified = ? WHERE name = ?", (modified, name))
+            version = cnx.execute("SELECT version FROM versions WHERE name = ?", (name,)).fetchone()[0]
+            if name == "data":
+                tag = "{start}-{version}".format(start=self.start, version=version)
+                cnx.execute("DELETE FROM pages WHERE version != ?", (tag,))
+        return version
+
+    def get_version(self, name="data"):
+        """
+        This method will return the version counter and the time of the last increment.
+
+        :param name: Name of the counter.
+
+        :return: Tuple with version tag (string) and UTC datetime of the last increment.
+        """
+        res = self.connection().execute("SELECT version, modified FROM versions WHERE name = ?", (name,)).fetchone()
+        if res:
+            (version, modified) = res
+            modified = datetime.strptime(modified, "%Y-%m-%dT%H:%M:%S")
+        else:
+            version = 0
+            modified = datetime(1970, 1, 1)
+        return "{start}-{version}".format(start=self.start, version=version), modified
+
+    def get(self, key, version):
+        """
+        This method will return the page for the key, on condition that it was rendered for the data version.
+
+        :param key: Key of the page, e.g. route name and arguments.
+
+        :param version: Current data version.
+
+        :return: Rendered page (string), or False if the page is not in the cache for this version.
+        """
+        cnx = self.connection()
+        res = cnx.execute("SELECT data, used FROM pages WHERE key = ? AND version = ?",
+                          (repr(key), str(version))).fetchone()
+        if not res:
+            self.misses += 1
+            return False
+        (data, used) = res
+        now = time.time()
+        if now - used >= self.touch:
+            cnx.execute("UPDATE pages SET used = ? WHERE key = ?", (now, repr(key)))
+        self.hits += 1
+        return zlib.decompress(data).decode("utf-8")
+
+    def put(self, key, version, page):
+        """
+        This method will add the rendered page to the cache. Least recently used pages are removed if the cache exceeds
+        the limits. Pages for older versions are removed on bump_version.
+
+        :param key: Key of the page.
+
+        :param version: Data version for which the page was rendered.
+
+        :param page: Rendered page (string).
+
+        :return:
+        """
+        data = zlib.compress(page.encode("utf-8"))
+        if len(data) > self.max_bytes:
+            logging.warning("Page {key} too large for cache ({s} bytes)".format(key=key, s=len(data)))
+            return
+        cnx = self.connection()
+        with cnx:
+            cnx.execute("BEGIN IMMEDIATE")
+            cnx.execute("INSERT OR REPLACE INTO pages (key, version, data, used) VALUES (?, ?, ?, ?)",
+                        (repr(key), str(version), data, time.time()))
+            while True:
+                (cnt, size) = cnx.execute("SELECT count(*), coalesce(sum(length(data)), 0) FROM pages").fetchone()
+                if cnt <= self.max_entries and size <= self.max_bytes:
+                    break
+                cnx.execute("DELETE FROM pages WHERE key = (SELECT key FROM pages ORDER BY used LIMIT 1)")
+        return
+
+    def remove(self, key):
+        """
+        This method will remove the page from the cache.
+
+        :param key: Key of the page.
+
+        :return:
+        """
+        self.connection().execute("DELETE FROM pages WHERE key = ?", (repr(key),))
+        return
+
+    def clear(self):
+        """
+        This method will remove all pages from the cache.
+
+        :return:
+        """
+        self.connection().execute("DELETE FROM pages")
+        return
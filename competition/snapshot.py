@@ -0,0 +1,124 @@
+"""
+This class consolidates the snapshots of the read pages. A snapshot is the most recent page that has been rendered
+for a key, whatever the data version. The snapshot is returned if the page cannot be rendered, e.g. when the Neo4J
+database is restarted for a backup. The snapshots are kept in memory, or in a local SQLite database so that they are
+shared by the worker processes and survive a restart of the application.
+"""
+
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from datetime import datetime
+
+
+class Snapshots:
+
+    def __init__(self, path=None, max_entries=256, timeout=10):
+        """
+        Method to instantiate the snapshot store.
+
+        :param path: Filename of the SQLite database, or None to keep the snapshots in memory.
+
+        :param max_entries: Maximum number of snapshots, the least recently rendered snapshots are removed first.
+
+        :param timeout: Seconds to wait for a lock held by another worker.
+
+        :return: Object to handle snapshot commands.
+        """
+        self.path = path
+        self.max_entries = max_entries
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.pages = OrderedDict()
+        if path:
+            self.connection().execute("""
+                CREATE TABLE IF NOT EXISTS snapshots (key TEXT PRIMARY KEY, version TEXT, data BLOB, rendered REAL)
+            """)
+        return
+
+    def connection(self):
+        """
+        This method will return the database connection for the current thread.
+
+        :return: Connection in autocommit mode.
+        """
+        try:
+            return self.local.cnx
+        except AttributeError:
+            cnx = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            cnx.execute("PRAGMA journal_mode=WAL")
+            cnx.execute("PRAGMA synchronous=NORMAL")
+            self.local.cnx = cnx
+            return cnx
+
+    def get(self, key):
+        """
+        This method will return the snapshot for the key.
+
+        :param key: Key of the page, e.g. route name and arguments.
+
+        :return: Tuple (page, data version, local datetime when the page was rendered), or False if there is no
+        snapshot for the key.
+        """
+        if self.path:
+            res = self.connection().execute("SELECT version, data, rendered FROM snapshots WHERE key = ?",
+                                            (repr(key),)).fetchone()
+        else:
+            with self.lock:
+                res = self.pages.get(key)
+        if not res:
+            return False
+        (version, data, rendered) = res
+        return zlib.decompress(data).decode("utf-8"), version, datetime.fromtimestamp(rendered)
+
+    def put(self, key, version, page):
+        """
+        This method will replace the snapshot for the key. Nothing is done if the snapshot was rendered for the same
+        data version already.
+
+        :param key: Key of the page.
+
+        :param version: Data version for which the page was rendered.
+
+        :param page: Rendered page (string).
+
+        :return:
+        """
+        if self.version(key) == str(version):
+            return
+        row = (str(version), zlib.compress(page.encode("utf-8")), time.time())
+        if self.path:
+            cnx = self.connection()
+            with cnx:
+                cnx.execute("BEGIN IMMEDIATE")
+                cnx.execute("INSERT OR REPLACE INTO snapshots (key, version, data, rendered) VALUES (?, ?, ?, ?)",
+                            (repr(key),) + row)
+                cnx.execute("""
+                    DELETE FROM snapshots WHERE key NOT IN
+                    (SELECT key FROM snapshots ORDER BY rendered DESC LIMIT ?)
+                """, (self.max_entries,))
+        else:
+            with self.lock:
+                self.pages.pop(key, None)
+                self.pages[key] = row
+                while len(self.pages) > self.max_entries:
+                    self.pages.popitem(last=False)
+        return
+
+    def version(self, key):
+        """
+        This method will return the data version of the snapshot for the key.
+
+        :param key: Key of the page.
+
+        :return: Data version (string), or None if there is no snapshot for the key.
+        """
+        if self.path:
+            res = self.connection().execute("SELECT version FROM snapshots WHERE key = ?", (repr(key),)).fetchone()
+        else:
+            with self.lock:
+                res = self.pages.get(key)
+        return res[0] if res else None
@@ -4,12 +4,14 @@ setup and initializing the config file.
 Also other utilities find their home here.
 """
 
+import atexit
 import configparser
 import datetime
 import logging
 import logging.handlers
 import os
 import platform
+import queue
 import sys
 
 
@@ -23,7 +25,11 @@ def init_env(projectname, filename):
     projectname = projectname
     modulename = get_modulename(filename)
     config = get_inifile(projectname)
-    my_log = init_loghandler(modulename, config["Main"]["logdir"], config["Main"]["loglevel"])
+    if config.has_section("Loglevels"):
+        loglevels = dict(config["Loglevels"])
+    else:
+        loglevels = None
+    my_log = init_loghandler(modulename, config["Main"]["logdir"], config["Main"]["loglevel"], loglevels=loglevels)
     my_log.info('Start Application')
     return config
 
@@ -73,28 +79,62 @@ def get_modulename(scriptname):
     return module
 
 
-def init_loghandler(scriptname, logdir, loglevel):
+# Default loglevels for chatty libraries. Can be overruled in init_loghandler.
+default_loglevels = {
+    "neo4j.bolt": "warning",
+    "httpstream": "warning"
+}
+# Queue listener and queue handler from the latest init_loghandler call.
+log_listener = None
+log_queue_handler = None
+
+
+class DropQueueHandler(logging.handlers.QueueHandler):
+    """
+    Queue handler on a bounded queue. If the queue is full, then the log record is dropped and counted, so that the
+    calling thread never waits for the log writer.
+    """
+
+    def __init__(self, q):
+        logging.handlers.QueueHandler.__init__(self, q)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def init_loghandler(scriptname, logdir, loglevel, loglevels=None, queuesize=10000):
     """
     This function initializes the loghandler. Logfilename consists of calling module name + computername.
     Logfile directory is read from the project .ini file.
     Format of the logmessage is specified in basicConfig function.
     This is for Log Handler configuration. If basic log file configuration is required, then use init_logfile.
     Review logger, there seems to be a conflict with the flask logger.
+    Log records are put on a bounded queue. A background thread writes the records to the rotating logfile, so the
+    calling thread does not wait on disk I/O or rotation. If the queue is full, records are dropped and counted.
     :param scriptname: Name of the calling module.
     :param logdir: Directory of the logfile.
     :param loglevel: The loglevel for logging.
+    :param loglevels: Dictionary with logger name and loglevel, for loggers that need a different loglevel.
+    :param queuesize: Maximum number of log records waiting for the writer thread.
     :return: logging handler
     """
+    global log_listener, log_queue_handler
     modulename = get_modulename(scriptname)
     loglevel = loglevel.upper()
     # Extract Computername
     computername = platform.node()
     # Define logfileName
     logfile = logdir + "/" + modulename + "_" + computername + ".log"
-    # Set loglevel for bolt driver to warning
-    logging.getLogger("neo4j.bolt").setLevel(logging.WARNING)
-    # logging.getLogger("neo4j.http").setLevel(logging.WARNING)
-    logging.getLogger("httpstream").setLevel(logging.WARNING)
+    # Set loglevel per logger, e.g. loglevel for bolt driver to warning
+    logger_levels = dict(default_loglevels)
+    if loglevels:
+        logger_levels.update(loglevels)
+    for logger_name, logger_level in logger_levels.items():
+        logging.getLogger(logger_name).setLevel(logging.getLevelName(logger_level.upper()))
     # Configure the root logger
     logger = logging.getLogger()
     level = logging.getLevelName(loglevel)
@@ -116,12 +156,56 @@ def init_loghandler(scriptname, logdir, loglevel):
     ch.setFormatter(formatter_console)
     # Add Formatter to Rotating File Handler
     rfh.setFormatter(formatter_file)
+    # Replace queue handler from a previous call, to avoid duplicate log records.
+    stop_loghandler()
     # Add Handler to the logger
     # logger.addHandler(ch)
-    logger.addHandler(rfh)
+    log_queue_handler = DropQueueHandler(queue.Queue(maxsize=queuesize))
+    log_listener = logging.handlers.QueueListener(log_queue_handler.queue, rfh, respect_handler_level=True)
+    log_listener.start()
+    logger.addHandler(log_queue_handler)
     return logger
 
 
+def stop_loghandler():
+    """
+    This function will write remaining log records to the logfile and stop the writer thread. The number of dropped
+    log records is reported in the logfile. This function is called on exit.
+    :return: Number of dropped log records.
+    """
+    global log_listener, log_queue_handler
+    dropped = 0
+    if log_queue_handler:
+        logging.getLogger().removeHandler(log_queue_handler)
+        dropped = log_queue_handler.dropped
+        log_queue_handler = None
+    if log_listener:
+        # Stop writes the records that are still on the queue.
+        log_listener.stop()
+        if dropped:
+            # The queue can still be full, so the record goes to the file handler directly instead of on the queue.
+            record = logging.makeLogRecord(dict(name=__name__, levelno=logging.WARNING, levelname="WARNING",
+                                                msg="{d} log records dropped, log queue full".format(d=dropped)))
+            log_listener.handle(record)
+        for handler in log_listener.handlers:
+            handler.close()
+        log_listener = None
+    return dropped
+
+
+def get_log_dropped():
+    """
+    This function returns the number of log records that have been dropped since init_loghandler.
+    :return: Number of dropped log records.
+    """
+    if log_queue_handler:
+        return log_queue_handler.dropped
+    return 0
+
+
+atexit.register(stop_loghandler)
+
+
 def datestr2date(datestr):
     """
     This method will convert datestring to date type. Datestring must be of the form YYYY-MM-DD
@@ -0,0 +1,66 @@
+"""
+This procedure will test the background job queue.
+"""
+
+import threading
+import unittest
+from competition import jobqueue
+from flask import Flask
+
+
+class TestJobQueue(unittest.TestCase):
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app_ctx = self.app.app_context()
+        self.app_ctx.push()
+        self.calls = []
+        self.release = threading.Event()
+
+    def tearDown(self):
+        self.release.set()
+        self.app_ctx.pop()
+
+    def handler(self, race_id):
+        self.release.wait(5)
+        self.calls.append(race_id)
+
+    def test_coalesce(self):
+        jq = jobqueue.JobQueue(self.handler, name="test")
+        # First job starts running and blocks, the next requests for the same race are combined into one job.
+        jq.submit("race_1")
+        jq.submit("race_1")
+        jq.submit("race_1")
+        jq.submit("race_2")
+        self.assertTrue(jq.is_busy("race_1"))
+        self.release.set()
+        self.assertTrue(jq.wait(timeout=5))
+        self.assertLessEqual(self.calls.count("race_1"), 2)
+        self.assertEqual(self.calls.count("race_2"), 1)
+        self.assertEqual(jq.get_status("race_1")["state"], "done")
+        self.assertFalse(jq.is_busy("race_1"))
+        self.assertFalse(jq.get_status("race_3"))
+
+    def test_failed_job(self):
+        def failing_handler(race_id):
+            raise ValueError("No race {r}".format(r=race_id))
+        jq = jobqueue.JobQueue(failing_handler, name="test_fail")
+        jq.submit("race_1")
+        self.assertTrue(jq.wait(timeout=5))
+        status = jq.get_status("race_1")
+        self.assertEqual(status["state"], "failed")
+        self.assertTrue("race_1" in status["error"])
+
+    def test_max_status(self):
+        jq = jobqueue.JobQueue(lambda race_id: None, name="test_max", max_status=2)
+        for race_id in ["race_1", "race_2", "race_3"]:
+            jq.submit(race_id)
+            self.assertTrue(jq.wait(timeout=5))
+        # Status of the oldest finished job is removed.
+        self.assertFalse(jq.get_status("race_1"))
+        self.assertEqual(jq.get_status("race_3")["state"], "done")
+        self.assertEqual(len(jq.status), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,138 @@
+"""
+This procedure will test the race-day journal.
+"""
+
+import os
+import tempfile
+import unittest
+from competition import journal
+
+
+class TestJournal(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.applied = []
+        self.chains = {}
+        self.fail = False
+        self.unavailable = False
+        self.journal = journal.Journal(os.path.join(self.tmpdir.name, "journal.db"), batch_size=2, max_attempts=2)
+        self.journal.handler = self.apply
+        # Sync is called by the tests, not by the sync thread.
+        self.journal.start = lambda: None
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def apply(self, race_id, person_id, prev_person_id, props):
+        if self.unavailable:
+            raise ConnectionRefusedError("Neo4J not available")
+        if self.fail:
+            raise ValueError("Person not found")
+        # Chain of arrivals per race, as Participant.add: "-1" for the first arrival, else the previous person.
+        chain = self.chains.setdefault(race_id, [])
+        if prev_person_id == "-1":
+            chain.insert(0, person_id)
+        else:
+            chain.insert(chain.index(prev_person_id) + 1, person_id)
+        self.applied.append((race_id, person_id, prev_person_id, props))
+
+    def test_append(self):
+        self.assertTrue(self.journal.append("r1", "p1", -1, dict(pos="1"), key="k1"))
+        # Same key is registered once.
+        self.assertFalse(self.journal.append("r1", "p1", -1, dict(pos="1"), key="k1"))
+        self.assertTrue(self.journal.append("r2", "p2", "p9"))
+        self.assertEqual([entry["person_id"] for entry in self.journal.pending()], ["p1", "p2"])
+        self.assertEqual(self.journal.pending(race_id="r1")[0]["props"], dict(pos="1"))
+        self.assertEqual(self.journal.status(), dict(pending=2, synced=0, failed=0, held=0))
+
+    def test_sync(self):
+        for cnt in range(3):
+            self.journal.append("r1", "p{c}".format(c=cnt), -1 if cnt == 0 else "p{c}".format(c=cnt - 1))
+        # Batches in sequence of entry.
+        self.assertEqual(self.journal.sync(), 2)
+        self.assertEqual(self.journal.sync(), 1)
+        self.assertEqual([entry[1] for entry in self.applied], ["p0", "p1", "p2"])
+        self.assertEqual(self.chains["r1"], ["p0", "p1", "p2"])
+        self.assertEqual(self.journal.status(), dict(pending=0, synced=3, failed=0, held=0))
+
+    def test_sync_first_arrival(self):
+        # A first arrival in a race with arrivals is added before the other arrivals.
+        self.journal.append("r1", "p1", -1)
+        self.journal.append("r1", "p2", "p1")
+        self.journal.append("r1", "p0", -1)
+        self.assertEqual(self.journal.sync(), 2)
+        self.assertEqual(self.journal.sync(), 1)
+        self.assertEqual(self.journal.status(), dict(pending=0, synced=3, failed=0, held=0))
+        self.assertEqual(self.chains["r1"], ["p0", "p1", "p2"])
+
+    def test_sync_failed(self):
+        self.journal.append("r1", "p1", -1)
+        self.journal.append("r1", "p2", "p1")
+        self.fail = True
+        # Batch stops at the first failure, the entry is retried.
+        self.assertEqual(self.journal.sync(), 0)
+        self.assertEqual(self.journal.status()["pending"], 2)
+        self.fail = False
+        self.assertEqual(self.journal.sync(), 2)
+        self.journal.append("r1", "p3", "p2")
+        self.fail = True
+        self.journal.sync()
+        self.journal.sync()
+        self.assertEqual(self.journal.status(), dict(pending=0, synced=2, failed=1, held=0))
+
+    def test_sync_held(self):
+        self.journal.append("r1", "p1", -1)
+        self.journal.append("r1", "p2", "p1")
+        self.journal.append("r2", "p3", -1)
+        self.fail = True
+        self.journal.sync()
+        self.journal.sync()
+        self.assertEqual(self.journal.failed(race_id="r1")[0]["error"], "Person not found")
+        # Next entries of the race are held, other races are applied.
+        self.fail = False
+        self.assertEqual(self.journal.sync(), 1)
+        self.assertEqual([entry[1] for entry in self.applied], ["p3"])
+        self.assertEqual(self.journal.status(), dict(pending=1, synced=1, failed=1, held=1))
+        self.assertEqual(self.journal.retry("r1"), 1)
+        self.assertEqual(self.journal.sync(), 2)
+        self.assertEqual([entry[1] for entry in self.applied], ["p3", "p1", "p2"])
+
+    def test_sync_unavailable(self):
+        self.journal.append("r1", "p1", -1)
+        self.unavailable = True
+        # Attempts are not counted while Neo4J is not available, the wait before the next attempt is doubled.
+        for cnt in range(5):
+            self.assertEqual(self.journal.sync(), 0)
+        self.assertEqual(self.journal.status(), dict(pending=1, synced=0, failed=0, held=0))
+        self.assertEqual(self.journal.pending()[0]["attempts"], 0)
+        self.assertEqual(self.journal.delay, 60)
+        self.unavailable = False
+        self.assertEqual(self.journal.sync(), 1)
+        self.assertEqual(self.journal.delay, self.journal.interval)
+
+    def test_lease(self):
+        other = journal.Journal(self.journal.path)
+        self.assertTrue(self.journal.acquire_lease())
+        self.assertFalse(other.acquire_lease())
+        self.assertIsNone(other.sync())
+        self.assertTrue(self.journal.acquire_lease())
+
+    def test_lease_lost(self):
+        self.journal.append("r1", "p1", -1)
+        self.journal.append("r1", "p2", "p1")
+        other = journal.Journal(self.journal.path)
+
+        def apply(race_id, person_id, prev_person_id, props):
+            self.applied.append(person_id)
+            # Lease expires while the entry is applied, another worker takes it.
+            self.journal.connection().execute("UPDATE lease SET expires = 0")
+            other.acquire_lease()
+
+        self.journal.handler = apply
+        self.assertEqual(self.journal.sync(), 1)
+        self.assertEqual(self.applied, ["p1"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -26,7 +26,7 @@ class TestModelGraphClass(unittest.TestCase):
         self.app_ctx.pop()
 
     def test_organization_add(self):
-        nr_nodes = len(self.ns.get_nodes())
+        nr_nodes = self.ns.count_nodes()
         # This function tests the organization.
         name = "Dwars door Hillesheim"
         city = "Hillesheim_X"
@@ -55,13 +55,17 @@ class TestModelGraphClass(unittest.TestCase):
         self.assertTrue(isinstance(org.get_label(), str))
         # Test Type organizatie
         self.assertEqual(org.get_org_type(), "Wedstrijd")
+        # Test season, July is start of the season
+        self.assertEqual(self.ns.node(org_nid)["season"], "1963-1964")
+        self.assertTrue(org_nid in [rec["id"] for rec in mg.organization_list(season="1963-1964")])
+        self.assertFalse(org_nid in [rec["id"] for rec in mg.organization_list(season="1962-1963")])
         mg.organization_delete(org_id=org_nid)
         self.assertFalse(mg.get_location(loc_nid), "Location is removed as part of Organization removal")
-        self.assertEqual(nr_nodes, len(self.ns.get_nodes()))
+        self.assertEqual(nr_nodes, self.ns.count_nodes())
 
 
     def test_organization_edit(self):
-        nr_nodes = len(self.ns.get_nodes())
+        nr_nodes = self.ns.count_nodes()
         # This function tests the organization Edit.
         name = "Dwars door Hillesheim"
         city = "Hillesheim_X"
@@ -106,10 +110,10 @@ class TestModelGraphClass(unittest.TestCase):
         self.assertEqual(org.get_org_type(), "Deelname")
         mg.organization_delete(org_id=org_nid)
         self.assertFalse(mg.get_location(loc_nid), "Location is removed as part of Organization removal")
-        self.assertEqual(nr_nodes, len(self.ns.get_nodes()))
+        self.assertEqual(nr_nodes, self.ns.count_nodes())
 
     def test_race_add(self):
-        nr_nodes = len(self.ns.get_nodes())
+        nr_nodes = self.ns.count_nodes()
         # This function tests the organization.
         name = "Dwars door Hillesheim"
         city = "Hillesheim_X"
@@ -140,7 +144,192 @@ class TestModelGraphClass(unittest.TestCase):
         self.assertEqual(rc.get_racename(), "Seniors - Dames")
         mg.race_delete(rc.get_node()['nid'])
         mg.organization_delete(org_id=org_nid)
-        self.assertEqual(nr_nodes, len(self.ns.get_nodes()))
+        self.assertEqual(nr_nodes, self.ns.count_nodes())
+
+    def test_participants_for_race(self):
+        nr_nodes = self.ns.count_nodes()
+        org = mg.Organization()
+        self.assertTrue(org.add(name="Dwars door Hillesheim", location="Hillesheim_X",
+                                datestamp=datetime.datetime.strptime("1963-07-02", "%Y-%m-%d"), org_type=False))
+        org_nid = org.get_org_id()
+        cat_node = self.ns.get_node("Category", name="Seniors")
+        race = mg.Race(org_id=org_nid)
+        race.add(categories=[cat_node["nid"]], mf="vrouw", short=False, name=False)
+        race_nid = race.get_nid()
+        person_nids = []
+        for name in ["Loper Een", "Loper Twee"]:
+            person = mg.Person()
+            self.assertTrue(person.add(name=name, mf="vrouw", category=cat_node["nid"]))
+            person_nids.append(person.get_nid())
+        prev_person_nid = -1
+        for person_nid in person_nids:
+            mg.Participant(race_id=race_nid, person_id=person_nid, prev_person_id=prev_person_nid)
+            prev_person_nid = person_nid
+        eager = mg.participants_for_race(race_nid)
+        lazy = mg.participants_for_race(race_nid, select_related=False)
+        self.assertEqual([part.person.get_name() for part in eager], ["Loper Een", "Loper Twee"])
+        self.assertEqual([part.person.get_name() for part in lazy], ["Loper Een", "Loper Twee"])
+        self.assertEqual(eager[0].person.get_category()["nid"], cat_node["nid"])
+        self.assertEqual(eager[1].race.org.get_org_id(), org_nid)
+        self.assertEqual(lazy[1].race.org.get_org_id(), org_nid)
+        # Model objects are slotted, attributes cannot be added.
+        with self.assertRaises(AttributeError):
+            eager[0].extra = True
+        mg.points_queue.wait(5)
+        for part in eager:
+            part.remove()
+        mg.points_queue.wait(5)
+        for person_nid in person_nids:
+            self.ns.remove_node_force(person_nid)
+        mg.race_delete(race_nid)
+        self.assertTrue(mg.organization_delete(org_id=org_nid))
+        self.assertEqual(nr_nodes, self.ns.count_nodes())
+
+    def test_derived(self):
+        org = mg.Organization()
+        self.assertTrue(org.add(name="Dwars door Hillesheim", location="Hillesheim_X",
+                                datestamp=datetime.datetime.strptime("1963-07-02", "%Y-%m-%d"), org_type=False))
+        org_nid = org.get_org_id()
+        categories = mg.get_category_list()
+        race = mg.Race(org_id=org_nid)
+        race.add(categories=[categories[0][0]], mf="man", short=False, name=False)
+        race_nid = race.get_nid()
+        person = mg.Person()
+        self.assertTrue(person.add(name="Loper Derived", mf="man", category=categories[0][0]))
+        part = mg.Participant(race_id=race_nid, person_id=person.get_nid(), prev_person_id=-1)
+        part_node = self.ns.node(part.get_id())
+        self.assertEqual(part_node["person_nid"], person.get_nid())
+        self.assertEqual(part_node["cat_nid"], categories[0][0])
+        self.assertEqual(part_node["orgtype"], "Wedstrijd")
+        self.assertEqual(part_node["day_key"], "1963-07-02")
+        self.assertEqual(part_node["season"], "1963-1964")
+        # Write paths keep the attributes up to date.
+        person.set_category(categories[1][0])
+        org.edit(name="Dwars door Hillesheim", location="Berndorf-Y",
+                 datestamp=datetime.datetime.strptime("1963-08-03", "%Y-%m-%d"), org_type=True)
+        part_node = self.ns.node(part.get_id())
+        self.assertEqual(part_node["cat_nid"], categories[1][0])
+        self.assertEqual(part_node["orgtype"], "Deelname")
+        self.assertEqual(self.ns.node(race_nid)["city"], "Berndorf-Y")
+        races = mg.races4person(person.get_nid(), season="1963-1964")
+        self.assertEqual(len(races), 1)
+        nids = [part.get_id(), race_nid]
+        self.assertEqual([rec for rec in self.ns.verify_derived() if rec["nid"] in nids], [])
+        mg.points_queue.wait(5)
+        part.remove()
+        mg.points_queue.wait(5)
+        self.ns.remove_node_force(person.get_nid())
+        mg.race_delete(race_nid)
+        self.assertTrue(mg.organization_delete(org_id=org_nid))
+
+    def test_races_generate(self):
+        nr_nodes = self.ns.count_nodes()
+        org_dict = dict(
+            name="Dwars door Hillesheim",
+            location="Hillesheim_X",
+            datestamp=datetime.datetime.strptime("1963-07-02", "%Y-%m-%d"),
+            org_type=False
+        )
+        org = mg.Organization()
+        self.assertTrue(org.add(**org_dict))
+        org_nid = org.get_org_id()
+        mg.races_generate(org_nid)
+        races = mg.get_race_list(org_nid)
+        # One race per category and mf
+        self.assertEqual(len(races), 2 * len(self.ns.get_category_nodes()))
+        race = mg.Race(race_id=races[0]["race"]["nid"])
+        self.assertEqual(race.get_racename(), "{c} - {mf}".format(c=self.ns.get_category_nodes()[0]["name"],
+                                                                  mf=races[0]["mf"]["name"]))
+        # Organization with races cannot be removed
+        self.assertFalse(mg.organization_delete(org_id=org_nid))
+        for rec in races:
+            mg.race_delete(rec["race"]["nid"])
+        self.assertTrue(mg.organization_delete(org_id=org_nid))
+        self.assertEqual(nr_nodes, self.ns.count_nodes())
+
+    def test_rescore_race(self):
+        org = mg.Organization()
+        self.assertTrue(org.add(name="Dwars door Hillesheim", location="Hillesheim_X",
+                                datestamp=datetime.datetime.strptime("1963-07-02", "%Y-%m-%d"), org_type=False))
+        org_nid = org.get_org_id()
+        mg.races_generate(org_nid)
+        race_nids = self.ns.get_race_nids(season="1963-1964")
+        self.assertEqual(len(race_nids), 2 * len(self.ns.get_category_nodes()))
+        # Races without participants have nothing to rescore
+        self.assertEqual(mg.rescore_race(race_nids[0]), [])
+        for race_nid in race_nids:
+            mg.race_delete(race_nid)
+        self.assertTrue(mg.organization_delete(org_id=org_nid))
+
+    def test_person_import(self):
+        nr_nodes = self.ns.count_nodes()
+        (cat_nid, cat_name) = mg.get_category_list()[0]
+        content = "name,mf,category\n" \
+                  "Import Een,man,{cat}\n" \
+                  "Import Twee,vrouw,{nid}\n" \
+                  "import een,man,{cat}\n" \
+                  "Import Drie,x,{cat}\n" \
+                  "Import Vier,man,Onbekend\n".format(cat=cat_name, nid=cat_nid)
+        rows = mg.person_import_rows(content)
+        report = mg.person_import(rows, dry_run=True)
+        self.assertEqual(report["created"], ["Import Een", "Import Twee"])
+        self.assertEqual([conflict["line"] for conflict in report["conflicts"]], [3, 4, 5])
+        self.assertEqual(nr_nodes, self.ns.count_nodes())
+        report = mg.person_import(rows)
+        self.assertEqual(report["created"], ["Import Een", "Import Twee"])
+        person = mg.Person(person_id=self.ns.get_node("Person", name="Import Twee")["nid"])
+        self.assertEqual(person.get_category()["nid"], cat_nid)
+        self.assertEqual(person.get_mf_value(), "vrouw")
+        # Second import of the same file creates no persons.
+        report = mg.person_import(mg.person_import_rows('[{"name": "Import Een", "mf": "man", "category": "%s"}]'
+                                                        % cat_nid, fmt="json"))
+        self.assertEqual(report["created"], [])
+        self.assertEqual(len(report["conflicts"]), 1)
+        # JSON list that does not contain persons.
+        self.assertRaises(ValueError, mg.person_import_rows, '["Import Een"]', fmt="json")
+        for name in ["Import Een", "Import Twee"]:
+            mg.remove_node_force(self.ns.get_node("Person", name=name)["nid"])
+        self.assertEqual(nr_nodes, self.ns.count_nodes())
+
+    def test_category_rollover(self):
+        categories = mg.get_category_list()
+        (old_nid, old_name) = categories[0]
+        (new_nid, new_name) = categories[1]
+        report = mg.person_import([dict(name="Rollover Een", mf="man", category=old_nid)])
+        self.assertEqual(report["created"], ["Rollover Een"])
+        person_nid = self.ns.get_node("Person", name="Rollover Een")["nid"]
+        self.assertEqual(mg.category_rollover(mapping={"Onbekend": new_name})["unknown"], ["Onbekend"])
+        report = mg.category_rollover(mapping={old_name: new_name}, dry_run=True)
+        self.assertTrue(person_nid in [move["nid"] for move in report["moves"]])
+        self.assertEqual(mg.Person(person_id=person_nid).get_category()["nid"], old_nid)
+        # Birth year rule, only the test person has a birth date in 1901.
+        props = self.ns.node_props(person_nid)
+        props["born"] = "1901-05-01"
+        self.ns.node_update(**props)
+        report = mg.category_rollover(birth_years={new_name: [1901, 1901]}, season="1963-1964")
+        self.assertEqual([move["nid"] for move in report["moves"]], [person_nid])
+        self.assertEqual(report["races"], 0)
+        self.assertEqual(mg.Person(person_id=person_nid).get_category()["nid"], new_nid)
+        self.assertEqual(self.ns.relations(person_nid), 2)
+        # Persons in the new category already are not moved.
+        report = mg.category_rollover(birth_years={new_name: [1901, 1901]}, dry_run=True)
+        self.assertEqual(report["moves"], [])
+        mg.remove_node_force(person_nid)
+
+    def test_season4date(self):
+        self.assertEqual(mg.season4date("2018-10-21"), "2018-2019")
+        self.assertEqual(mg.season4date(datetime.date(2019, 3, 17)), "2018-2019")
+        self.assertEqual(mg.season4date(datetime.date(2019, 7, 1)), "2019-2020")
+
+    def test_user_cache(self):
+        user_nid = self.ns.get_node("User")["nid"]
+        mg.user_cache_clear()
+        user = mg.load_user(user_nid)
+        self.assertEqual(user.get_id(), user_nid)
+        # Second request is served from the cache
+        self.assertIs(mg.load_user(user_nid), user)
+        mg.user_cache_clear(user_nid)
+        self.assertIsNot(mg.load_user(user_nid), user)
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,65 @@
+"""
+This procedure will test the queue based log handler.
+"""
+
+import logging
+import os
+import platform
+import queue
+import tempfile
+import unittest
+from lib import my_env
+
+
+class TestLogHandler(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.level = logging.getLogger().level
+
+    def tearDown(self):
+        my_env.stop_loghandler()
+        logging.getLogger().setLevel(self.level)
+        self.tmpdir.cleanup()
+
+    def logfile(self):
+        logfile = os.path.join(self.tmpdir.name, "test_my_env_{c}.log".format(c=platform.node()))
+        with open(logfile) as f:
+            return f.read()
+
+    def test_drop(self):
+        # Nobody reads from the queue, so records after the first one are dropped.
+        handler = my_env.DropQueueHandler(queue.Queue(maxsize=1))
+        logger = logging.getLogger("test_my_env.drop")
+        logger.propagate = False
+        logger.addHandler(handler)
+        try:
+            for cnt in range(3):
+                logger.warning("Record {cnt}".format(cnt=cnt))
+        finally:
+            logger.removeHandler(handler)
+        self.assertEqual(handler.dropped, 2)
+        self.assertEqual(handler.queue.qsize(), 1)
+        self.assertEqual(handler.queue.get_nowait().getMessage(), "Record 0")
+
+    def test_stop(self):
+        my_env.init_loghandler("test_my_env.py", self.tmpdir.name, "info")
+        logging.getLogger("test_my_env").info("First record")
+        # Simulate dropped records, a full queue depends on the speed of the writer thread.
+        my_env.log_queue_handler.dropped = 3
+        self.assertEqual(my_env.get_log_dropped(), 3)
+        self.assertEqual(my_env.stop_loghandler(), 3)
+        self.assertEqual(my_env.get_log_dropped(), 0)
+        self.assertIsNone(my_env.log_listener)
+        content = self.logfile()
+        # Records on the queue are written on stop, followed by the number of dropped records.
+        self.assertIn("First record", content)
+        self.assertIn("3 log records dropped, log queue full", content)
+        self.assertLess(content.index("First record"), content.index("log records dropped"))
+        # Records after stop are not written to the logfile.
+        logging.getLogger("test_my_env").info("Late record")
+        self.assertNotIn("Late record", self.logfile())
+
+
+if __name__ == "__main__":
+    unittest.main()
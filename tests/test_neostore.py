@@ -3,6 +3,7 @@ This procedure will test the neostore functionality.
 """
 
 import os
+import threading
 import unittest
 from competition import create_app
 from competition import neostore
@@ -36,7 +37,7 @@ class TestNeoStore(unittest.TestCase):
         self.app_ctx.pop()
 
     def test_remove_relation(self):
-        nr_nodes = self.ns.get_nodes()
+        nr_nodes = self.ns.count_nodes()
         # First create 2 nodes and a relation
         label = "TestNode"
         node1_params = dict(
@@ -53,10 +54,72 @@ class TestNeoStore(unittest.TestCase):
         self.ns.remove_relation_node(start_node=node1_node, end_node=node2_node, rel_type=rel)
         self.ns.remove_node_force(node1_node["nid"])
         self.ns.remove_node_force(node2_node["nid"])
-        self.assertEqual(self.ns.get_nodes(), nr_nodes)
+        self.assertEqual(self.ns.count_nodes(), nr_nodes)
+
+    def test_get_endnode(self):
+        nr_nodes = self.ns.count_nodes()
+        label = "TestNode"
+        node1_node = self.ns.create_node(label, testname="Node1")
+        node2_node = self.ns.create_node(label, testname="Node2")
+        node3_node = self.ns.create_node(label, testname="Node3")
+        rel = "TestRel"
+        self.ns.create_relation(from_node=node1_node, rel=rel, to_node=node2_node)
+        self.assertEqual(self.ns.get_endnode(start_node=node1_node, rel_type=rel)["nid"], node2_node["nid"])
+        self.assertEqual(self.ns.get_startnode(end_node=node2_node, rel_type=rel)["nid"], node1_node["nid"])
+        self.assertEqual(self.ns.get_start_node(end_node_id=node2_node["nid"], rel_type=rel), node1_node["nid"])
+        self.assertFalse(self.ns.get_endnode(start_node=node2_node, rel_type=rel))
+        self.assertFalse(self.ns.get_endnode(start_node=node1_node, rel_type="OtherRel"))
+        # Batched lookup, nodes without relation are not in the result.
+        end_map = self.ns.get_endnode_map([node1_node, node2_node, node3_node], rel)
+        self.assertEqual(list(end_map.keys()), [node1_node["nid"]])
+        self.assertEqual(end_map[node1_node["nid"]]["nid"], node2_node["nid"])
+        start_map = self.ns.get_startnode_map([node2_node, node3_node], rel)
+        self.assertEqual(start_map[node2_node["nid"]]["nid"], node1_node["nid"])
+        # More than one end node, one of them is returned.
+        self.ns.create_relation(from_node=node1_node, rel=rel, to_node=node3_node)
+        self.assertIn(self.ns.get_endnode(start_node=node1_node, rel_type=rel)["nid"],
+                      [node2_node["nid"], node3_node["nid"]])
+        for node in [node1_node, node2_node, node3_node]:
+            self.ns.remove_node_force(node["nid"])
+        self.assertEqual(self.ns.count_nodes(), nr_nodes)
+
+    def test_create_relations(self):
+        nr_nodes = self.ns.count_nodes()
+        label = "TestNode"
+        nodes = [self.ns.create_node(label, testname="Node{cnt}".format(cnt=cnt)) for cnt in range(3)]
+        triples = [(nodes[0]["nid"], "TestRel", nodes[1]["nid"]),
+                   (nodes[0]["nid"], "TestRel", nodes[2]["nid"]),
+                   (nodes[1]["nid"], "OtherRel", nodes[2]["nid"])]
+        self.assertEqual(self.ns.create_relations(triples, from_label=label, to_label=label), 3)
+        self.assertEqual(len(self.ns.get_endnodes(start_node=nodes[0], rel_type="TestRel")), 2)
+        self.assertEqual(self.ns.get_endnode(start_node=nodes[1], rel_type="OtherRel")["nid"], nodes[2]["nid"])
+        self.assertEqual(self.ns.create_relations([]), 0)
+        # Merge does not add a relation that exists already.
+        self.ns.merge_relation(from_node=nodes[1], rel="OtherRel", to_node=nodes[2])
+        self.assertEqual(self.ns.relations(nodes[1]["nid"]), 2)
+        for node in nodes:
+            self.ns.remove_node_force(node["nid"])
+        self.assertEqual(self.ns.count_nodes(), nr_nodes)
+
+    def test_iter_nodes(self):
+        label = "Test_Iter_Nodes"
+        nr_nodes = self.ns.count_nodes()
+        nodes = [self.ns.create_node(label, testname="Node", cnt=cnt) for cnt in range(5)]
+        self.assertEqual(self.ns.count_nodes(), nr_nodes + 5)
+        self.assertEqual(self.ns.count_nodes(label), 5)
+        # Pages smaller than, equal to and larger than the number of nodes.
+        for page_size in [2, 5, 10]:
+            res = list(self.ns.iter_nodes(label, page_size=page_size))
+            self.assertEqual(sorted(node["cnt"] for node in res), list(range(5)))
+        res = list(self.ns.iter_nodes(label, page_size=2, testname="Node", cnt=3))
+        self.assertEqual([node["nid"] for node in res], [nodes[3]["nid"]])
+        self.assertEqual(list(self.ns.iter_nodes(label, testname="Other")), [])
+        for node in nodes:
+            self.ns.remove_node_force(node["nid"])
+        self.assertEqual(self.ns.count_nodes(), nr_nodes)
 
     def test_get_nodes(self):
-        nr_nodes = self.ns.get_nodes()
+        nr_nodes = self.ns.count_nodes()
         # First create 2 nodes and a relation
         label = "Test_Get_Nodes"
         node1_params = dict(
@@ -88,30 +151,124 @@ class TestNeoStore(unittest.TestCase):
         # Verify all nodes are removed
         self.assertFalse(self.ns.get_nodes(label))
         # Check same number of nodes at the end as on the beginning
-        self.assertEqual(self.ns.get_nodes(), nr_nodes)
+        self.assertEqual(self.ns.count_nodes(), nr_nodes)
 
     def test_node_count(self):
         # 2 MF Nodes
         label = "MF"
-        nr = len(self.ns.get_nodes(label))
+        nr = self.ns.count_nodes(label)
         self.assertEqual(nr, 2)
         # 2 OrgType Nodes
         label = "OrgType"
-        nr = len(self.ns.get_nodes(label))
+        nr = self.ns.count_nodes(label)
         self.assertEqual(nr, 2)
         # 1 User Node
         label = "User"
-        nr = len(self.ns.get_nodes(label))
+        nr = self.ns.count_nodes(label)
         self.assertEqual(nr, 1)
         # 12 Category Nodes
         label = "Category"
-        nr = len(self.ns.get_nodes(label))
+        nr = self.ns.count_nodes(label)
         self.assertEqual(nr, 12)
         # 1 CategoryGroup Node
         label = "categoryGroup"
-        nr = len(self.ns.get_nodes(label))
+        nr = self.ns.count_nodes(label)
         self.assertEqual(nr, 1)
 
+    def test_race_version(self):
+        nr_nodes = self.ns.count_nodes()
+        race_node = self.ns.create_node("Race", racename="Test Race Version")
+        race_nid = race_node["nid"]
+        self.assertEqual(self.ns.get_race_version(race_nid), 0)
+        # Compare-and-set succeeds on current version, fails on outdated version.
+        self.assertTrue(self.ns.set_race_version(race_nid, 0))
+        self.assertFalse(self.ns.set_race_version(race_nid, 0))
+        self.assertEqual(self.ns.get_race_version(race_nid), 1)
+        # Unconditional increment
+        self.assertTrue(self.ns.set_race_version(race_nid))
+        self.assertEqual(self.ns.get_race_version(race_nid), 2)
+        # Node update keeps the version and the derived attributes.
+        self.ns.node_set_attribs(nid=race_nid, season="2018-2019")
+        self.ns.node_update(nid=race_nid, racename="Test Race Version Updated")
+        self.assertEqual(self.ns.get_race_version(race_nid), 2)
+        self.assertEqual(self.ns.node_props(race_nid)["season"], "2018-2019")
+        self.ns.remove_node_force(race_nid)
+        self.assertEqual(self.ns.count_nodes(), nr_nodes)
+
+    def test_add_participant(self):
+        nr_nodes = self.ns.count_nodes()
+        race_nid = self.ns.create_node("Race", racename="Test Race Chain")["nid"]
+        person_nids = [self.ns.create_node("Person", name="Test Chain {n}".format(n=n))["nid"] for n in range(3)]
+        first = self.ns.add_participant(race_nid, person_nids[0], 0)
+        last = self.ns.add_participant(race_nid, person_nids[2], 1, prev_nid=first["nid"])
+        # Outdated version, chain is not modified.
+        self.assertFalse(self.ns.add_participant(race_nid, person_nids[1], 1, prev_nid=first["nid"],
+                                                 next_nid=last["nid"]))
+        middle = self.ns.add_participant(race_nid, person_nids[1], 2, prev_nid=first["nid"], next_nid=last["nid"])
+        self.assertEqual(self.ns.get_race_version(race_nid), 3)
+        # Derived attributes are set when the participant is added.
+        self.assertEqual(middle["person_nid"], person_nids[1])
+        self.assertEqual(self.ns.get_endnode(start_node=last, rel_type="after")["nid"], middle["nid"])
+        self.assertEqual(self.ns.get_endnode(start_node=middle, rel_type="after")["nid"], first["nid"])
+        for nid in [race_nid, first["nid"], middle["nid"], last["nid"]] + person_nids:
+            self.ns.remove_node_force(nid)
+        self.assertEqual(self.ns.count_nodes(), nr_nodes)
+
+    def test_remove_participant(self):
+        nr_nodes = self.ns.count_nodes()
+        race_nid = self.ns.create_node("Race", racename="Test Race Remove")["nid"]
+        person_nids = [self.ns.create_node("Person", name="Test Remove {n}".format(n=n))["nid"] for n in range(3)]
+        first = self.ns.add_participant(race_nid, person_nids[0], 0)
+        middle = self.ns.add_participant(race_nid, person_nids[1], 1, prev_nid=first["nid"])
+        last = self.ns.add_participant(race_nid, person_nids[2], 2, prev_nid=middle["nid"])
+        # Outdated version, participant is not removed.
+        self.assertFalse(self.ns.remove_participant(race_nid, middle["nid"], 2))
+        self.assertTrue(self.ns.remove_participant(race_nid, middle["nid"], 3))
+        self.assertEqual(self.ns.get_race_version(race_nid), 4)
+        self.assertEqual(self.ns.get_endnode(start_node=last, rel_type="after")["nid"], first["nid"])
+        for nid in [race_nid, first["nid"], last["nid"]] + person_nids:
+            self.ns.remove_node_force(nid)
+        self.assertEqual(self.ns.count_nodes(), nr_nodes)
+
+    def test_concurrent_requests(self):
+        nr_nodes = self.ns.count_nodes()
+        (start_tag, _) = self.ns.get_version()
+        nr_threads = 8
+        nr_loops = 10
+        errors = []
+
+        def worker(thread_nr):
+            with self.app.app_context():
+                try:
+                    for cnt in range(nr_loops):
+                        name = "Stress {t}-{c}".format(t=thread_nr, c=cnt)
+                        node = self.ns.create_node("Stress", name=name)
+                        self.assertEqual(self.ns.get_node("Stress", nid=node["nid"])["name"], name)
+                        self.ns.remove_node_force(node["nid"])
+                except Exception as e:
+                    errors.append(e)
+
+        threads = [threading.Thread(target=worker, args=(nr,)) for nr in range(nr_threads)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        # Every write is counted once in the data version.
+        (end_tag, _) = self.ns.get_version()
+        self.assertEqual(int(end_tag.split("-")[1]) - int(start_tag.split("-")[1]), 2 * nr_threads * nr_loops)
+        self.assertEqual(self.ns.count_nodes(), nr_nodes)
+
+    def test_version_batch(self):
+        (start_tag, _) = self.ns.get_version()
+        with self.ns.version_batch():
+            node = self.ns.create_node("Stress", name="Batch")
+            self.ns.remove_node_force(node["nid"])
+            # Versions are incremented at the end of the batch.
+            self.assertEqual(self.ns.get_version()[0], start_tag)
+        (end_tag, _) = self.ns.get_version()
+        self.assertEqual(int(end_tag.split("-")[1]) - int(start_tag.split("-")[1]), 1)
+
     def test_get_category_nodes(self):
         res = self.ns.get_category_nodes()
         for rec in res:
@@ -0,0 +1,46 @@
+"""
+This procedure will test the rendered page cache.
+"""
+
+import unittest
+from competition import pagecache
+
+
+class TestPageCache(unittest.TestCase):
+
+    def test_version(self):
+        pc = pagecache.PageCache()
+        key = ("main.overview", (("mf", "Dames"),), False)
+        self.assertFalse(pc.get(key, "v1"))
+        pc.put(key, "v1", "<html>Dames</html>")
+        self.assertEqual(pc.get(key, "v1"), "<html>Dames</html>")
+        # Page rendered for older version is not returned, and is removed.
+        self.assertFalse(pc.get(key, "v2"))
+        self.assertEqual(pc.size, 0)
+        self.assertEqual((pc.hits, pc.misses), (1, 2))
+
+    def test_lru(self):
+        pc = pagecache.PageCache(max_entries=2)
+        pc.put("a", 1, "page a")
+        pc.put("b", 1, "page b")
+        # Use a, so b is the least recently used page.
+        self.assertTrue(pc.get("a", 1))
+        pc.put("c", 1, "page c")
+        self.assertFalse(pc.get("b", 1))
+        self.assertTrue(pc.get("a", 1))
+        self.assertTrue(pc.get("c", 1))
+
+    def test_size(self):
+        pc = pagecache.PageCache(max_bytes=200)
+        page = "".join(str(cnt) for cnt in range(1000))
+        # Compressed page is larger than the cache, so it is not stored.
+        pc.put("big", 1, page)
+        self.assertFalse(pc.get("big", 1))
+        pc.put("small", 1, "x" * 1000)
+        self.assertTrue(pc.size < 200)
+        pc.clear()
+        self.assertEqual(pc.size, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,44 @@
+"""
+This procedure will test the person search index.
+"""
+
+import unittest
+from competition import personsearch
+
+
+class TestPersonSearch(unittest.TestCase):
+
+    def setUp(self):
+        self.index = personsearch.PersonIndex()
+        self.index.load([
+            dict(nid="1", name="Jan Baillevier"),
+            dict(nid="2", name="Noël Janssens"),
+            dict(nid="3", name="Marijke Jansen"),
+            dict(nid="4", name="Piet Verbaillen"),
+        ], version="v1")
+
+    def test_normalize(self):
+        self.assertEqual(personsearch.normalize(" Noël Émile "), "noel emile")
+
+    def test_search(self):
+        # Word prefix before substring.
+        self.assertEqual([p["nid"] for p in self.index.search("baill")], ["1", "4"])
+        self.assertEqual([p["nid"] for p in self.index.search("noel")], ["2"])
+        self.assertEqual(set(p["nid"] for p in self.index.search("JANS")[:2]), {"2", "3"})
+        self.assertEqual(self.index.search("xyz"), [])
+        self.assertEqual(len(self.index.search("jan", limit=2)), 2)
+        self.assertEqual(self.index.search("  "), [])
+        self.assertEqual(self.index.version, "v1")
+
+    def test_search_typo(self):
+        self.assertEqual(self.index.search("baillivier")[0]["name"], "Jan Baillevier")
+
+    def test_search_nids(self):
+        self.assertEqual([p["nid"] for p in self.index.search("jan", nids={"3"})], ["3"])
+
+    def test_get_names(self):
+        self.assertEqual(self.index.get_names(["2", "9"]), {"2": "Noël Janssens"})
+
+
+if __name__ == "__main__":
+    unittest.main()
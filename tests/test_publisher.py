@@ -0,0 +1,87 @@
+"""
+This procedure will test the change publisher.
+"""
+
+import json
+import unittest
+from competition import publisher
+
+
+class TestPublisher(unittest.TestCase):
+
+    def test_publish(self):
+        pub = publisher.Publisher(maxsize=2)
+        channel = "race:test"
+        self.assertFalse(pub.has_subscribers(channel))
+        q1 = pub.subscribe(channel)
+        q2 = pub.subscribe(channel)
+        self.assertTrue(pub.has_subscribers(channel))
+        self.assertEqual(pub.publish(channel, "finishers", [dict(name="Jan")]), 2)
+        msg = q1.get_nowait()
+        self.assertTrue(msg.startswith("event: finishers\n"))
+        data = msg.split("data: ")[1].strip()
+        self.assertEqual(json.loads(data), [dict(name="Jan")])
+        self.assertEqual(q2.get_nowait(), msg)
+        # Slow subscriber keeps the most recent messages only.
+        for cnt in range(3):
+            pub.publish(channel, "finishers", cnt)
+        self.assertEqual(q1.qsize(), 2)
+        self.assertTrue(q1.get_nowait().endswith("data: 1\n\n"))
+        pub.unsubscribe(channel, q1)
+        pub.unsubscribe(channel, q2)
+        self.assertFalse(pub.has_subscribers(channel))
+
+    def test_stream(self):
+        pub = publisher.Publisher()
+        channel = "result:Dames:test"
+        stream = pub.stream(channel, keepalive=0.01)
+        self.assertTrue(next(stream).startswith("retry"))
+        self.assertTrue(pub.has_subscribers(channel))
+        self.assertEqual(next(stream), ": keepalive\n\n")
+        pub.publish(channel, "standings", [])
+        self.assertEqual(next(stream), "event: standings\ndata: []\n\n")
+        stream.close()
+        self.assertFalse(pub.has_subscribers(channel))
+
+    def test_max_streams(self):
+        pub = publisher.Publisher()
+        stream1 = pub.stream("race:1", max_streams=1)
+        next(stream1)
+        self.assertIsNone(pub.stream("race:2", max_streams=1))
+        stream1.close()
+        stream2 = pub.stream("race:2", max_streams=1)
+        self.assertIsNotNone(stream2)
+        # A stream that is never started is no longer counted after its lifetime.
+        pub = publisher.Publisher()
+        pub.stream("race:1", lifetime=-5, max_streams=1)
+        self.assertIsNotNone(pub.stream("race:2", max_streams=1))
+
+    def test_lifetime(self):
+        pub = publisher.Publisher(poll=0.01)
+        channel = "race:test"
+        stream = pub.stream(channel, keepalive=0.01, lifetime=0.05)
+        self.assertEqual(list(stream)[0], "retry: 5000\n\n")
+        self.assertFalse(pub.has_subscribers(channel))
+        self.assertEqual(pub.streams, {})
+
+    def test_check(self):
+        version = ["v1"]
+        refreshed = []
+        pub = publisher.Publisher(version=lambda: version[0], refresh=refreshed.append, poll=0)
+        channel = "race:test"
+        pub.subscribe(channel)
+        self.assertEqual(pub.check(), 0)
+        self.assertEqual(pub.check(), 0)
+        # Write in another worker process.
+        version[0] = "v2"
+        self.assertEqual(pub.check(), 1)
+        self.assertEqual(refreshed, [channel])
+        stream = pub.stream("result:Dames:test", keepalive=0.01)
+        next(stream)
+        version[0] = "v3"
+        self.assertEqual(next(stream), ": keepalive\n\n")
+        self.assertEqual(sorted(refreshed), sorted([channel, channel, "result:Dames:test"]))
+
+
+if __name__ == "__main__":
+    unittest.main()
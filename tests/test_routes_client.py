@@ -1,3 +1,4 @@
+import json
 import unittest
 from competition import create_app, models_graph as mg
 
@@ -68,3 +69,37 @@ class UserModelTestCase(unittest.TestCase):
         # You need to log in first, so check for log in message
         self.assertEqual(r.status_code, 200)
         self.assertTrue('Aankomsten' in r.get_data(as_text=True))
+
+    def test_person_list_filter(self):
+        r = self.client.get('/person/list?prefix=Jan+B&mf=man')
+        self.assertEqual(r.status_code, 200)
+        self.assertTrue('Jan Baillevier' in r.get_data(as_text=True))
+        r = self.client.get('/person/list?prefix=Jan+B&mf=vrouw')
+        self.assertFalse('Jan Baillevier' in r.get_data(as_text=True))
+        # One person per page, the link to the next page keeps the filter.
+        (persons, next_after) = mg.person_page(page_size=1, prefix="J")
+        self.assertEqual(len(persons), 1)
+        if next_after:
+            (next_persons, _) = mg.person_page(after=next_after, page_size=1, prefix="J")
+            self.assertTrue(next_persons[0]["name"] > persons[0]["name"])
+
+    def test_person_search(self):
+        r = self.client.get('/api/person/search?q=baillev&k=5')
+        self.assertEqual(r.status_code, 200)
+        persons = json.loads(r.get_data(as_text=True))
+        self.assertTrue(len(persons) <= 5)
+        self.assertEqual(persons[0]["name"], "Jan Baillevier")
+
+    def test_conditional_get(self):
+        # Second load of an unchanged list page is answered with 304 Not Modified.
+        r = self.client.get('/organization/list')
+        self.assertEqual(r.status_code, 200)
+        etag = r.headers.get('ETag')
+        self.assertTrue(etag)
+        r = self.client.get('/organization/list', headers={'If-None-Match': etag})
+        self.assertEqual(r.status_code, 304)
+        self.assertEqual(r.get_data(as_text=True), '')
+        # A write in the neostore changes the version, so the page is rendered again.
+        mg.get_ns().bump_version()
+        r = self.client.get('/organization/list', headers={'If-None-Match': etag})
+        self.assertEqual(r.status_code, 200)
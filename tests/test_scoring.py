@@ -0,0 +1,47 @@
+"""
+This procedure will test the scoring rules.
+"""
+
+import unittest
+from competition import scoring
+
+
+class TestScoring(unittest.TestCase):
+
+    def setUp(self):
+        self.rules = scoring.ScoringRules()
+
+    def test_points(self):
+        self.assertEqual([self.rules.points("Wedstrijd", pos) for pos in range(1, 6)], [25, 20, 18, 16, 15])
+        self.assertEqual(self.rules.points("Wedstrijd", 19), 1)
+        self.assertEqual(self.rules.points("Wedstrijd", 5000), 1)
+        self.assertEqual([self.rules.points("Short", pos) for pos in range(1, 5)], [20, 17, 15, 14])
+        self.assertEqual(self.rules.points("Short", 40), 1)
+        self.assertEqual(self.rules.points("Deelname", 3), 20)
+        self.assertEqual(self.rules.points("Onbekend", 1), 20)
+
+    def test_race_points(self):
+        cats = ["A", "B", "A", "A", "B"]
+        self.assertEqual(self.rules.race_points("Wedstrijd", cats),
+                         [(25, 1), (25, 2), (20, 3), (18, 4), (20, 5)])
+        self.assertEqual(self.rules.race_points("Short", cats),
+                         [(20, 1), (17, 2), (15, 3), (14, 4), (13, 5)])
+        self.assertEqual(self.rules.race_points("Deelname", cats[:2]), [(20, 1), (20, 2)])
+        self.assertEqual(self.rules.race_points("Wedstrijd", []), [])
+
+    def test_total(self):
+        self.assertEqual(self.rules.total([10, 20]), 30)
+        # Best 6 results, 5 points for every additional result.
+        self.assertEqual(self.rules.total([1, 2, 3, 4, 5, 6, 7, 8]), 3 + 4 + 5 + 6 + 7 + 8 + 2 * 5)
+
+    def test_custom_rules(self):
+        rules = dict(scoring.default_rules, best_n=2, org_bonus=dict(PK=4))
+        custom = scoring.ScoringRules(rules)
+        self.assertEqual(custom.total([5, 10, 20]), 35)
+        self.assertEqual(custom.org_bonus, dict(PK=4))
+        self.assertNotEqual(custom.fingerprint, self.rules.fingerprint)
+        self.assertEqual(scoring.ScoringRules().fingerprint, self.rules.fingerprint)
+
+
+if __name__ == "__main__":
+    unittest.main()
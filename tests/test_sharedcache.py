@@ -0,0 +1,78 @@
+"""
+This procedure will test the cache that is shared by the worker processes.
+"""
+
+import os
+import tempfile
+import unittest
+from competition import sharedcache
+
+
+class TestSharedCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, "cache.db")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_version(self):
+        # Two cache objects on the same file behave as two worker processes.
+        worker1 = sharedcache.SharedCache(self.path)
+        worker2 = sharedcache.SharedCache(self.path)
+        (tag, _) = worker1.get_version()
+        self.assertEqual(worker2.get_version()[0], tag)
+        self.assertEqual(worker1.bump_version(), 1)
+        self.assertNotEqual(worker2.get_version()[0], tag)
+        self.assertEqual(worker2.get_version(), worker1.get_version())
+        # Version counters are independent.
+        self.assertEqual(worker2.bump_version("users"), 1)
+        self.assertEqual(worker1.bump_version(), 2)
+
+    def test_pages(self):
+        worker1 = sharedcache.SharedCache(self.path)
+        worker2 = sharedcache.SharedCache(self.path)
+        key = ("main.overview", (("mf", "Dames"),), False)
+        self.assertFalse(worker2.get(key, "v1"))
+        worker1.put(key, "v1", "<html>Dames</html>")
+        self.assertEqual(worker2.get(key, "v1"), "<html>Dames</html>")
+        # Page rendered for older version is not returned.
+        self.assertFalse(worker2.get(key, "v2"))
+        worker2.put("other", "v2", "page")
+        self.assertEqual(worker1.get(key, "v1"), "<html>Dames</html>")
+        worker1.clear()
+        self.assertFalse(worker2.get("other", "v2"))
+
+    def test_bump_evicts(self):
+        cache = sharedcache.SharedCache(self.path)
+        (tag, _) = cache.get_version()
+        cache.put("a", tag, "page a")
+        cache.bump_version("users")
+        self.assertTrue(cache.get("a", tag))
+        cache.bump_version()
+        (new_tag, _) = cache.get_version()
+        cache.put("b", new_tag, "page b")
+        self.assertEqual(cache.connection().execute("SELECT key FROM pages").fetchall(), [(repr("b"),)])
+
+    def test_touch(self):
+        cache = sharedcache.SharedCache(self.path)
+        cache.put("a", 1, "page a")
+        used = cache.connection().execute("SELECT used FROM pages").fetchone()[0]
+        # Recently used page, the hit does not write.
+        self.assertTrue(cache.get("a", 1))
+        self.assertEqual(cache.connection().execute("SELECT used FROM pages").fetchone()[0], used)
+
+    def test_lru(self):
+        cache = sharedcache.SharedCache(self.path, max_entries=2, touch=0)
+        cache.put("a", 1, "page a")
+        cache.put("b", 1, "page b")
+        self.assertTrue(cache.get("a", 1))
+        cache.put("c", 1, "page c")
+        self.assertFalse(cache.get("b", 1))
+        self.assertTrue(cache.get("a", 1))
+        self.assertTrue(cache.get("c", 1))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,58 @@
+"""
+This procedure will test the snapshots of the read pages.
+"""
+
+import os
+import tempfile
+import unittest
+from competition import snapshot
+
+
+class TestSnapshots(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def stores(self):
+        return [snapshot.Snapshots(max_entries=2),
+                snapshot.Snapshots(os.path.join(self.tmpdir.name, "snapshots.db"), max_entries=2)]
+
+    def test_get_put(self):
+        key = ("main.overview", (("mf", "dames"),), (), False)
+        for store in self.stores():
+            self.assertFalse(store.get(key))
+            self.assertIsNone(store.version(key))
+            store.put(key, "v1", "<p>Overzicht</p>")
+            (page, version, rendered) = store.get(key)
+            self.assertEqual(page, "<p>Overzicht</p>")
+            self.assertEqual(version, "v1")
+            self.assertEqual(store.version(key), "v1")
+            # A new version replaces the snapshot.
+            store.put(key, "v2", "<p>Nieuw</p>")
+            self.assertEqual(store.get(key)[:2], ("<p>Nieuw</p>", "v2"))
+
+    def test_same_version(self):
+        key = ("main.person_list", (), (), False)
+        for store in self.stores():
+            store.put(key, "v1", "first")
+            store.put(key, "v1", "second")
+            self.assertEqual(store.get(key)[0], "first")
+
+    def test_max_entries(self):
+        for store in self.stores():
+            for cnt in range(3):
+                store.put(("page", cnt), "v1", "page {cnt}".format(cnt=cnt))
+            self.assertFalse(store.get(("page", 0)))
+            self.assertEqual(store.get(("page", 2))[0], "page 2")
+
+    def test_shared(self):
+        path = os.path.join(self.tmpdir.name, "snapshots.db")
+        snapshot.Snapshots(path).put("key", "v1", "page")
+        self.assertEqual(snapshot.Snapshots(path).get("key")[0], "page")
+
+
+if __name__ == "__main__":
+    unittest.main()
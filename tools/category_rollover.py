@@ -0,0 +1,57 @@
+"""
+This script will move persons to their category for the new season. The new category is given in a JSON file, as a
+mapping from current category to new category, e.g. {"Benjamins": "Pupillen"}, and / or as a birth year rule for
+persons with a birth date, e.g. {"Pupillen": [2010, 2011]}. The races of the season with a moved person are rescored.
+Archive the finished season with season_archive.py before the rollover.
+"""
+
+import argparse
+import json
+import logging
+import platform
+from competition import create_app
+
+parser = argparse.ArgumentParser(
+    description="Move persons to the category for the new season"
+)
+parser.add_argument('-m', '--mapping', type=str,
+                    help='JSON file with current category as key and new category as value.')
+parser.add_argument('-y', '--birth-years', type=str,
+                    help='JSON file with category as key and [first year, last year] of birth as value.')
+parser.add_argument('-s', '--season', type=str,
+                    help='Season to rescore, e.g. 2018-2019. Default is the current season.')
+parser.add_argument('-n', '--dry-run', action='store_true',
+                    help='Report the moves, do not update the categories.')
+args = parser.parse_args()
+if not (args.mapping or args.birth_years):
+    parser.error("Mapping or birth years file is required.")
+env = "development"
+if platform.node() == "zeegeus":
+    env = "production"
+app = create_app(env, tool=True)
+# Create app before import models_graph. Environment settings for Neo4J are required before import.
+from competition import models_graph as mg
+
+
+def read_json(filename):
+    if not filename:
+        return None
+    with open(filename, encoding="utf-8") as fh:
+        return json.load(fh)
+
+
+logging.info("Arguments: {a}".format(a=args))
+with app.app_context():
+    report = mg.category_rollover(mapping=read_json(args.mapping), birth_years=read_json(args.birth_years),
+                                  season=args.season, dry_run=args.dry_run)
+    if report["unknown"]:
+        print("Unknown categories: {u}".format(u=", ".join(str(cat) for cat in report["unknown"])))
+    else:
+        cat_names = dict(mg.get_category_list())
+        for move in report["moves"]:
+            print("{name}: {old} -> {new}".format(name=move["name"], old=cat_names.get(move["old"], "Not defined"),
+                                                  new=cat_names[move["category"]]))
+        print("{cnt} persons {action}, {p} participants rescored in {r} races."
+              .format(cnt=len(report["moves"]), action="to move" if args.dry_run else "moved",
+                      p=report["points"], r=report["races"]))
+logging.info("End Application")
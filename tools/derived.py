@@ -0,0 +1,42 @@
+"""
+This script will check the derived attributes on the Race and Participant nodes (organization type, date, season,
+category, mf, ...). These attributes are copied from the related nodes, so that lists and points calculation do not
+need to walk the graph. Action 'verify' reports the nodes with an attribute that is not correct, action 'set' sets the
+attributes on all races and participants. Action 'migrate' sets the season and the derived attributes only on nodes
+that do not have them yet, run it once after upgrading a database from before these attributes were introduced.
+"""
+
+import argparse
+import logging
+import platform
+from competition import create_app
+
+parser = argparse.ArgumentParser(
+    description="Verify or set the derived attributes on races and participants"
+)
+parser.add_argument('-a', '--action', type=str, required=True, choices=['verify', 'set', 'migrate'],
+                    help='Please provide the (verify, set, migrate) action.')
+args = parser.parse_args()
+env = "development"
+if platform.node() == "zeegeus":
+    env = "production"
+app = create_app(env, tool=True)
+# Create app before import models_graph. Environment settings for Neo4J are required before import.
+from competition import models_graph as mg
+
+logging.info("Arguments: {a}".format(a=args))
+with app.app_context():
+    ns = mg.get_ns()
+    if args.action == "verify":
+        res = ns.verify_derived()
+        for rec in res:
+            print("{label} {nid}: {attrib} not correct".format(**rec))
+        print("{cnt} nodes with derived attributes that are not correct.".format(cnt=len(res)))
+    elif args.action == "migrate":
+        (orgs, parts) = mg.migrate()
+        print("Season set for {orgs} organizations, derived attributes set for {parts} participants.".format(
+            orgs=orgs, parts=parts))
+    else:
+        cnt = ns.set_derived()
+        print("Derived attributes set for all races and {cnt} participants.".format(cnt=cnt))
+logging.info("End Application")
@@ -0,0 +1,38 @@
+"""
+This script will register the persons from a CSV or JSON file, e.g. at the start of a season. A CSV file has a header
+line with columns name, mf (man / vrouw) and category (name or nid). A JSON file has a list of objects with the same
+fields. All valid persons are created in one transaction, rows that cannot be registered are reported as conflicts.
+"""
+
+import argparse
+import logging
+import platform
+from competition import create_app
+
+parser = argparse.ArgumentParser(
+    description="Register persons from a CSV or JSON file"
+)
+parser.add_argument('-f', '--file', type=str, required=True,
+                    help='CSV or JSON file with the persons.')
+parser.add_argument('-n', '--dry-run', action='store_true',
+                    help='Validate the file and report the conflicts, do not create the persons.')
+args = parser.parse_args()
+env = "development"
+if platform.node() == "zeegeus":
+    env = "production"
+app = create_app(env, tool=True)
+# Create app before import models_graph. Environment settings for Neo4J are required before import.
+from competition import models_graph as mg
+
+logging.info("Arguments: {a}".format(a=args))
+with app.app_context():
+    fmt = "json" if args.file.lower().endswith(".json") else "csv"
+    with open(args.file, encoding="utf-8-sig") as fh:
+        rows = mg.person_import_rows(fh.read(), fmt=fmt)
+    report = mg.person_import(rows, dry_run=args.dry_run)
+    for conflict in report["conflicts"]:
+        print("Line {line}: {name} - {reason}".format(**conflict))
+    print("{cnt} persons {action}, {c} conflicts."
+          .format(cnt=len(report["created"]), action="valid" if args.dry_run else "created",
+                  c=len(report["conflicts"])))
+logging.info("End Application")
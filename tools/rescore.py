@@ -0,0 +1,68 @@
+"""
+This script will recalculate the points for all races in a season, e.g. after a change in the scoring rules or in the
+category of a person. Races are calculated in parallel, changed points are written in batches. With dry-run the changed
+points are reported, but not written.
+"""
+
+import argparse
+import logging
+import platform
+from concurrent.futures import ThreadPoolExecutor
+from competition import create_app
+from lib import my_env
+
+parser = argparse.ArgumentParser(
+    description="Recalculate the points for all races in a season"
+)
+parser.add_argument('-s', '--season', type=str,
+                    help='Season to rescore, e.g. 2018-2019. Default is the current season.')
+parser.add_argument('-w', '--workers', type=int, default=4,
+                    help='Number of races that are calculated in parallel.')
+parser.add_argument('-b', '--batch', type=int, default=500,
+                    help='Number of participants that are updated in one write.')
+parser.add_argument('-n', '--dry-run', action='store_true',
+                    help='Report the changed points, do not update the participants.')
+args = parser.parse_args()
+env = "development"
+if platform.node() == "zeegeus":
+    env = "production"
+app = create_app(env, tool=True)
+# Create app before import models_graph. Environment settings for Neo4J are required before import.
+from competition import models_graph as mg
+
+
+def rescore_race(race_id):
+    # Worker threads need their own application context.
+    with app.app_context():
+        return mg.rescore_race(race_id)
+
+
+logging.info("Arguments: {a}".format(a=args))
+with app.app_context():
+    ns = mg.get_ns()
+    season = args.season or mg.current_season()
+    race_nids = ns.get_race_nids(season=season)
+    li = my_env.LoopInfo("races", 10)
+    diff = []
+    with ThreadPoolExecutor(max_workers=args.workers) as pool:
+        for race_diff in pool.map(rescore_race, race_nids):
+            diff.extend(race_diff)
+            li.info_loop()
+    li.end_loop()
+    if args.dry_run:
+        labels = {}
+        for rec in diff:
+            if rec["race_id"] not in labels:
+                labels[rec["race_id"]] = mg.Race(race_id=rec["race_id"]).get_label()
+            print("{race}: {name} {op} -> {p} points (position {orp} -> {rp})"
+                  .format(race=labels[rec["race_id"]], name=rec["person_name"], op=rec["old_points"],
+                          p=rec["points"], orp=rec["old_rel_pos"], rp=rec["rel_pos"]))
+        print("Season {s}: {cnt} participants would change in {r} races."
+              .format(s=season, cnt=len(diff), r=len(set(rec["race_id"] for rec in diff))))
+    else:
+        for pos in range(0, len(diff), args.batch):
+            ns.set_points(diff[pos:pos + args.batch])
+        ns.set_scoring_fingerprint(mg.scoring_rules.fingerprint)
+        print("Season {s}: {cnt} participants updated in {r} races."
+              .format(s=season, cnt=len(diff), r=len(set(rec["race_id"] for rec in diff))))
+logging.info("End Application")
@@ -0,0 +1,38 @@
+"""
+This script will manage the seasons. Action 'set' will set the season for organizations that do not have a season yet.
+Action 'archive' will freeze the standings of a finished season into a read-only archive.
+"""
+
+import argparse
+import logging
+import platform
+from competition import create_app
+
+parser = argparse.ArgumentParser(
+    description="Set seasons for organizations or archive the standings of a season"
+)
+parser.add_argument('-a', '--action', type=str, required=True, choices=['set', 'archive'],
+                    help='Please provide the (set, archive) action.')
+parser.add_argument('-s', '--season', type=str,
+                    help='Season to archive, e.g. 2018-2019.')
+args = parser.parse_args()
+env = "development"
+if platform.node() == "zeegeus":
+    env = "production"
+app = create_app(env, tool=True)
+# Create app before import models_graph. Environment settings for Neo4J are required before import.
+from competition import models_graph as mg
+
+logging.info("Arguments: {a}".format(a=args))
+with app.app_context():
+    if args.action == "set":
+        cnt = mg.get_ns().set_seasons(mg.season_start_month)
+        print("Season set for {cnt} organizations.".format(cnt=cnt))
+    else:
+        if not args.season:
+            parser.error("Season is required for action archive.")
+        if args.season == mg.current_season():
+            logging.warning("Archiving the current season {s}".format(s=args.season))
+        cnt = mg.season_archive(args.season)
+        print("Season {s} archived with {cnt} standings lines.".format(s=args.season, cnt=cnt))
+logging.info("End Application")
@@ -1,16 +1,98 @@
+import logging
+import os
 import platform
+import signal
+import socket
+import time
 from competition import create_app
+from config import config
 from waitress import serve
 
 
+def serve_workers(env, host, port, workers, threads):
+    """
+    This function will serve the application from multiple worker processes. The listening socket is opened before the
+    workers are forked, so all workers accept connections on the same port. Every worker creates its own application,
+    so that database connections are not shared between processes. Configure CACHE_PATH so that the workers share data
+    version and page cache. A worker that stops is replaced, until the launcher is terminated. A worker that stops soon
+    after start, e.g. because Neo4J is not available, is replaced after a delay that doubles for every next failure.
+
+    :param env: Configuration name.
+
+    :param host: Listen address.
+
+    :param port: Listen port.
+
+    :param workers: Number of worker processes.
+
+    :param threads: Number of request threads per worker process.
+
+    :return:
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(1024)
+    pids = {}
+    stopping = []
+    # Workers that run for less than min_uptime seconds count as failed start.
+    min_uptime = 30
+    max_delay = 300
+    failures = 0
+
+    def start_worker():
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            try:
+                serve(create_app(env), sockets=[sock], threads=threads)
+            except Exception:
+                logging.exception("Worker {pid} failed".format(pid=os.getpid()))
+                os._exit(1)
+            os._exit(0)
+        pids[pid] = time.time()
+
+    def stop(signum, frame):
+        stopping.append(signum)
+        for worker_pid in list(pids):
+            os.kill(worker_pid, signal.SIGTERM)
+
+    for _ in range(workers):
+        start_worker()
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    while pids:
+        (pid, status) = os.wait()
+        started = pids.pop(pid)
+        if stopping:
+            continue
+        if time.time() - started < min_uptime:
+            failures += 1
+        else:
+            failures = 0
+        delay = min(2 ** failures - 1, max_delay)
+        logging.error("Worker {pid} stopped with status {s}, start new worker in {d} seconds"
+                      .format(pid=pid, s=status, d=delay))
+        time.sleep(delay)
+        if not stopping:
+            start_worker()
+    sock.close()
+    return
+
+
 # Run Application
 if __name__ == "__main__":
     env = "development"
     if platform.node() == "zeegeus":
         env = "production"
-    app = create_app(env)
+    workers = getattr(config[env], 'WAITRESS_WORKERS', 1)
+    # Every live stream holds a request thread, the streams get threads of their own so that pages are still served.
+    threads = getattr(config[env], 'WAITRESS_THREADS', 4) + getattr(config[env], 'STREAM_MAX', 50)
 
     if env == "development":
-        app.run()
+        create_app(env).run()
+    elif workers > 1:
+        serve_workers(env, '127.0.0.1', 18103, workers, threads)
     else:
-        serve(app, listen='127.0.0.1:18103')
+        serve(create_app(env), listen='127.0.0.1:18103', threads=threads)